@@ -0,0 +1,158 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Start-up benchmark for the "excavate" command. Times "excavate --help" and a
+small SVG-to-SVG render in fresh interpreters, checks them against a time
+budget and checks that none of the heavy dependencies were imported along the
+way. Exits with a non-zero status if any check fails.
+
+    python benchmarks/import_time.py [--runs N] [--help-budget S] ...
+"""
+import argparse
+import os
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+# Modules that must not be loaded for "--help" or an SVG-only render
+HEAVY_MODULES = ('PIL', 'wand', 'cssutils', 'pkg_resources')
+
+# Modules that must not be loaded by "--help" (rendering SVG needs bs4)
+HELP_HEAVY_MODULES = HEAVY_MODULES + ('bs4', 'lxml')
+
+FLOORPLAN_SVG = b"""\
+<svg xmlns="http://www.w3.org/2000/svg" width="400" height="300">
+  <path d="M 20 20 L 380 20 L 380 280 L 20 280 Z"/>
+</svg>
+"""
+
+# Runs the command line entry point and reports which heavy modules it loaded
+RUNNER = """\
+import sys
+sys.argv = ['excavate'] + sys.argv[1:]
+from dumat.excavate import main
+try:
+    main()
+except SystemExit:
+    pass
+loaded = [m for m in {modules!r} if m in sys.modules]
+sys.stderr.write('LOADED:' + ','.join(loaded) + '\\n')
+"""
+
+
+def solid_png(width, height, rgb):
+    """ Returns the bytes of a solid colour PNG, without needing Pillow. """
+    def chunk(kind, data):
+        body = kind + data
+        return (
+            struct.pack('>I', len(data)) + body
+            + struct.pack('>I', zlib.crc32(body) & 0xffffffff)
+        )
+
+    row = b'\x00' + bytes(rgb) * width
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(row * height))
+        + chunk(b'IEND', b'')
+    )
+
+
+def time_command(args, modules, runs):
+    """
+    Runs the entry point with the given arguments in a fresh interpreter "runs"
+    times. Returns the median wall time and the heavy modules it loaded.
+    """
+    source = RUNNER.format(modules=modules)
+    timings = []
+    loaded = []
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, '-c', source] + args,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            check=True
+        )
+        timings.append(time.perf_counter() - start)
+
+        for line in proc.stderr.decode('utf-8', 'replace').splitlines():
+            if line.startswith('LOADED:'):
+                loaded = [m for m in line[len('LOADED:'):].split(',') if m]
+
+    return statistics.median(timings), loaded
+
+
+def check(name, elapsed, budget, loaded):
+    """ Prints the outcome of one benchmark. Returns True if it passed. """
+    passed = elapsed <= budget and not loaded
+    print('{:<12} {:7.3f}s (budget {:.3f}s) {}{}'.format(
+        name,
+        elapsed,
+        budget,
+        'ok' if passed else 'FAIL',
+        ' loaded: ' + ', '.join(loaded) if loaded else ''
+    ))
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument(
+        '--help-budget', type=float, default=0.25,
+        help="Time budget in seconds for 'excavate --help'")
+    parser.add_argument(
+        '--svg-budget', type=float, default=0.6,
+        help="Time budget in seconds for an SVG-only render")
+    args = parser.parse_args()
+
+    results = []
+
+    elapsed, loaded = time_command(['--help'], HELP_HEAVY_MODULES, args.runs)
+    results.append(check('--help', elapsed, args.help_budget, loaded))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = {
+            'ground': solid_png(64, 64, (120, 100, 80)),
+            'wall': solid_png(64, 64, (60, 60, 60)),
+            'floorplan': FLOORPLAN_SVG,
+        }
+
+        for name, data in paths.items():
+            with open(os.path.join(workdir, name), 'wb') as output:
+                output.write(data)
+
+        render_args = [
+            os.path.join(workdir, 'ground'),
+            os.path.join(workdir, 'wall'),
+            os.path.join(workdir, 'floorplan'),
+            os.path.join(workdir, 'map.svg'),
+        ]
+
+        elapsed, loaded = time_command(render_args, HEAVY_MODULES, args.runs)
+        results.append(check('svg render', elapsed, args.svg_budget, loaded))
+
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,314 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Rendering several rooms into one document (an atlas).
+
+Every room is built from the template as usual, and then its layers and clip
+paths are moved into the atlas, each room in its own layer, laid out on a
+grid. The things that are the same for every room - the ground and wall
+texture images and the wall shading filter - are only kept once, in the
+atlas's <defs>, and every room refers to them. The textures are prepared once
+for the largest room, so they are embedded (and base64 encoded) once however
+many rooms there are.
+
+The IDs of everything else a room has are prefixed with the room's ID (eg.
+"room-2-clip-path-floor"), so that the rooms don't clash.
+"""
+from contextlib import ExitStack
+from math import ceil, sqrt
+import re
+
+from dumat import buffers, encoders, excavate, textures
+from dumat.floorplan import PreparedFloorplan
+from dumat.memory import MemoryTracker
+
+# The template elements that are the same for every room, and so are shared
+SHARED_IDS = frozenset(('image-ground', 'image-wall', 'wall-boundary-filter'))
+
+# The space left between rooms, in tiles
+ROOM_GAP_TILES = 1
+
+# References to elements by ID in attribute values, eg. "url(#clip)"
+ID_REFERENCE = re.compile(r'#([\w.:-]+)')
+
+# The attributes that may refer to other elements
+REFERENCE_ATTRIBUTES = ('clip-path', 'filter', 'mask', 'style', 'xlink:href')
+
+
+def atlas_layout(sizes, columns=None, gap=0):
+    """
+    Places rooms of the given sizes on a grid, left to right and then top to
+    bottom. Each column is as wide as its widest room and each row as tall as
+    its tallest. Returns a list of the (x, y) position of each room, and the
+    (width, height) of the whole atlas.
+
+    @param sizes a list of the (width, height) of each room
+    @param columns the number of columns, or None for a roughly square grid
+    @param gap the space to leave between rooms
+    """
+    if not sizes:
+        raise ValueError('An atlas needs at least one room')
+
+    if columns is None:
+        columns = int(ceil(sqrt(len(sizes))))
+
+    if columns < 1:
+        raise ValueError('An atlas needs at least one column')
+
+    # Start rooms on whole px, so that their texture tiles line up with pixels
+    sizes = [(ceil(width), ceil(height)) for width, height in sizes]
+
+    column_widths = [0] * min(columns, len(sizes))
+    row_heights = [0] * int(ceil(len(sizes) / columns))
+
+    for number, (width, height) in enumerate(sizes):
+        row, column = divmod(number, columns)
+        column_widths[column] = max(column_widths[column], width)
+        row_heights[row] = max(row_heights[row], height)
+
+    column_x = [sum(column_widths[:n]) + n * gap for n in range(len(column_widths))]
+    row_y = [sum(row_heights[:n]) + n * gap for n in range(len(row_heights))]
+
+    positions = [
+        (column_x[column], row_y[row])
+        for row, column in (divmod(number, columns) for number in range(len(sizes)))
+    ]
+
+    total = (
+        column_x[-1] + column_widths[-1],
+        row_y[-1] + row_heights[-1],
+    )
+
+    return positions, total
+
+
+def _prefix_ids(elements, prefix):
+    """
+    Prefixes the IDs of the given elements and everything in them, other than
+    the shared ones, and updates their references to each other.
+    """
+    renamed = {}
+    tags = []
+
+    for element in elements:
+        tags.append(element)
+        tags.extend(element.find_all(True))
+
+    for tag in tags:
+        element_id = tag.get('id')
+        if element_id is not None and element_id not in SHARED_IDS:
+            renamed[element_id] = prefix + element_id
+            tag['id'] = renamed[element_id]
+
+    def rename(match):
+        return '#' + renamed.get(match.group(1), match.group(1))
+
+    for tag in tags:
+        for attribute in REFERENCE_ATTRIBUTES:
+            value = tag.get(attribute)
+
+            if value is None:
+                continue
+
+            if attribute == 'xlink:href' and not value.startswith('#'):
+                # An embedded image
+                continue
+
+            tag[attribute] = ID_REFERENCE.sub(rename, value)
+
+
+def render_atlas(
+        floorplans,
+        ground_data,
+        wall_data,
+        tile_size,
+        format='svg',
+        names=None,
+        columns=None,
+        report=None,
+        track_memory=False,
+        memory_budget=None,
+        tolerance=excavate.SIMPLIFY_TOLERANCE,
+        min_area=excavate.SIMPLIFY_MIN_AREA,
+        seed=None,
+        shading='filter',
+        quality=None,
+        compression_level=None,
+        texture_format=textures.ORIGINAL_FORMAT,
+        scale=1.0):
+    """
+    Renders several floorplans with the same textures into one map, each room
+    in its own layer. Returns the image data and MIME type (or a list of them,
+    if "format" is a list), as for excavate.render_room().
+
+    @param floorplans a list of floorplans, each a PreparedFloorplan, a file
+           name or a buffer of floorplan data (see excavate.render_room)
+    @param names a label for each room's layer, or None to number them
+    @param columns the number of columns of rooms, or None for a roughly
+           square grid
+    @param report if not None, a dictionary that is filled in with statistics
+           about the render; report['rooms'] has the position, size and
+           statistics of each room
+    The other arguments are as for excavate.render_room().
+    """
+    encoders.parse_formats(format)
+    excavate.check_scale(scale)
+
+    if names is None:
+        names = ['Room {}'.format(number + 1) for number in range(len(floorplans))]
+
+    if len(names) != len(floorplans):
+        raise ValueError('There must be one name for each floorplan')
+
+    if scale < 1:
+        # As for render_room()
+        tolerance /= scale
+
+    tracker = MemoryTracker(budget=memory_budget, enabled=track_memory)
+
+    with ExitStack() as inputs, tracker:
+        ground_data, wall_data = (
+            inputs.enter_context(buffers.input_buffer(source))
+            for source in (ground_data, wall_data)
+        )
+
+        rooms = []
+
+        for floorplan in floorplans:
+            if not isinstance(floorplan, PreparedFloorplan):
+                with buffers.input_buffer(floorplan) as clip_data:
+                    with tracker.stage('trace'):
+                        floorplan = excavate.prepare_floorplan(
+                            clip_data,
+                            tolerance,
+                            min_area
+                        )
+
+            rooms.append(floorplan)
+
+        positions, (width, height) = atlas_layout(
+            [(room.width, room.height) for room in rooms],
+            columns,
+            ROOM_GAP_TILES * tile_size
+        )
+
+        # Textures only need to cover the biggest room
+        with tracker.stage('textures'):
+            dimensions = (
+                max(room.width for room in rooms),
+                max(room.height for room in rooms),
+            )
+            embedded_textures = {
+                name: excavate.embed_texture(data, dimensions, texture_format, scale)
+                for name, data in (('ground', ground_data), ('wall', wall_data))
+            }
+
+        atlas_doc = None
+        room_reports = []
+
+        # The rooms' biggest paths, written as the atlas is serialised
+        deferred_paths = {}
+
+        for number, (room, name, (x, y)) in enumerate(zip(rooms, names, positions)):
+            room_report = {} if report is not None else None
+
+            room_doc = excavate.build_room_document(
+                room,
+                ground_data,
+                wall_data,
+                tile_size,
+                tracker=tracker,
+                report=room_report,
+                seed=seed,
+                shading=shading,
+                texture_format=texture_format,
+                embedded_textures=embedded_textures,
+                scale=scale,
+                deferred_paths=deferred_paths)
+
+            if atlas_doc is None:
+                # The first room's document becomes the atlas, and its shared
+                # definitions are the ones that are kept
+                atlas_doc = room_doc
+
+            room_id = 'room-{}'.format(number + 1)
+
+            clip_paths = [
+                clip_path.extract()
+                for clip_path in room_doc.find('defs').find_all('clipPath')
+            ]
+            layers = [
+                layer.extract()
+                for layer in room_doc.find('svg').find_all('g', recursive=False)
+            ]
+
+            _prefix_ids(clip_paths + layers, room_id + '-')
+
+            atlas_defs = atlas_doc.find('defs')
+            for clip_path in clip_paths:
+                atlas_defs.append(clip_path)
+
+            room_layer = atlas_doc.new_tag(
+                'g',
+                id=room_id,
+                transform='translate({},{})'.format(x, y),
+                **{
+                    'inkscape:groupmode': 'layer',
+                    'inkscape:label': name,
+                }
+            )
+            for layer in layers:
+                room_layer.append(layer)
+
+            atlas_doc.find('svg').append(room_layer)
+
+            if room_report is not None:
+                room_report.pop('texture_bytes', None)
+                room_report.update(
+                    name=name,
+                    x=x,
+                    y=y,
+                    width=room.width,
+                    height=room.height
+                )
+                room_reports.append(room_report)
+
+        svg_doc = atlas_doc.find('svg')
+        svg_doc['width'] = width * scale
+        svg_doc['height'] = height * scale
+
+        if scale != 1:
+            svg_doc['viewBox'] = '0 0 {} {}'.format(width, height)
+
+        if report is not None:
+            report['rooms'] = room_reports
+            report['texture_bytes'] = sum(
+                embedded[2] for embedded in embedded_textures.values()
+            )
+
+        rendered = excavate.encode_document(
+            atlas_doc,
+            format,
+            tracker,
+            quality,
+            compression_level,
+            deferred_paths
+        )
+
+    if report is not None and tracker.enabled:
+        report['memory'] = tracker.stages
+
+    return rendered
@@ -0,0 +1,296 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Fitting a render into a time budget.
+
+The cost of a render is estimated from the things that dominate it: the number
+of nodes in the hand drawn outline, and the number of pixels to rasterise (and
+blur, if the wall shading is left to the SVG filter). If the estimate is over
+the budget, the quality is lowered one step at a time until it fits, in this
+order:
+
+    outline detail  longer straight segments in the outline (see
+                    floorplan.outline_spacing), down to MIN_OUTLINE_DETAIL
+    baked shading   the wall shading is baked, rather than blurred by the
+                    rasteriser (only if NumPy is installed)
+    scale           the map is rasterised smaller, down to MIN_BUDGET_SCALE
+
+A step is only taken if it saves enough to be worth it.
+
+The costs per node and per pixel below are heuristics, measured once on one
+machine. To carry them over to the machine doing the render, the first plan in
+each process times a small probe (outlining PROBE_FLOOR, which is the same
+work as the outline stage) and scales every cost by how much slower or faster
+that was than on the reference machine (see machine_factor). The raster costs
+are scaled the same way, which assumes ImageMagick is slower or faster by
+about the same amount as Python. The estimates are still rough; the budget is
+a target, not a guarantee.
+"""
+from importlib.util import find_spec
+from math import hypot
+import time
+
+from dumat import cubicsuperpath, excavate
+from dumat.floorplan import PreparedFloorplan, outline_spacing
+
+# Rough costs on the reference machine. They only need to be the right order
+# of magnitude to pick sensible degradations.
+
+# Loading the template, embedding the textures and serialising the document
+FIXED_SECONDS = 0.05
+
+# Densifying, jittering and writing out one node of the outline
+OUTLINE_SECONDS_PER_NODE = 20e-6
+
+# Rasterising and encoding one output pixel
+RASTER_SECONDS_PER_PIXEL = 100e-9
+
+# The SVG filter's blurs, per output pixel and per px of blur
+FILTER_SECONDS_PER_PIXEL = 30e-9
+
+# Baking the wall shading, per output pixel
+BAKE_SECONDS_PER_PIXEL = 400e-9
+
+# How far each kind of degradation can go
+MIN_OUTLINE_DETAIL = 1 / 16
+MIN_BUDGET_SCALE = 1 / 8
+
+# A degradation has to save at least this fraction of the estimated time to be
+# used
+MIN_SAVING = 0.1
+
+# The calibration probe: the floor that is outlined (a few dozen nodes, a few
+# milliseconds of work), with the tile size to outline it for
+PROBE_FLOOR = (
+    'M 0,0 L 400,0 C 500,0 500,300 400,300 L 0,300 Z '
+    'M 600,0 L 700,0 L 700,100 Z'
+)
+PROBE_TILE_SIZE = 50
+
+# The probe is run this many times and the quickest is kept, to leave out
+# interruptions
+PROBE_RUNS = 3
+
+# How long the probe takes on the reference machine, in seconds
+PROBE_REFERENCE_SECONDS = 0.005
+
+# The machine factor is kept within these limits, so that one badly timed
+# probe can't throw the plan out completely
+MIN_MACHINE_FACTOR = 0.25
+MAX_MACHINE_FACTOR = 8.0
+
+# The machine factor once it has been measured in this process
+_machine_factor = None
+
+
+def probe_seconds():
+    """ Times the calibration probe, returning the quickest run in seconds. """
+    floor = cubicsuperpath.parsePath(PROBE_FLOOR)
+    runs = []
+
+    for _ in range(PROBE_RUNS):
+        # A new floorplan each time, so that nothing is reused between runs
+        prepared = PreparedFloorplan(800, 400, floor, [])
+        start = time.perf_counter()
+        prepared.outline(
+            PROBE_TILE_SIZE,
+            excavate.JITTER_SCALE * PROBE_TILE_SIZE,
+            seed=0
+        )
+        runs.append(time.perf_counter() - start)
+
+    return min(runs)
+
+
+def machine_factor():
+    """
+    Returns how many times longer this machine takes to do the same work as
+    the reference machine (below 1 if it's quicker). This is measured with
+    the calibration probe the first time it's needed in each process.
+    """
+    global _machine_factor
+
+    if _machine_factor is None:
+        factor = probe_seconds() / PROBE_REFERENCE_SECONDS
+        _machine_factor = min(
+            max(factor, MIN_MACHINE_FACTOR),
+            MAX_MACHINE_FACTOR
+        )
+
+    return _machine_factor
+
+
+def outline_stats(p):
+    """
+    Returns the total length of the straight lines between the nodes of a
+    cubicsuperpath, and the number of them. Densifying adds about one node per
+    outline spacing of length.
+    """
+    length = 0.0
+    segments = 0
+
+    for subpath in p:
+        for sp1, sp2 in zip(subpath, subpath[1:]):
+            length += hypot(sp2[1][0] - sp1[1][0], sp2[1][1] - sp1[1][1])
+        segments += len(subpath)
+
+    return length, segments
+
+
+def estimate_seconds(
+        stats,
+        tile_size,
+        raster,
+        shading,
+        scale,
+        detail,
+        factor=1.0):
+    """
+    Returns the estimated time in seconds to render a map.
+
+    @param stats a dictionary of the 'length' and 'segments' of the floor (see
+           outline_stats) and the 'area' to draw in floorplan px^2
+    @param raster whether the map will be rasterised
+    @param factor how many times longer the work takes than on the reference
+           machine (see machine_factor)
+    """
+    spacing = outline_spacing(
+        tile_size,
+        excavate.JITTER_SCALE * tile_size,
+        scale,
+        detail
+    )
+
+    nodes = stats['segments']
+    if spacing is not None:
+        nodes += stats['length'] / spacing
+
+    seconds = FIXED_SECONDS + nodes * OUTLINE_SECONDS_PER_NODE
+    pixels = stats['area'] * scale ** 2
+
+    if shading == 'baked':
+        seconds += pixels * BAKE_SECONDS_PER_PIXEL
+
+    if raster:
+        seconds += pixels * RASTER_SECONDS_PER_PIXEL
+
+        if shading == 'filter':
+            blur = (
+                excavate.BLUR_INSIDE_WIDTH + excavate.BLUR_OUTSIDE_WIDTH
+            ) * tile_size * scale
+            seconds += pixels * blur * FILTER_SECONDS_PER_PIXEL
+
+    return seconds * factor
+
+
+def plan_render(
+        prepared,
+        tile_size,
+        raster,
+        shading,
+        scale,
+        budget,
+        region=None,
+        factor=None):
+    """
+    Works out how to render a prepared floorplan in about "budget" seconds.
+    Returns a dictionary of the 'shading', 'scale' and outline 'detail' to
+    render with, the 'estimated_seconds' that will take and the list of
+    'degradations' that were needed (eg. ['outline_detail=0.25']).
+
+    @param raster whether the map will be rasterised; only then do the shading
+           and scale affect the render time
+    @param shading the shading mode that was asked for
+    @param scale the scale that was asked for
+    @param region if not None, the (x, y, width, height) that will be drawn
+    @param factor how many times longer the work takes than on the reference
+           machine, or None to measure it (see machine_factor)
+    """
+    if factor is None:
+        factor = machine_factor()
+
+    if region is None:
+        floor = prepared.floor
+        area = prepared.width * prepared.height
+    else:
+        x, y, width, height = region
+        padding = excavate.shading_padding(tile_size)
+        floor = [
+            prepared.floor[number]
+            for number in prepared.subpaths_in((
+                x - padding,
+                y - padding,
+                x + width + padding,
+                y + height + padding,
+            ))
+        ]
+        area = width * height
+
+    length, segments = outline_stats(floor)
+    stats = {'length': length, 'segments': segments, 'area': area}
+
+    plan = {'shading': shading, 'scale': scale, 'detail': 1.0}
+    can_bake = raster and shading == 'filter' and find_spec('numpy') is not None
+
+    def estimate(settings):
+        return estimate_seconds(
+            stats,
+            tile_size,
+            raster,
+            settings['shading'],
+            settings['scale'],
+            settings['detail'],
+            factor
+        )
+
+    seconds = estimate(plan)
+
+    while seconds > budget:
+        steps = []
+
+        if plan['detail'] > MIN_OUTLINE_DETAIL:
+            steps.append(dict(plan, detail=plan['detail'] / 2))
+
+        if can_bake and plan['shading'] == 'filter':
+            steps.append(dict(plan, shading='baked'))
+
+        if raster and plan['scale'] > MIN_BUDGET_SCALE:
+            steps.append(dict(plan, scale=max(plan['scale'] / 2, MIN_BUDGET_SCALE)))
+
+        for step in steps:
+            step_seconds = estimate(step)
+            if step_seconds <= seconds * (1 - MIN_SAVING):
+                plan, seconds = step, step_seconds
+                break
+        else:
+            # Nothing left that helps enough
+            break
+
+    degradations = []
+
+    if plan['detail'] != 1:
+        degradations.append('outline_detail={:g}'.format(plan['detail']))
+
+    if plan['shading'] != shading:
+        degradations.append('shading={}'.format(plan['shading']))
+
+    if plan['scale'] != scale:
+        degradations.append('scale={:g}'.format(plan['scale']))
+
+    plan['estimated_seconds'] = seconds
+    plan['degradations'] = degradations
+
+    return plan
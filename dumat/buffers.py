@@ -0,0 +1,128 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Loading inputs without copying them.
+
+Textures and floorplans can be very large, and reading a file into a byte
+string, wrapping it in a BytesIO and so on makes a copy in memory each time.
+Instead, files are memory mapped and handed around as memoryviews, which
+Pillow (through BufferReader), base64 and the pipe to 'potrace' can all read
+from directly.
+"""
+from contextlib import contextmanager
+import io
+import mmap
+import os
+
+
+def is_path(source):
+    """ Returns True if an input is a file name rather than a buffer. """
+    return isinstance(source, (str, os.PathLike))
+
+
+@contextmanager
+def mapped_file(path):
+    """
+    Memory maps a file for reading, and yields a memoryview of its contents.
+    The mapping is closed afterwards, unless something still holds a view of
+    it (in which case it is closed when that goes away).
+    """
+    with open(path, 'rb') as source:
+        if os.fstat(source.fileno()).st_size == 0:
+            # Empty files can't be mapped
+            yield memoryview(b'')
+            return
+
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(mapped)
+
+    try:
+        yield view
+    finally:
+        try:
+            view.release()
+            mapped.close()
+        except BufferError:
+            # Eg. a texture that was embedded as it is
+            pass
+
+
+@contextmanager
+def input_buffer(source):
+    """
+    Yields the contents of an input: a file name is memory mapped (see
+    mapped_file), byte strings are used as they are and anything else that
+    supports the buffer protocol is viewed as bytes.
+    """
+    if is_path(source):
+        with mapped_file(source) as view:
+            yield view
+    elif isinstance(source, bytes):
+        yield source
+    else:
+        with memoryview(source) as view:
+            yield view.cast('B')
+
+
+class BufferReader(io.RawIOBase):
+    """
+    A read-only file object over a buffer, for libraries like Pillow that
+    want a file. Unlike BytesIO, it doesn't copy the buffer.
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+
+        if offset < 0:
+            raise ValueError("Negative seek position {}".format(offset))
+
+        self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+def open_image(data):
+    """ Opens image data with Pillow without copying it. """
+    from PIL import Image
+
+    return Image.open(BufferReader(data))
@@ -0,0 +1,369 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+A cache of finished renders, so that repeating a render with exactly the same
+inputs and options just returns the earlier result.
+
+Entries are keyed by a SHA-256 hash of the input data and every option that
+affects the output. There are two tiers, both evicting the least recently used
+entries once they go over their size limit: one in memory, and optionally one
+on disk (which can be shared between processes and kept between runs).
+
+The outline jitter is random unless it is seeded, so cached renders always
+use a seed (DEFAULT_SEED if none is given); otherwise a cached result would be
+no more correct than any other render.
+
+A render with a time budget may come out at a lower quality, depending on how
+fast the machine was at the time (see dumat.budget). Those renders are never
+stored, and the budget isn't part of the key: a full quality render that is
+already in the cache is the best answer to any budget.
+"""
+from collections import OrderedDict
+from contextlib import ExitStack
+import hashlib
+import json
+import os
+import tempfile
+
+from dumat import buffers, encoders, excavate
+
+# Bump this when a change to the renderer changes its output, so that old
+# cache entries aren't used
+CACHE_VERSION = 1
+
+# Default size limits for the tiers in bytes
+MEMORY_CACHE_SIZE = 64 * 1024 * 1024
+DISK_CACHE_SIZE = 1024 * 1024 * 1024
+
+# The seed used for cached renders that don't give one
+DEFAULT_SEED = 0
+
+# Disk entries are named after their key, with this extension
+ENTRY_EXTENSION = '.render'
+
+# Render options that don't go into the cache key (see above)
+UNKEYED_OPTIONS = frozenset(('time_budget',))
+
+
+class RenderCache(object):
+    """
+    Stores rendered maps (the data and MIME type) by key. Use key() to make
+    a key from the render inputs and options.
+    """
+
+    def __init__(
+            self,
+            directory=None,
+            memory_size=MEMORY_CACHE_SIZE,
+            disk_size=DISK_CACHE_SIZE):
+        """
+        @param directory the directory for the disk tier, or None to only
+               cache in memory; it is created if necessary
+        @param memory_size the most bytes to keep in memory (0 to disable the
+               memory tier)
+        @param disk_size the most bytes to keep on disk
+        """
+        self.directory = directory
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+
+        self._memory = OrderedDict()
+        self._memory_used = 0
+
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+        }
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(inputs, options):
+        """
+        Returns the key for a render of the given input buffers with the given
+        options (a dictionary of JSON-serialisable values).
+        """
+        key = hashlib.sha256()
+        key.update(str(CACHE_VERSION).encode('ascii'))
+
+        for data in inputs:
+            key.update(hashlib.sha256(data).digest())
+
+        key.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+
+        return key.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the (data, MIME type) stored for a key, or None if there isn't
+        anything.
+        """
+        return self.lookup(key)[0]
+
+    def lookup(self, key):
+        """
+        As for get(), but returns a tuple of the entry and which tier it came
+        from ('memory', 'disk' or None if it was a miss).
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.stats['memory_hits'] += 1
+            return self._memory[key], 'memory'
+
+        if self.directory is not None:
+            path = self._entry_path(key)
+
+            try:
+                with open(path, 'rb') as source:
+                    mime_type, _, data = source.read().partition(b'\n')
+            except FileNotFoundError:
+                pass
+            else:
+                # Mark it as recently used
+                os.utime(path)
+
+                entry = (data, mime_type.decode('ascii'))
+                self._remember(key, entry)
+                self.stats['disk_hits'] += 1
+                return entry, 'disk'
+
+        self.stats['misses'] += 1
+        return None, None
+
+    def put(self, key, data, mime_type):
+        """ Stores a render. """
+        data = bytes(data)
+        self._remember(key, (data, mime_type))
+        self.stats['stores'] += 1
+
+        if self.directory is not None:
+            # Write to a temporary file first, so other processes never see a
+            # partly written entry
+            fd, temp_path = tempfile.mkstemp(dir=self.directory)
+
+            try:
+                with os.fdopen(fd, 'wb') as output:
+                    output.write(mime_type.encode('ascii') + b'\n' + data)
+                os.replace(temp_path, self._entry_path(key))
+            finally:
+                # Only still there if it couldn't be written or moved
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+            self._evict_disk()
+
+    def metrics(self):
+        """ Returns the hit and miss counts, and the overall hit rate. """
+        metrics = dict(self.stats)
+        hits = metrics['memory_hits'] + metrics['disk_hits']
+        lookups = hits + metrics['misses']
+        metrics['hit_rate'] = hits / lookups if lookups else 0.0
+        return metrics
+
+    def clear(self):
+        """ Removes every entry from both tiers. """
+        self._memory.clear()
+        self._memory_used = 0
+
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(ENTRY_EXTENSION):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _entry_path(self, key):
+        """ Returns the path of the disk entry for a key. """
+        return os.path.join(self.directory, key + ENTRY_EXTENSION)
+
+    def _remember(self, key, entry):
+        """ Adds an entry to the memory tier, evicting old ones to fit. """
+        size = len(entry[0])
+
+        if size > self.memory_size:
+            return
+
+        if key in self._memory:
+            self._memory_used -= len(self._memory.pop(key)[0])
+
+        self._memory[key] = entry
+        self._memory_used += size
+
+        while self._memory_used > self.memory_size:
+            _, (old_data, _) = self._memory.popitem(last=False)
+            self._memory_used -= len(old_data)
+            self.stats['evictions'] += 1
+
+    def _evict_disk(self):
+        """ Removes the least recently used disk entries to fit the limit. """
+        entries = []
+        used = 0
+
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ENTRY_EXTENSION):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                used += stat.st_size
+
+        entries.sort()
+
+        for _, size, path in entries:
+            if used <= self.disk_size:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another process got to it first
+                pass
+
+            used -= size
+            self.stats['evictions'] += 1
+
+
+def render_options(**options):
+    """
+    Returns the options of a render as they are used in the cache: any seed
+    that isn't given is replaced with DEFAULT_SEED.
+    """
+    if options.get('seed') is None:
+        options['seed'] = DEFAULT_SEED
+
+    return options
+
+
+def cached_formats(cache, inputs, options, formats, render, report=None):
+    """
+    Looks up a render in each of the given formats, and calls "render" with a
+    list of the formats that weren't cached and a report dictionary to render
+    the rest. They are then stored, unless the report says the render had to
+    be degraded to fit a time budget. Returns a list of the (data, MIME type)
+    for each format, and a list of where each came from ('memory', 'disk' or
+    None if it was a miss).
+
+    @param inputs the input buffers, as for RenderCache.key()
+    @param options the other render options, as for RenderCache.key(); any
+           UNKEYED_OPTIONS are left out of the key
+    @param report the report to pass to "render", or None to pass it one
+           that is then thrown away
+    """
+    options = {
+        name: value for name, value in options.items()
+        if name not in UNKEYED_OPTIONS
+    }
+    keys = [cache.key(inputs, dict(options, format=spec)) for spec in formats]
+
+    results = []
+    sources = []
+
+    for key in keys:
+        cached, source = cache.lookup(key)
+        results.append(cached)
+        sources.append(source)
+
+    missing = [number for number, result in enumerate(results) if result is None]
+
+    if missing:
+        render_report = {} if report is None else report
+        rendered = render([formats[number] for number in missing], render_report)
+        degraded = bool(render_report.get('degradations'))
+
+        for number, result in zip(missing, rendered):
+            if not degraded:
+                cache.put(keys[number], *result)
+            results[number] = result
+
+    return results, sources
+
+
+def report_sources(report, format, sources):
+    """
+    Adds where each format came from (see cached_formats) to the report, if
+    there is one: 'memory', 'disk' or 'miss', or a dictionary of them by format
+    if there were several.
+    """
+    if report is None:
+        return
+
+    sources = [source or 'miss' for source in sources]
+
+    if isinstance(format, str):
+        report['cache'] = sources[0]
+    else:
+        report['cache'] = dict(zip(format, sources))
+
+
+def cached_render_room(
+        cache,
+        ground_data,
+        wall_data,
+        clip_data,
+        tile_size,
+        format,
+        report=None,
+        track_memory=False,
+        memory_budget=None,
+        **options):
+    """
+    As for excavate.render_room(), but returns the result from the cache if
+    the same render has been done before, and stores it otherwise. If no seed
+    is given, DEFAULT_SEED is used. The report says whether it was a 'memory'
+    or 'disk' hit or a 'miss'. If several formats are given, each is cached
+    separately and only the missing ones are rendered. Renders that were
+    degraded to fit a time budget aren't stored.
+
+    @param options the other keyword arguments for render_room(); all of them
+           are part of the cache key
+    """
+    options = render_options(**options)
+    formats = encoders.parse_formats(format)
+
+    with ExitStack() as inputs:
+        ground_data, wall_data, clip_data = (
+            inputs.enter_context(buffers.input_buffer(source))
+            for source in (ground_data, wall_data, clip_data)
+        )
+
+        def render(missing, render_report):
+            return excavate.render_room(
+                ground_data,
+                wall_data,
+                clip_data,
+                tile_size,
+                missing,
+                report=render_report,
+                track_memory=track_memory,
+                memory_budget=memory_budget,
+                **options
+            )
+
+        results, sources = cached_formats(
+            cache,
+            (ground_data, wall_data, clip_data),
+            dict(options, tile_size=tile_size),
+            formats,
+            render,
+            report
+        )
+
+    report_sources(report, format, sources)
+
+    if isinstance(format, str):
+        return results[0]
+
+    return results
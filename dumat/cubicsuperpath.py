@@ -15,6 +15,7 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 from dumat import simplepath 
+import itertools
 from math import *
 
 def matprod(mlist):
@@ -93,8 +94,12 @@ def ArcToPath(p1,params):
     return(p)
     
 def CubicSuperPath(simplepath):
-    csp = []
-    subpath = -1
+    return list(iterSubpaths(simplepath))
+
+def iterSubpaths(simplepath):
+    # Added by JH: as for CubicSuperPath, but takes any iterable of segments
+    # and yields each subpath as soon as it is complete
+    subpath = None
     subpathstart = []
     last = []
     lastctrl = []
@@ -102,18 +107,18 @@ def CubicSuperPath(simplepath):
         cmd, params = s        
         if cmd == 'M':
             if last:
-                csp[subpath].append([lastctrl[:],last[:],last[:]])
-            subpath += 1
-            csp.append([])
+                subpath.append([lastctrl[:],last[:],last[:]])
+                yield subpath
+            subpath = []
             subpathstart =  params[:]
             last = params[:]
             lastctrl = params[:]
         elif cmd == 'L':
-            csp[subpath].append([lastctrl[:],last[:],last[:]])
+            subpath.append([lastctrl[:],last[:],last[:]])
             last = params[:]
             lastctrl = params[:]
         elif cmd == 'C':
-            csp[subpath].append([lastctrl[:],last[:],params[:2]])
+            subpath.append([lastctrl[:],last[:],params[:2]])
             last = params[-2:]
             lastctrl = params[2:4]
         elif cmd == 'Q':
@@ -128,7 +133,7 @@ def CubicSuperPath(simplepath):
             y1=1./3*q0[1]+2./3*q1[1]
             y2=           2./3*q1[1]+1./3*q2[1]
             y3=                           q2[1]
-            csp[subpath].append([lastctrl[:],[x0,y0],[x1,y1]])
+            subpath.append([lastctrl[:],[x0,y0],[x1,y1]])
             last = [x3,y3]
             lastctrl = [x2,y2]
         elif cmd == 'A':
@@ -136,35 +141,63 @@ def CubicSuperPath(simplepath):
             arcp[ 0][0]=lastctrl[:]
             last=arcp[-1][1]
             lastctrl = arcp[-1][0]
-            csp[subpath]+=arcp[:-1]
+            subpath+=arcp[:-1]
         elif cmd == 'Z':
-            csp[subpath].append([lastctrl[:],last[:],last[:]])
+            subpath.append([lastctrl[:],last[:],last[:]])
             last = subpathstart[:]
             lastctrl = subpathstart[:]
     #append final superpoint
-    csp[subpath].append([lastctrl[:],last[:],last[:]])
-    return csp    
+    if subpath is not None:
+        subpath.append([lastctrl[:],last[:],last[:]])
+        yield subpath
+
+def isLine(sp1, sp2):
+    # Added by JH: L segments are stored with their control points on the
+    # nodes, so they can be recognised (and written out) as lines again
+    return sp1[2] == sp1[1] and sp2[0] == sp2[1]
 
 def unCubicSuperPath(csp):
-    a = []
+    return list(iterSegments(csp))
+
+def iterSegments(csp):
+    # Added by JH: as for unCubicSuperPath, but takes any iterable of subpaths
+    # and yields the segments one at a time
     for subpath in csp:
         if subpath:
-            a.append(['M',subpath[0][1][:]])
+            yield ['M',subpath[0][1][:]]
             for i in range(1,len(subpath)):
-                a.append(['C',subpath[i-1][2][:] + subpath[i][0][:] + subpath[i][1][:]])
-    return a
+                if isLine(subpath[i-1], subpath[i]):
+                    yield ['L',subpath[i][1][:]]
+                else:
+                    yield ['C',subpath[i-1][2][:] + subpath[i][0][:] + subpath[i][1][:]]
 
 def parsePath(d):
-    return CubicSuperPath(simplepath.parsePath(d))
+    return CubicSuperPath(simplepath.iterPath(d))
+
+def iterParsePath(d):
+    # Added by JH: yields the subpaths of path data one at a time
+    return iterSubpaths(simplepath.iterPath(d))
 
 def formatPath(p, terminate=False):
     # Modified by JH to add 'Z' termination when needed
-    simple_path = unCubicSuperPath(p)
-    
+    return "".join(iterFormatPath(p, terminate))
+
+def iterFormatPath(p, terminate=False):
+    # Added by JH: as for formatPath, but takes any iterable of subpaths and
+    # yields the path data a segment at a time
+    segments = iterSegments(p)
+
     if terminate:
-        simple_path.append(['Z', []])
-    
-    return simplepath.formatPath(simple_path)
+        segments = itertools.chain(segments, [['Z', []]])
+
+    return simplepath.iterFormatPath(segments)
+
+def writePath(p, sink, terminate=False):
+    # Added by JH: writes the path data for an iterable of subpaths to a file
+    # like object as it is made, so that the whole string never has to be held
+    # in memory
+    for chunk in iterFormatPath(p, terminate):
+        sink.write(chunk)
 
 
 
@@ -0,0 +1,366 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Output encoders for rendered maps.
+
+Raster formats are made in two steps: the map SVG is rasterised once (with
+ImageMagick, via wand) into a Pillow image, and the image is then encoded. Each
+encoder is registered under a format name with a set of presets that trade
+encoding time against output size:
+
+    default  the settings used if no preset is given
+    fast     least CPU time, bigger files
+    small    smallest files, more CPU time
+
+A format is given as "name" or "name:preset", eg. "webp:small". Quality and
+compression level can also be given explicitly, and override the preset. When
+one render is encoded in several formats, it is only rasterised once.
+"""
+from io import BytesIO
+
+# The registry of encoders, by format name. See register_encoder().
+ENCODERS = {}
+
+PRESETS = ('default', 'fast', 'small')
+
+# The compression levels any encoder accepts (zlib's; WebP only goes to 6 and
+# treats higher levels as 6)
+MAX_COMPRESSION_LEVEL = 9
+
+# Pillow's fast octree quantiser, which was a plain integer constant before
+# Image.Quantize was added in Pillow 9.1
+FASTOCTREE = 2
+
+
+def register_encoder(
+        name,
+        encode,
+        mime_type,
+        raster=True,
+        presets=None,
+        extension=None,
+        quality_range=None):
+    """
+    Adds an output format.
+
+    @param name the format name, as given to render_room() or on the command
+           line
+    @param encode a function that takes a Pillow image (or the SVG data, if
+           "raster" is False) and keyword options, and returns the encoded
+           bytes
+    @param mime_type the MIME type of the encoded data
+    @param raster whether the map has to be rasterised before encoding
+    @param presets a dictionary of preset name to the keyword options for
+           "encode"; presets that aren't given use the encoder's defaults
+    @param extension the file name extension for the format, if it isn't the
+           same as the name
+    @param quality_range the lowest and highest quality the encoder accepts,
+           or None if it has no quality setting (and ignores it)
+    """
+    presets = dict(presets or {})
+
+    for preset, options in presets.items():
+        if preset not in PRESETS:
+            raise ValueError("Unknown preset '{}'".format(preset))
+
+        _check_quality(name, quality_range, options.get('quality'))
+
+    ENCODERS[name] = {
+        'encode': encode,
+        'mime_type': mime_type,
+        'raster': raster,
+        'presets': presets,
+        'extension': extension or name,
+        'quality_range': quality_range,
+    }
+
+
+def parse_format(spec):
+    """
+    Splits a "name" or "name:preset" format into the format name and preset.
+    Raises ValueError if either is unknown.
+    """
+    name, _, preset = spec.partition(':')
+    preset = preset or 'default'
+
+    if name not in ENCODERS:
+        raise ValueError("Unknown format '{}'".format(name))
+
+    if preset not in PRESETS:
+        raise ValueError("Unknown preset '{}'".format(preset))
+
+    return name, preset
+
+
+def parse_formats(format):
+    """
+    Returns a list of formats from a single format or a sequence of them (to
+    encode one render several ways), checking each with parse_format().
+    """
+    formats = [format] if isinstance(format, str) else list(format)
+
+    if not formats:
+        raise ValueError("No output format given")
+
+    for spec in formats:
+        parse_format(spec)
+
+    return formats
+
+
+def is_raster(spec):
+    """ Returns True if the format has to be rasterised. """
+    name, _ = parse_format(spec)
+    return ENCODERS[name]['raster']
+
+
+def extension(spec):
+    """ Returns the file name extension for a format. """
+    name, _ = parse_format(spec)
+    return ENCODERS[name]['extension']
+
+
+def quality_range(spec):
+    """
+    Returns the lowest and highest quality a format accepts, or None if it has
+    no quality setting.
+    """
+    name, _ = parse_format(spec)
+    return ENCODERS[name]['quality_range']
+
+
+def check_quality(spec, quality):
+    """
+    Raises ValueError if a quality is outside the range the format accepts.
+    None is always accepted, as is any quality for a format without a quality
+    setting (so that one quality can be given for several formats).
+    """
+    name, _ = parse_format(spec)
+    _check_quality(name, ENCODERS[name]['quality_range'], quality)
+
+
+def _check_quality(name, valid_range, quality):
+    """ As for check_quality(), for a format name and its quality range. """
+    if quality is None or valid_range is None:
+        return
+
+    low, high = valid_range
+
+    if not low <= quality <= high:
+        raise ValueError(
+            "Quality for {} must be from {} to {}, not {}".format(
+                name,
+                low,
+                high,
+                quality
+            )
+        )
+
+
+def encoder_options(name, preset='default', quality=None, compression_level=None):
+    """
+    Returns the keyword options for an encoder: the preset's, with any
+    explicitly given quality or compression level on top.
+    """
+    options = dict(ENCODERS[name]['presets'].get(preset, {}))
+
+    check_compression_level(compression_level)
+    _check_quality(name, ENCODERS[name]['quality_range'], quality)
+
+    if quality is not None:
+        options['quality'] = quality
+
+    if compression_level is not None:
+        options['compression_level'] = compression_level
+
+    return options
+
+
+def check_compression_level(compression_level):
+    """
+    Raises ValueError if a compression level isn't None or 0 to
+    MAX_COMPRESSION_LEVEL.
+    """
+    if compression_level is None:
+        return
+
+    if not 0 <= compression_level <= MAX_COMPRESSION_LEVEL:
+        raise ValueError(
+            "Compression level must be from 0 to {}, not {}".format(
+                MAX_COMPRESSION_LEVEL,
+                compression_level
+            )
+        )
+
+
+def rasterize(room_data):
+    """ Rasterises the map SVG data into an RGBA Pillow image. """
+    import wand.image as wi
+    from PIL import Image
+
+    with wi.Image(blob=room_data, format='svg') as img:
+        img.depth = 8
+        size = (img.width, img.height)
+        pixels = img.make_blob('RGBA')
+
+    return Image.frombytes('RGBA', size, pixels)
+
+
+def encode_image(image, spec, quality=None, compression_level=None):
+    """
+    Encodes a Pillow image in a raster format. Returns the bytes and the MIME
+    type.
+    """
+    name, preset = parse_format(spec)
+    encoder = ENCODERS[name]
+
+    if not encoder['raster']:
+        raise ValueError("'{}' is not a raster format".format(name))
+
+    options = encoder_options(name, preset, quality, compression_level)
+    return encoder['encode'](image, **options), encoder['mime_type']
+
+
+def encode(room_data, spec, quality=None, compression_level=None):
+    """
+    Renders the map SVG data to the given format. Returns the bytes and the
+    MIME type.
+    """
+    name, preset = parse_format(spec)
+    encoder = ENCODERS[name]
+
+    if encoder['raster']:
+        return encode_image(
+            rasterize(room_data),
+            spec,
+            quality,
+            compression_level
+        )
+
+    options = encoder_options(name, preset, quality, compression_level)
+    return encoder['encode'](room_data, **options), encoder['mime_type']
+
+
+def _save(image, format, **options):
+    """ Saves a Pillow image to bytes. """
+    output = BytesIO()
+    image.save(output, format, **options)
+    return output.getvalue()
+
+
+def _opaque(image):
+    """ Returns the image without alpha, over white (as ImageMagick does). """
+    from PIL import Image
+
+    if image.mode == 'RGB':
+        return image
+
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A') if 'A' in image.mode else None)
+    return background
+
+
+def encode_svg(room_data, quality=None, compression_level=None):
+    """ SVG is already done; there's nothing to set. """
+    return room_data
+
+
+def encode_png(image, quality=None, compression_level=6, optimize=False):
+    """ Encodes a truecolour PNG. """
+    return _save(
+        image,
+        'PNG',
+        compress_level=compression_level,
+        optimize=optimize
+    )
+
+
+def encode_palette_png(
+        image,
+        quality=None,
+        compression_level=6,
+        optimize=False,
+        colors=256):
+    """
+    Encodes an indexed (palette) PNG, which is much smaller than truecolour for
+    maps made from a couple of textures. Alpha is dropped.
+    """
+    from PIL import Image
+
+    method = getattr(Image, 'Quantize', None)
+    method = FASTOCTREE if method is None else method.FASTOCTREE
+
+    paletted = _opaque(image).quantize(colors, method=method)
+
+    return _save(
+        paletted,
+        'PNG',
+        compress_level=compression_level,
+        optimize=optimize
+    )
+
+
+def encode_jpg(
+        image,
+        quality=94,
+        compression_level=None,
+        optimize=False,
+        progressive=False):
+    """ Encodes a JPEG. """
+    return _save(
+        _opaque(image),
+        'JPEG',
+        quality=quality,
+        optimize=optimize,
+        progressive=progressive
+    )
+
+
+def encode_webp(image, quality=90, compression_level=4, lossless=False):
+    """
+    Encodes a WebP. The compression level is WebP's "method", from 0 (fast)
+    to 6 (small); higher levels are treated as 6.
+    """
+    return _save(
+        image,
+        'WEBP',
+        quality=quality,
+        method=min(compression_level, 6),
+        lossless=lossless
+    )
+
+
+register_encoder('svg', encode_svg, 'image/svg+xml', raster=False)
+
+register_encoder('png', encode_png, 'image/png', presets={
+    'fast': {'compression_level': 1},
+    'small': {'compression_level': 9, 'optimize': True},
+})
+
+register_encoder('png8', encode_palette_png, 'image/png', extension='png', presets={
+    'fast': {'compression_level': 1},
+    'small': {'compression_level': 9, 'optimize': True},
+})
+
+register_encoder('jpg', encode_jpg, 'image/jpeg', presets={
+    'fast': {'quality': 85},
+    'small': {'quality': 80, 'optimize': True, 'progressive': True},
+}, quality_range=(1, 100))
+
+register_encoder('webp', encode_webp, 'image/webp', presets={
+    'fast': {'compression_level': 0},
+    'small': {'quality': 80, 'compression_level': 6},
+}, quality_range=(0, 100))
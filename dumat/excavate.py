@@ -13,24 +13,34 @@
 #
 # You should have received a copy of the GNU General Public License along with
 # dumat. If not, see <http://www.gnu.org/licenses/>.
+# The heavy third party modules (BeautifulSoup, Pillow and Wand) are imported
+# inside the functions that need them. Wand in particular initialises
+# ImageMagick on import. Only BeautifulSoup is needed for a plain SVG render
+# from an SVG floorplan, and none of them are needed for "--help".
 import argparse
 import base64
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from io import BytesIO, TextIOWrapper
 from itertools import product
-import logging.config
-from math import ceil
+from math import ceil, floor
 import os.path
+import re
 import subprocess
 import sys
+import time
 from tempfile import TemporaryFile, NamedTemporaryFile
 
-from bs4 import BeautifulSoup as bs
-import cssutils
-from PIL import Image
-from pkg_resources import resource_stream
-import wand.image as wi
-
-from dumat import svgtools
+from dumat import buffers, cubicsuperpath, encoders, svgtools, textures
+from dumat.floorplan import PreparedFloorplan, is_prepared
+from dumat.ingest import NON_RENDERED_ELEMENTS, read_svg_floorplan
+from dumat.memory import (
+    MIB,
+    MemoryBudgetExceeded,
+    MemoryTracker,
+    format_memory_stages,
+    imagemagick_limit,
+)
 
 # SVG template name for the map
 TEMPLATE_FILE = 'template.svg'
@@ -47,6 +57,11 @@ WALL_STROKE_WIDTH = 0.02
 # Size of jitter displacement
 JITTER_SCALE = WALL_STROKE_WIDTH/4
 
+# Stands in for path data that is only made as the document is serialised (see
+# defer_path)
+DEFERRED_PATH = 'dumat-deferred-path-{}'
+DEFERRED_PATH_PATTERN = re.compile(r'dumat-deferred-path-\d+')
+
 HELP_TEXT="""\
 The dungeon excavator takes a floor image, a wall image and a floorplan and
 renders a dungeon map. The floorplan image is used to create shading to give the
@@ -57,35 +72,78 @@ The wall and floor images are tiled if they are smaller than the floorplan.
 
 TRACING_FORMAT='ppm'
 
+# Leading bytes of the bitmap formats 'potrace' reads itself (PNM and BMP);
+# these are piped to it as they are, without decoding them first
+POTRACE_SIGNATURES = (b'P1', b'P2', b'P3', b'P4', b'P5', b'P6', b'BM')
+
+# Straight runs in the floorplan path may be moved by this much (in px) when
+# simplifying it
+SIMPLIFY_TOLERANCE = 0.5
+
+# Subpaths in the floorplan that enclose less than this area (in px^2) are
+# dropped as noise
+SIMPLIFY_MIN_AREA = 4.0
+
+# Threads for the stages of a render that can run at the same time: tracing
+# and preparing the two textures
+CONCURRENT_STAGES = 3
+
+# How the wall shading is drawn: with the template's SVG filter, worked out by
+# whatever displays the map, or baked into an image at render time (which
+# needs NumPy)
+SHADING_MODES = ('filter', 'baked')
+
+# The scale of a --preview render
+PREVIEW_SCALE = 0.25
+
 
 def image_trace(image):
     """
     Uses "potrace" to trace the given PIL.Image object. Returns a beautifulsoup
     document for the SVG path.
     """ 
+    with TemporaryFile('w+b') as rfile:
+        image.save(rfile, TRACING_FORMAT)
+        rfile.seek(0)
+
+        return _potrace(stdin=rfile)
+
+
+def bitmap_trace(bitmap_data):
+    """
+    As for image_trace(), but traces a buffer of PNM or BMP data, which is
+    piped straight to "potrace".
+    """
+    return _potrace(input=bitmap_data)
+
+
+def _potrace(**kwargs):
+    """
+    Runs "potrace" with the given input (as keyword arguments for
+    subprocess.run) and returns a beautifulsoup document for the SVG path.
+    """
+    from bs4 import BeautifulSoup as bs
+
     with TemporaryFile('w+b') as vfile:
-        with TemporaryFile('w+b') as rfile:
-            image.save(rfile, TRACING_FORMAT)
-            rfile.seek(0)
-            
-            ptproc = subprocess.check_call(
-                [
-                    'potrace',
-                    '-b', 'svg',
-                    '-u', '1',
-                    # The resolution option to potrace is tricky. The output
-                    # units are pt, but we're really working with pixels. It's
-                    # easiest to just ignore this and copy the transform over
-                    # without conversion.
-                    # '-r', '90',
-                    # Output is stdout
-                    '-o', '-',
-                    # Input is stdin
-                    '-'
-                ],
-                stdin=rfile,
-                stdout=vfile
-            )
+        subprocess.run(
+            [
+                'potrace',
+                '-b', 'svg',
+                '-u', '1',
+                # The resolution option to potrace is tricky. The output
+                # units are pt, but we're really working with pixels. It's
+                # easiest to just ignore this and copy the transform over
+                # without conversion.
+                # '-r', '90',
+                # Output is stdout
+                '-o', '-',
+                # Input is stdin
+                '-'
+            ],
+            stdout=vfile,
+            check=True,
+            **kwargs
+        )
 
         vfile.seek(0)
         
@@ -102,55 +160,132 @@ def image_trace(image):
     return path_doc
 
 
-def extract_image_path(image_data):
+def is_potrace_bitmap(data):
+    """ Returns True if a buffer holds a bitmap that 'potrace' can read. """
+    return bytes(data[:2]) in POTRACE_SIGNATURES
+
+
+def extract_image_path(
+        image_data,
+        tolerance=SIMPLIFY_TOLERANCE,
+        min_area=SIMPLIFY_MIN_AREA,
+        report=None):
     """
     Returns the 'd' attribute of an SVG path for the given image data. If the
-    data represents an SVG file, the first path found is returned. If it is a
-    raster image, it is traced using 'potrace' and the path from that is
-    returned.
+    data represents an SVG file, all of the paths in it are combined (with
+    their transforms applied); SVG files are read as a stream, without
+    building a document (see dumat.ingest). If it is a raster image, it is
+    traced using 'potrace' and the paths from that are returned.
+
+    The path is simplified before it is returned (see svgtools.simplify_csp),
+    since every later stage pays for each node.
+
+    @param tolerance the simplification tolerance in px (zero to disable)
+    @param min_area subpaths smaller than this in px^2 are dropped
+    @param report if not None, a dictionary that the node counts before and
+           after simplification are added to
     """
-    try:
-        # Try to open as a raster image
-        data = BytesIO(image_data)
-        im = Image.open(data)
-    except IOError:
-        # Pillow throws an IOError if it doesn't recognise the image format,
-        # which might mean it's an SVG file already.
-        path_doc = bs(image_data, 'xml')
+    path_doc = None
+
+    if looks_like_xml(image_data):
+        # Don't bother loading Pillow for something that's clearly SVG
+        width, height, traced = read_svg_floorplan(image_data)
     else:
         try:
-            path_doc = image_trace(im)
+            if is_potrace_bitmap(image_data):
+                path_doc = bitmap_trace(image_data)
+            else:
+                try:
+                    # Try to open as a raster image
+                    im = buffers.open_image(image_data)
+                except IOError:
+                    # Pillow throws an IOError if it doesn't recognise the
+                    # image format, which might mean it's an SVG file already.
+                    width, height, traced = read_svg_floorplan(image_data)
+                else:
+                    path_doc = image_trace(im)
         except FileNotFoundError:
             raise ValueError(
                 "Bitmap floorplans require 'potrace' to be installed"
             )
 
+    if path_doc is not None:
+        width, height, traced = document_floorplan(path_doc)
+    
+    if not traced:
+        raise ValueError("Cannot extract path from floorplan file")
+
+    simplified = svgtools.simplify_csp(traced, tolerance, min_area)
+
+    if not simplified:
+        raise ValueError("Floorplan is empty after simplification")
+
+    if report is not None:
+        report['traced_nodes'] = svgtools.node_count(traced)
+        report['simplified_nodes'] = svgtools.node_count(simplified)
+
+    transformed_path = cubicsuperpath.formatPath(simplified, terminate=True)
+    
+    return transformed_path, width, height
+
+
+def document_floorplan(path_doc):
+    """
+    As for ingest.read_svg_floorplan(), but reads the paths from a
+    BeautifulSoup document (eg. the output of image_trace()).
+    """
     svg_root = path_doc.find('svg')
 
     width  = float(svg_root['width'])
     height = float(svg_root['height'])
 
-    traced_path = path_doc.find('path')
-    
-    if not traced_path:
-        raise ValueError("Cannot extract path from floorplan file")
-    
-    traced_path_d = traced_path['d']
-    traced_path_tx = traced_path.get('transform', '')
-    traced_path_parent_tx = traced_path.parent.get('transform', '')
-    
-    # Apply the transforms to the path to simplify it
-    transformed_path = svgtools.fuseTransform(
-        traced_path_tx,
-        traced_path_d
-    )
-        
-    transformed_path = svgtools.fuseTransform(
-        traced_path_parent_tx,
-        transformed_path
+    traced = []
+
+    for traced_path in path_doc.find_all('path'):
+        if not traced_path.get('d') or not is_rendered(traced_path):
+            continue
+
+        # Apply the transforms to the path to simplify it, a subpath at a
+        # time
+        traced.extend(svgtools.transform_subpaths(
+            element_transform(traced_path),
+            cubicsuperpath.iterParsePath(traced_path['d'])
+        ))
+
+    return width, height, traced
+
+
+def is_rendered(element):
+    """
+    Returns False if the element is inside something that isn't drawn directly,
+    like <defs> or <clipPath>.
+    """
+    return not any(
+        parent.name in NON_RENDERED_ELEMENTS for parent in element.parents
     )
-    
-    return transformed_path, width, height
+
+
+def element_transform(element):
+    """
+    Returns the transform matrix for an element, combining its own transform
+    with those of all of its ancestors.
+    """
+    transforms = [element.get('transform', '')]
+    transforms.extend(parent.get('transform', '') for parent in element.parents)
+
+    matrix = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
+    for transform in reversed(transforms):
+        matrix = svgtools.parseTransform(transform, matrix)
+
+    return matrix
+
+
+def looks_like_xml(data):
+    """
+    Returns True if the given buffer starts like an XML (eg. SVG) document.
+    """
+    head = bytes(data[:256]).lstrip(b'\xef\xbb\xbf \t\r\n')
+    return head.startswith(b'<')
 
 
 def raster_size(raster_data):
@@ -158,34 +293,93 @@ def raster_size(raster_data):
     Given a buffer of raster image data, return the size of the image
     represented.
     """
-    data = BytesIO(raster_data)
-    im = Image.open(data)
-    return im.size
+    # PNG dimensions are at a fixed offset in the header, so there's no need to
+    # load Pillow just to find them
+    size = textures.png_size(raster_data)
+    if size is not None:
+        return size
 
+    return buffers.open_image(raster_data).size
 
-def image_to_svg(image_data):
+
+def image_to_svg(image_data, mime_type='image/png'):
     """
     Given a buffer, returns the base64 encoded data in ASCII with a prefix
     suitable for SVG.
     """
     return (
-        'data:image/png;base64,'
+        'data:{};base64,'.format(mime_type)
         + base64.b64encode(image_data).decode('ascii'))
 
 
-def insert_and_tile_raster(image_data, map_doc, dimensions, image_id, layer_id):
-    """ Given raster (PNG) image data, convert it to SVG data and tile it.
+def embed_texture(
+        image_data,
+        dimensions,
+        texture_format=textures.ORIGINAL_FORMAT,
+        scale=1.0,
+        region=None):
+    """
+    Prepares a texture for the map (see dumat.textures.prepare_texture) and
+    encodes it for SVG. Returns a tuple of the encoded data, the size of the
+    texture, the number of bytes of image data and where to put it (see
+    prepare_texture).
+    """
+    texture_data, mime_type, size, origin = textures.prepare_texture(
+        image_data,
+        dimensions,
+        scale=scale,
+        format=texture_format,
+        region=region
+    )
+    return (
+        image_to_svg(texture_data, mime_type),
+        size,
+        len(texture_data),
+        origin,
+    )
+
+
+def insert_and_tile_raster(
+        image_data,
+        map_doc,
+        dimensions,
+        image_id,
+        layer_id,
+        region=None,
+        texture_format=textures.ORIGINAL_FORMAT,
+        embedded=None,
+        scale=1.0):
+    """ Given raster image data, convert it to SVG data and tile it. Returns
+    the number of bytes of image data embedded.
     
-    @param image_data a buffer of PNG data
+    @param image_data a buffer of image data (see dumat.textures)
     @param map_doc the SVG file containing the template definitions
     @param dimensions a tuple of the map dimensions (width, height)
     @param image_id the ID of the image definition in the SVG template
     @param layer_id the ID of the layer that should contain the tiled image
+    @param region if not None, a bounding box (x0, y0, x1, y1); only the tiles
+           overlapping it are added, and a texture bigger than it is cut down
+           to the part that is seen
+    @param texture_format the format to re-encode the texture in (see
+           dumat.textures.prepare_texture)
+    @param embedded if not None, the result of embed_texture() for the image
+           data, if it has already been worked out
+    @param scale how big the map will be drawn; below 1, the texture is
+           downscaled to match
     """
     # The floor
     width, height = dimensions
-    image_width, image_height = raster_size(image_data)
-    image_svg = image_to_svg(image_data)
+
+    if embedded is None:
+        embedded = embed_texture(
+            image_data,
+            dimensions,
+            texture_format,
+            scale,
+            region
+        )
+
+    image_svg, (image_width, image_height), texture_bytes, origin = embedded
     image_element = map_doc.find(id=image_id)
     image_element['xlink:href'] = image_svg
     image_element['width']  = image_width
@@ -193,11 +387,26 @@ def insert_and_tile_raster(image_data, map_doc, dimensions, image_id, layer_id):
     
     # Tile the floor
     image_layer = map_doc.find(id=layer_id)
-    x_repeats = ceil(width / image_width)
-    y_repeats = ceil(height / image_height)
+
+    if region is None:
+        region = (0, 0, width, height)
+
+    x0, y0, x1, y1 = region
+    x1 = min(x1, width)
+    y1 = min(y1, height)
+
+    x_tiles = range(max(floor(x0 / image_width), 0), ceil(x1 / image_width))
+    y_tiles = range(max(floor(y0 / image_height), 0), ceil(y1 / image_height))
     
-    x_offsets = (num * image_width for num in range(x_repeats))
-    y_offsets = (num * image_width for num in range(y_repeats))
+    x_offsets = (num * image_width for num in x_tiles)
+    y_offsets = (num * image_height for num in y_tiles)
+
+    # A texture cut down to the region is drawn once, where it belongs
+    origin_x, origin_y = origin
+    if origin_x is not None:
+        x_offsets = [origin_x]
+    if origin_y is not None:
+        y_offsets = [origin_y]
     
     for x_offset, y_offset in product(x_offsets, y_offsets):
         x_offset_str = '{:d}'.format(x_offset)
@@ -212,153 +421,935 @@ def insert_and_tile_raster(image_data, map_doc, dimensions, image_id, layer_id):
             }  
         )
 
-        image_layer.append(tile)
+    image_layer.append(tile)
 
-# Each post_render_* function takes a byte string containing the room data, and
-# renders it to the bytes for the final output format. They should return a
-# tuple: (image bytes, MIME type).
+    return texture_bytes
 
-def post_render_svg(room_data):
-    """ Render to SVG. """
-    return room_data, 'image/svg+xml'
 
-def post_render_png(room_data):
-    """ Render to PNG """
-    with wi.Image(blob=room_data, format='svg') as img:
-        img.format = 'png'
-        mime_type = img.mimetype
-        result = img.make_blob()
-    
-    return result, mime_type
+def load_template():
+    """ Returns the map template as a BeautifulSoup document. """
+    from importlib import resources
 
+    from bs4 import BeautifulSoup as bs
 
-def post_render_jpg(room_data):
-    """ Render to JPG with 94% compression level. """
-    with wi.Image(blob=room_data, format='svg') as img:
-        img.format = 'jpg'
-        img.compression_quality = 94
-        mime_type = img.mimetype
-        result = img.make_blob()
-    
-    return result, mime_type
+    template_file = resources.files(__package__) / TEMPLATE_FILE
+
+    with template_file.open('rb') as template_data:
+        return bs(template_data, 'xml')
+
+
+def prepare_floorplan(
+        clip_data,
+        tolerance=SIMPLIFY_TOLERANCE,
+        min_area=SIMPLIFY_MIN_AREA,
+        report=None):
+    """
+    Traces the floorplan and does all of the geometry work that doesn't depend
+    on the textures, tile size or format. Returns a PreparedFloorplan that can
+    be passed to render_prepared() any number of times. The floorplan data may
+    also be a prepared floorplan serialised with PreparedFloorplan.to_bytes().
+    The other arguments are as for extract_image_path().
+    """
+    if is_prepared(clip_data):
+        return PreparedFloorplan.from_bytes(clip_data)
+
+    floorplan_path, width, height = extract_image_path(
+        clip_data,
+        tolerance,
+        min_area,
+        report
+    )
+    return PreparedFloorplan.from_path(floorplan_path, width, height)
 
 
-def render_room(ground_data, wall_data, clip_data, tile_size, format):
+def render_room(
+        ground_data,
+        wall_data,
+        clip_data,
+        tile_size,
+        format,
+        report=None,
+        track_memory=False,
+        memory_budget=None,
+        tolerance=SIMPLIFY_TOLERANCE,
+        min_area=SIMPLIFY_MIN_AREA,
+        seed=None,
+        shading='filter',
+        quality=None,
+        compression_level=None,
+        texture_format=textures.ORIGINAL_FORMAT,
+        scale=1.0,
+        time_budget=None,
+        workers=1):
     """
     Fill out the template document with the ground and wall textures. Returns
-    a byte string containing the final image data, and a MIME type.
-    """
-    # Disable logging for the cssutils module, it's just so darn talkative
-    logging_config = {
-        'version' : 1,
-        'loggers' : {
-            'cssutils' : {
-                'level' : 'ERROR'
-            }
+    a byte string containing the final image data, and a MIME type. The
+    textures and floorplan may each be given as a file name, which is memory
+    mapped rather than read (see dumat.buffers), or as any buffer.
+
+    @param format the output format, as "name" or "name:preset" (eg.
+           "webp:small"); see dumat.encoders. This can also be a list of
+           formats, in which case the map is built and rasterised once and a
+           list of (data, MIME type) is returned, one for each format.
+
+    @param clip_data the floorplan image data, or a serialised prepared
+           floorplan
+    @param report if not None, a dictionary that is filled in with statistics
+           about the render
+    @param track_memory record the peak memory used by each stage of the
+           render in report['memory']
+    @param memory_budget if not None, the maximum number of bytes the render
+           may use on top of what the process already had; the budget is
+           checked between stages, and MemoryBudgetExceeded is raised at the
+           first one that goes over
+    @param tolerance the floorplan simplification tolerance in px (see
+           extract_image_path)
+    @param min_area floorplan subpaths smaller than this in px^2 are dropped
+    @param seed if not None, the outline jitter is repeatable: the same seed
+           and floorplan subpath always give the same hand drawn outline
+    @param shading 'filter' to shade the walls with an SVG filter, or 'baked'
+           to work the shading out now and embed it as an image, so that the
+           cost of displaying the map doesn't depend on the blur size
+    @param quality the encoder quality (eg. for JPG or WebP), overriding the
+           format's preset
+    @param compression_level the encoder compression level (eg. 0 to 9 for
+           PNG), overriding the format's preset
+    @param texture_format 'original' to embed the textures in their own
+           format (they are still cropped to the map), or a raster format from
+           dumat.encoders to re-encode them in
+    @param scale how big to draw the map relative to the floorplan, eg. 0.25
+           for a quick preview; the textures, outline, shading and floorplan
+           simplification are all made as coarse as the scale allows
+    @param time_budget if not None, the number of seconds the render should
+           take; if it looks like it will take longer, the outline detail,
+           shading and scale are lowered to fit (see dumat.budget), and the
+           report lists the 'degradations'
+    @param workers the number of processes to outline a very large floorplan
+           with (see PreparedFloorplan.workers); 1 to never start any, None
+           for one per CPU
+    """
+    deadline = _deadline(time_budget)
+    encoders.parse_formats(format)
+    check_scale(scale)
+
+    if scale < 1:
+        # Details smaller than the tolerance in output px can't be seen
+        tolerance /= scale
+
+    with ExitStack() as inputs:
+        ground_data, wall_data, clip_data = (
+            inputs.enter_context(buffers.input_buffer(source))
+            for source in (ground_data, wall_data, clip_data)
+        )
+
+        tracker = MemoryTracker(budget=memory_budget, enabled=track_memory)
+
+        template_doc = None
+        embedded_textures = None
+
+        with tracker:
+            if is_prepared(clip_data):
+                with tracker.stage('load'):
+                    prepared = PreparedFloorplan.from_bytes(clip_data)
+            else:
+                # Memory stages can't be told apart if they overlap, and
+                # tracing SVG is all Python, so only overlap when there's a
+                # bitmap to trace
+                dimensions = None if tracker.enabled else bitmap_size(clip_data)
+
+                if dimensions is None:
+                    # Trace paths for the floor plan
+                    with tracker.stage('trace'):
+                        floorplan_path, width, height = extract_image_path(
+                            clip_data,
+                            tolerance,
+                            min_area,
+                            report
+                        )
+                else:
+                    traced, template_doc, embedded_textures = _trace_concurrently(
+                        clip_data,
+                        ground_data,
+                        wall_data,
+                        dimensions,
+                        tolerance,
+                        min_area,
+                        report,
+                        texture_format,
+                        scale
+                    )
+                    floorplan_path, width, height = traced
+
+                    if (width, height) != dimensions:
+                        # The textures were cropped for the wrong size
+                        embedded_textures = None
+
+                with tracker.stage('geometry'):
+                    prepared = PreparedFloorplan.from_path(
+                        floorplan_path,
+                        width,
+                        height
+                    )
+
+            prepared.workers = workers
+
+            rendered = _render_prepared_stages(
+                prepared,
+                ground_data,
+                wall_data,
+                tile_size,
+                format,
+                tracker,
+                report,
+                seed=seed,
+                shading=shading,
+                quality=quality,
+                compression_level=compression_level,
+                texture_format=texture_format,
+                template_doc=template_doc,
+                embedded_textures=embedded_textures,
+                scale=scale,
+                deadline=deadline)
+
+        _report_memory(report, tracker)
+
+        return rendered
+
+
+def _deadline(time_budget):
+    """
+    Returns the time.perf_counter() time a render with the given budget (in
+    seconds, or None) should be done by, or None if it doesn't have one.
+    """
+    if time_budget is None:
+        return None
+
+    if time_budget <= 0:
+        raise ValueError('Time budget must be greater than zero')
+
+    return time.perf_counter() + time_budget
+
+
+def check_scale(scale):
+    """ Raises ValueError if a render scale isn't usable. """
+    if not scale > 0:
+        raise ValueError('Scale must be greater than zero')
+
+
+def bitmap_size(clip_data):
+    """
+    Returns the size of a bitmap floorplan, or None if the floorplan isn't a
+    bitmap (or can't be read).
+    """
+    if looks_like_xml(clip_data):
+        return None
+
+    try:
+        width, height = raster_size(clip_data)
+    except OSError:
+        return None
+
+    return float(width), float(height)
+
+
+def _trace_concurrently(
+        clip_data,
+        ground_data,
+        wall_data,
+        dimensions,
+        tolerance,
+        min_area,
+        report,
+        texture_format,
+        scale=1.0):
+    """
+    Traces a bitmap floorplan while the template is loaded and the textures
+    are prepared for a map of the given dimensions (which tracing should come
+    up with too). Tracing is mostly spent waiting for 'potrace', and Pillow
+    lets other threads run while it works, so they overlap well.
+
+    Returns the result of extract_image_path(), the template document and the
+    embedded textures (see build_room_document).
+    """
+    with ThreadPoolExecutor(max_workers=CONCURRENT_STAGES) as executor:
+        trace = executor.submit(
+            extract_image_path,
+            clip_data,
+            tolerance,
+            min_area,
+            report
+        )
+        texture_jobs = {
+            name: executor.submit(
+                embed_texture,
+                data,
+                dimensions,
+                texture_format,
+                scale
+            )
+            for name, data in (('ground', ground_data), ('wall', wall_data))
         }
-    }
-    logging.config.dictConfig(logging_config)    
-    
-    post_render_funcs = {
-        'svg': post_render_svg,
-        'png': post_render_png,
-        'jpg': post_render_jpg
-    }
 
-    if format not in post_render_funcs:
-        raise ValueError('Invalid format!')
+        template_doc = load_template()
+
+        embedded_textures = {
+            name: job.result() for name, job in texture_jobs.items()
+        }
 
-    # Trace paths for the floor plan
-    floorplan_path, width, height = extract_image_path(clip_data)
+        return trace.result(), template_doc, embedded_textures
+
+
+def render_prepared(
+        prepared,
+        ground_data,
+        wall_data,
+        tile_size,
+        format,
+        report=None,
+        track_memory=False,
+        memory_budget=None,
+        seed=None,
+        shading='filter',
+        quality=None,
+        compression_level=None,
+        texture_format=textures.ORIGINAL_FORMAT,
+        scale=1.0,
+        time_budget=None):
+    """
+    As for render_room(), but starts from a PreparedFloorplan. Use this to
+    render the same floorplan with several textures, tile sizes or formats
+    without tracing it again.
+    """
+    deadline = _deadline(time_budget)
+    encoders.parse_formats(format)
+    check_scale(scale)
+
+    tracker = MemoryTracker(budget=memory_budget, enabled=track_memory)
+
+    with tracker:
+        rendered = _render_prepared_stages(
+            prepared,
+            ground_data,
+            wall_data,
+            tile_size,
+            format,
+            tracker,
+            report,
+            seed=seed,
+            shading=shading,
+            quality=quality,
+            compression_level=compression_level,
+            texture_format=texture_format,
+            scale=scale,
+            deadline=deadline)
+
+    _report_memory(report, tracker)
+
+    return rendered
+
+
+def render_region(
+        x,
+        y,
+        width,
+        height,
+        floorplan,
+        ground_data,
+        wall_data,
+        tile_size,
+        format,
+        report=None,
+        track_memory=False,
+        memory_budget=None,
+        seed=None,
+        shading='filter',
+        quality=None,
+        compression_level=None,
+        texture_format=textures.ORIGINAL_FORMAT,
+        scale=1.0,
+        time_budget=None):
+    """
+    Renders just the part of the map inside the given rectangle (in floorplan
+    px). Only the floorplan subpaths and texture tiles near the region are
+    used, so the cost depends on the size of the region rather than the map.
+    Returns the image data and MIME type, as for render_room().
+
+    @param floorplan a PreparedFloorplan, or floorplan data to prepare (see
+           prepare_floorplan); preparing once and rendering many regions from
+           it is much cheaper
+    """
+    deadline = _deadline(time_budget)
+    encoders.parse_formats(format)
+    check_scale(scale)
+
+    if width <= 0 or height <= 0:
+        raise ValueError('Region must have a positive size')
+
+    if not isinstance(floorplan, PreparedFloorplan):
+        floorplan = prepare_floorplan(floorplan)
+
+    tracker = MemoryTracker(budget=memory_budget, enabled=track_memory)
+
+    with tracker:
+        rendered = _render_prepared_stages(
+            floorplan,
+            ground_data,
+            wall_data,
+            tile_size,
+            format,
+            tracker,
+            report,
+            region=(x, y, width, height),
+            seed=seed,
+            shading=shading,
+            quality=quality,
+            compression_level=compression_level,
+            texture_format=texture_format,
+            scale=scale,
+            deadline=deadline)
+
+    _report_memory(report, tracker)
+
+    return rendered
+
+
+def _report_memory(report, tracker):
+    """ Adds the stages recorded by the tracker to the report, if any. """
+    if report is not None and tracker.enabled:
+        report['memory'] = tracker.stages
+
+
+def _render_prepared_stages(
+        prepared,
+        ground_data,
+        wall_data,
+        tile_size,
+        format,
+        tracker,
+        report,
+        region=None,
+        seed=None,
+        shading='filter',
+        quality=None,
+        compression_level=None,
+        texture_format=textures.ORIGINAL_FORMAT,
+        template_doc=None,
+        embedded_textures=None,
+        scale=1.0,
+        deadline=None):
+    """
+    Does the actual work for render_prepared() and render_region(), with each
+    stage wrapped for memory tracking. If a deadline (a time.perf_counter()
+    time) is given, the quality is lowered as needed to try to finish by then
+    (see dumat.budget).
+    """
+    detail = 1.0
+
+    if deadline is not None:
+        from dumat.budget import plan_render
+
+        raster = any(
+            encoders.is_raster(spec) for spec in encoders.parse_formats(format)
+        )
+        plan = plan_render(
+            prepared,
+            tile_size,
+            raster,
+            shading,
+            scale,
+            deadline - time.perf_counter(),
+            region
+        )
+        shading = plan['shading']
+        detail = plan['detail']
+
+        if plan['scale'] != scale:
+            # The textures were made to suit the scale that was asked for
+            embedded_textures = None
+
+            if report is not None:
+                # Say so plainly; the caller may not expect a smaller image
+                if region is None:
+                    size = (prepared.width, prepared.height)
+                else:
+                    size = region[2:]
+
+                report['requested_size'] = [
+                    round(value * scale, 2) for value in size
+                ]
+                report['output_size'] = [
+                    round(value * plan['scale'], 2) for value in size
+                ]
+
+            scale = plan['scale']
+
+        if report is not None:
+            report['degradations'] = plan['degradations']
+            report['estimated_seconds'] = round(plan['estimated_seconds'], 3)
+
+    deferred_paths = {}
+
+    template_doc = build_room_document(
+        prepared,
+        ground_data,
+        wall_data,
+        tile_size,
+        region=region,
+        tracker=tracker,
+        report=report,
+        seed=seed,
+        shading=shading,
+        texture_format=texture_format,
+        template_doc=template_doc,
+        embedded_textures=embedded_textures,
+        scale=scale,
+        detail=detail,
+        deferred_paths=deferred_paths)
+
+    return encode_document(
+        template_doc,
+        format,
+        tracker,
+        quality,
+        compression_level,
+        deferred_paths
+    )
+
+
+def defer_path(path_tag, subpaths, deferred_paths, terminate=False):
+    """
+    Sets the "d" attribute of a path element to the path data for an iterable
+    of cubicsuperpath subpaths. If "deferred_paths" is a dictionary, the
+    attribute is only given a placeholder, and the path data is written
+    straight into the output a subpath at a time when the document is
+    serialised (see serialize_document), so neither the subpaths nor the
+    formatted data need to be held in memory all at once. Otherwise the path
+    data is formatted now.
+    """
+    if deferred_paths is None:
+        path_tag['d'] = cubicsuperpath.formatPath(subpaths, terminate)
+        return
+
+    placeholder = DEFERRED_PATH.format(len(deferred_paths))
+    deferred_paths[placeholder] = (subpaths, terminate)
+    path_tag['d'] = placeholder
+
+
+def serialize_document(map_doc, deferred_paths=None):
+    """
+    Returns a finished map document as SVG data, with the path data of any
+    deferred paths (see defer_path) written in as it is made.
+    """
+    text = map_doc.prettify()
+
+    if not deferred_paths:
+        return text.encode('ascii')
+
+    output = BytesIO()
+    sink = TextIOWrapper(output, encoding='ascii')
+    position = 0
+
+    for match in DEFERRED_PATH_PATTERN.finditer(text):
+        sink.write(text[position:match.start()])
+        subpaths, terminate = deferred_paths[match.group(0)]
+        cubicsuperpath.writePath(subpaths, sink, terminate)
+        position = match.end()
+
+    sink.write(text[position:])
+    sink.detach()
+
+    return output.getvalue()
+
+
+def _counted(subpaths, report, key):
+    """
+    Yields each of an iterable of subpaths, and then puts the number of nodes
+    in them in the report under the given key.
+    """
+    nodes = 0
+
+    for subpath in subpaths:
+        nodes += len(subpath)
+        yield subpath
+
+    report[key] = nodes
+
+
+def encode_document(
+        map_doc,
+        format,
+        tracker,
+        quality=None,
+        compression_level=None,
+        deferred_paths=None):
+    """
+    Serialises a finished map document and encodes it in the given format, or
+    list of formats, rasterising it at most once. Returns the image data and
+    MIME type (or a list of them) as for render_room().
+
+    @param tracker a MemoryTracker to record the stages in
+    @param deferred_paths the path data left out of the document, as filled
+           in by build_room_document()
+    """
+    with tracker.stage('serialize'):
+        room_data = serialize_document(map_doc, deferred_paths)
+
+    formats = encoders.parse_formats(format)
+    image = None
+    rendered = []
+
+    for spec in formats:
+        # Tell the stages apart if there are several
+        encode_stage = 'encode' if len(formats) == 1 else 'encode ' + spec
+
+        if encoders.is_raster(spec):
+            if image is None:
+                with tracker.stage('rasterize'), \
+                        imagemagick_limit(tracker.headroom()):
+                    image = encoders.rasterize(room_data)
+
+            with tracker.stage(encode_stage):
+                rendered.append(encoders.encode_image(
+                    image,
+                    spec,
+                    quality,
+                    compression_level
+                ))
+        else:
+            with tracker.stage(encode_stage):
+                rendered.append(encoders.encode(
+                    room_data,
+                    spec,
+                    quality,
+                    compression_level
+                ))
+
+    if isinstance(format, str):
+        return rendered[0]
+
+    return rendered
+
+
+def shading_padding(tile_size):
+    """
+    Returns how far (in px) outside a region the floorplan can still affect
+    what's drawn inside it: the reach of the blurs, the outline and its jitter.
+    """
+    blur = max(BLUR_INSIDE_WIDTH, BLUR_OUTSIDE_WIDTH) * tile_size
+    return 3 * blur + (WALL_STROKE_WIDTH + JITTER_SCALE) * tile_size
+
+
+def build_room_document(
+        prepared,
+        ground_data,
+        wall_data,
+        tile_size,
+        region=None,
+        tracker=None,
+        report=None,
+        seed=None,
+        shading='filter',
+        texture_format=textures.ORIGINAL_FORMAT,
+        template_doc=None,
+        embedded_textures=None,
+        scale=1.0,
+        detail=1.0,
+        deferred_paths=None):
+    """
+    Fills out the template document for a prepared floorplan and returns it
+    (as a BeautifulSoup document).
+
+    @param region if not None, a tuple (x, y, width, height) of the part of
+           the map to draw; only the geometry and texture tiles near it are
+           included, and the document is just that size
+    @param tracker if not None, a MemoryTracker to record the stages in
+    @param report if not None, a dictionary for render statistics
+    @param seed if not None, the seed for a repeatable outline jitter
+    @param shading 'filter' or 'baked' (see render_room)
+    @param texture_format the format to re-encode the textures in (see
+           render_room)
+    @param template_doc if not None, a freshly loaded template document to
+           fill out, instead of loading one
+    @param embedded_textures if not None, a dictionary with the embed_texture()
+           results for the 'ground' and 'wall' textures, already worked out
+           for the whole map (at the same scale)
+    @param scale how big to draw the map (see render_room); the document is
+           that much bigger or smaller, with the same view of the map
+    @param detail how detailed to make the outline (see
+           floorplan.outline_spacing)
+    @param deferred_paths if not None, a dictionary that the biggest paths
+           (the floor, the walls and the outline) are put in rather than the
+           document, to be written as the document is serialised (see
+           defer_path); pass it on to encode_document()
+    """
+    if shading not in SHADING_MODES:
+        raise ValueError('Invalid shading mode!')
+
+    check_scale(scale)
+
+    if tracker is None:
+        tracker = MemoryTracker(enabled=False)
+
+    width = prepared.width
+    height = prepared.height
+
+    if region is None:
+        subpaths = None
+        texture_region = None
+    else:
+        x, y, region_width, region_height = region
+        padding = shading_padding(tile_size)
+        texture_region = (x, y, x + region_width, y + region_height)
+        subpaths = prepared.subpaths_in((
+            x - padding,
+            y - padding,
+            x + region_width + padding,
+            y + region_height + padding,
+        ))
+
+    if embedded_textures is None:
+        embedded_textures = {}
 
-    # Create a bounding box for everything
-    bounding_path = svgtools.create_bounding_path(width, height)
- 
     # Load SVG
-    with resource_stream(__name__, TEMPLATE_FILE) as template_data:
-        template_doc = bs(template_data, 'xml')
+    if template_doc is None:
+        with tracker.stage('template'):
+            template_doc = load_template()
    
     # Set the sizes
     svg_doc = template_doc.find('svg')
-    svg_doc['width']  = width
-    svg_doc['height'] = height
+
+    if region is None:
+        svg_doc['width']  = width * scale
+        svg_doc['height'] = height * scale
+
+        if scale != 1:
+            # Everything inside is still in floorplan px
+            svg_doc['viewBox'] = '0 0 {} {}'.format(width, height)
+    else:
+        svg_doc['width']  = region_width * scale
+        svg_doc['height'] = region_height * scale
+        svg_doc['viewBox'] = '{} {} {} {}'.format(*region)
     
     # Put some bitmaps in
-    # Insert and tile the walls
-    insert_and_tile_raster(
-        wall_data,
-        template_doc,
-        (width, height),
-        'image-wall',
-        'layer-wall',
-    )
+    with tracker.stage('textures'):
+        # Insert and tile the walls
+        texture_bytes = insert_and_tile_raster(
+            wall_data,
+            template_doc,
+            (width, height),
+            'image-wall',
+            'layer-wall',
+            texture_region,
+            texture_format,
+            embedded_textures.get('wall'),
+            scale,
+        )
 
-    # Insert and tile the floor
-    insert_and_tile_raster(
-        ground_data,
-        template_doc,
-        (width, height),
-        'image-ground',
-        'layer-ground',
-    )
-    
-    # Adjust the blur
-    blur_inside = int(round(BLUR_INSIDE_WIDTH * tile_size))
-    blur_outside = int(round(BLUR_OUTSIDE_WIDTH * tile_size))
-    template_doc.find(id='wall-blur-inside')['stdDeviation'] = str(blur_inside)
-    template_doc.find(id='wall-blur-outside')['stdDeviation'] = str(blur_outside)
-    
-    # Clip the floor
-    clip_path = template_doc.find(id='clip-path-room-path')
-    clip_path['d'] = bounding_path
-    
-    # Clip the walls
-    floor_path = template_doc.find(id='clip-path-floor-path')
-    floor_path['d'] = floorplan_path
-    
-    # Invert the wall path
-    floorplan_path_inverted = svgtools.path_difference(bounding_path, floorplan_path)
-    floor_path_inverted = template_doc.find(id='clip-path-floor-path-inverted')
-    floor_path_inverted['d'] = floorplan_path_inverted
-    
-    floorplan_path_extra = svgtools.add_nodes_to_path(
-        floorplan_path,
-        'bymax',
-        max_length=40)
-    
-    wall_outline = template_doc.find(id='path-wall-outline')
+        # Insert and tile the floor
+        texture_bytes += insert_and_tile_raster(
+            ground_data,
+            template_doc,
+            (width, height),
+            'image-ground',
+            'layer-ground',
+            texture_region,
+            texture_format,
+            embedded_textures.get('ground'),
+            scale,
+        )
+
+        if report is not None:
+            report['texture_bytes'] = texture_bytes
     
-    wall_outline_attrs = cssutils.parseStyle(
-        wall_outline['style'],
-        validate=False
-    )
+    with tracker.stage('outline'):
+        # Adjust the blur
+        blur_inside = int(round(BLUR_INSIDE_WIDTH * tile_size))
+        blur_outside = int(round(BLUR_OUTSIDE_WIDTH * tile_size))
+        template_doc.find(id='wall-blur-inside')['stdDeviation'] = str(blur_inside)
+        template_doc.find(id='wall-blur-outside')['stdDeviation'] = str(blur_outside)
         
-    wall_outline_attrs['stroke-width'] = (
-        '{:.2f}'.format(WALL_STROKE_WIDTH * tile_size)
-    )
-    
-    jitter_radius = JITTER_SCALE * tile_size
-    
-    wall_outline_new_d = svgtools.jitter_nodes(
-        floorplan_path_extra,
-        end=True,
-        ctrl=True,
-        radiusx=jitter_radius,
-        radiusy=jitter_radius,
-        norm=False
-    )
-    
-    wall_outline['d'] = wall_outline_new_d
-    wall_outline['style'] = wall_outline_attrs.cssText
+        clip_path = template_doc.find(id='clip-path-room-path')
+        floor_path = template_doc.find(id='clip-path-floor-path')
+        floor_path_inverted = template_doc.find(id='clip-path-floor-path-inverted')
+
+        if region is None:
+            # Clip the floor
+            clip_path['d'] = prepared.bounding_path()
+            
+            # Clip the walls
+            defer_path(
+                floor_path,
+                prepared.floor,
+                deferred_paths,
+                terminate=True
+            )
+            
+            # The inverted floor path for the walls
+            defer_path(
+                floor_path_inverted,
+                prepared.inverted,
+                deferred_paths,
+                terminate=True
+            )
+        else:
+            # Only draw the part of the map inside the (padded) region
+            clip_x0 = max(x - padding, 0)
+            clip_y0 = max(y - padding, 0)
+            clip_x1 = min(x + region_width + padding, width)
+            clip_y1 = min(y + region_height + padding, height)
+
+            bounding_path = svgtools.create_bounding_path(
+                clip_x1 - clip_x0,
+                clip_y1 - clip_y0,
+                clip_x0,
+                clip_y0
+            )
+            clip_path['d'] = bounding_path
+
+            if subpaths:
+                region_floor_path = prepared.floor_path(subpaths)
+                floor_path['d'] = region_floor_path
+                floor_path_inverted['d'] = svgtools.path_difference(
+                    bounding_path,
+                    region_floor_path
+                )
+            else:
+                # Nothing but wall
+                floor_path['d'] = ''
+                floor_path_inverted['d'] = bounding_path
+
+            # Don't let the shading filter work on more than the region
+            wall_filter = template_doc.find(id='wall-boundary-filter')
+            wall_filter['filterUnits'] = 'userSpaceOnUse'
+            wall_filter['x'] = x - padding
+            wall_filter['y'] = y - padding
+            wall_filter['width'] = region_width + 2 * padding
+            wall_filter['height'] = region_height + 2 * padding
+        
+        wall_outline = template_doc.find(id='path-wall-outline')
+        
+        wall_outline_style = svgtools.update_style(
+            wall_outline['style'],
+            {'stroke-width': '{:.2f}'.format(WALL_STROKE_WIDTH * tile_size)}
+        )
+        
+        jitter_radius = JITTER_SCALE * tile_size
+        
+        # Densified and jittered a subpath at a time, as it is written out
+        outline = prepared.iter_outline(
+            tile_size,
+            jitter_radius,
+            subpaths,
+            seed,
+            scale,
+            detail
+        )
+
+        if report is not None:
+            outline = _counted(outline, report, 'outline_nodes')
+
+        defer_path(wall_outline, outline, deferred_paths)
+        wall_outline['style'] = wall_outline_style
+
+        if report is not None:
+            if subpaths is None:
+                subpaths = range(len(prepared.floor))
+
+            report['floor_subpaths'] = len(subpaths)
+            report['floor_nodes'] = sum(len(prepared.floor[i]) for i in subpaths)
+
+    if shading == 'baked':
+        with tracker.stage('shading'):
+            bake_wall_shading(
+                template_doc,
+                prepared,
+                subpaths,
+                blur_inside,
+                blur_outside,
+                region,
+                scale
+            )
 
     # Remove the copyright notice
     del template_doc.contents[0]
-    
-    room_data = template_doc.prettify().encode('ascii')
 
-    rendered_data, mime_type = post_render_funcs[format](room_data)
+    return template_doc
+
+
+def bake_wall_shading(
+        map_doc,
+        prepared,
+        subpaths,
+        blur_inside,
+        blur_outside,
+        region=None,
+        scale=1.0):
+    """
+    Replaces the filtered wall shading in the map document with the same
+    shading worked out now and embedded as an image.
+
+    @param subpaths the numbers of the floor subpaths to use, or None for all
+    @param blur_inside the standard deviation of the inner shadow in px
+    @param blur_outside the standard deviation of the outer glow in px
+    @param scale how big the map will be drawn; the image has one pixel per
+           pixel of the drawn map
+    """
+    from dumat.raster import shading_size, wall_shading_png
+
+    if region is None:
+        region = (0, 0, prepared.width, prepared.height)
+
+    floor_csp = prepared.floor
+    if subpaths is not None:
+        floor_csp = [prepared.floor[number] for number in subpaths]
+
+    shading_data = wall_shading_png(
+        floor_csp,
+        prepared.width,
+        prepared.height,
+        blur_inside,
+        blur_outside,
+        region,
+        scale
+    )
+
+    # Line the image up with the pixels of the drawn map, which start at the
+    # corner of the region
+    x, y, _, _ = region
+    width, height = shading_size(region, scale)
+
+    shading = map_doc.new_tag(
+        'image',
+        id='image-wall-shading',
+        x='{:.10g}'.format(x),
+        y='{:.10g}'.format(y),
+        width='{:.10g}'.format(width / scale),
+        height='{:.10g}'.format(height / scale),
+        **{
+            'xlink:href': 'data:image/png;base64,'
+                + base64.b64encode(shading_data).decode('ascii')
+        }
+    )
+
+    shading_layer = map_doc.find(id='layer-wall-shading')
+    shading_layer.clear()
+    shading_layer.append(shading)
+
+    # Nothing uses the filter now, but some viewers would still parse it
+    map_doc.find(id='wall-boundary-filter').decompose()
 
-    return rendered_data, mime_type
+
+def format_report(report):
+    """ Returns a list of human readable lines describing a render report. """
+    lines = []
+
+    for key, value in sorted(report.items()):
+        if key == 'memory':
+            lines.extend(format_memory_stages(value))
+        else:
+            lines.append('{}: {}'.format(key, value))
+
+    return lines
 
 def render_room_from_paths(
         ground_path,
@@ -366,28 +1357,352 @@ def render_room_from_paths(
         clip_path,
         output_path,
         tile_size,
-        format):
-    """ Load template and textures and export the rendered result. """
-    with open(ground_path, 'rb') as gp:
-        ground_data = gp.read()
-        
-    with open(wall_path, 'rb') as wp:
-        wall_data = wp.read()
-        
-    with open(clip_path, 'rb') as cp:
-        clip_data = cp.read()
-        
-    room, _ = render_room(
-        ground_data,
-        wall_data,
-        clip_data,
-        tile_size,
-        format)
-    
-    with open(output_path, 'wb') as op:
+        format,
+        report=None,
+        track_memory=False,
+        memory_budget=None,
+        prepared_path=None,
+        tolerance=SIMPLIFY_TOLERANCE,
+        min_area=SIMPLIFY_MIN_AREA,
+        region=None,
+        seed=None,
+        shading='filter',
+        quality=None,
+        compression_level=None,
+        texture_format=textures.ORIGINAL_FORMAT,
+        scale=1.0,
+        time_budget=None,
+        cache=None,
+        walls_path=None,
+        occupancy_path=None,
+        workers=1):
+    """
+    Load template and textures and export the rendered result. If
+    "prepared_path" is given, the prepared floorplan is also saved there so
+    that later renders can skip tracing. If "walls_path" is given, the wall
+    segments are saved there (see save_walls). If "occupancy_path" is given,
+    the occupancy grid is saved there (see dumat.occupancy.save_occupancy).
+    If "region" is given, it is a tuple (x, y, width, height) and only that
+    part of the map is rendered. If "cache" is given, it is a RenderCache (see
+    dumat.cache) to look the result up in and store it in. If "format" is a
+    list of formats, "output_path" is a list of the same length and the map is
+    only built and rasterised once for all of them. "workers" is the number of
+    processes to outline a very large floorplan with (see render_room).
+    """
+    formats = encoders.parse_formats(format)
+    output_paths = [output_path] if isinstance(format, str) else list(output_path)
+
+    if len(output_paths) != len(formats):
+        raise ValueError("There must be one output path for each format")
+
+    with ExitStack() as inputs:
+        # Map the files rather than reading them, so that large inputs aren't
+        # copied (see dumat.buffers)
+        ground_data, wall_data, clip_data = (
+            inputs.enter_context(buffers.mapped_file(path))
+            for path in (ground_path, wall_path, clip_path)
+        )
+
+        prepared = None
+
+        if (prepared_path is not None or walls_path is not None
+                or occupancy_path is not None):
+            prepared = prepare_floorplan(clip_data, tolerance, min_area, report)
+            prepared.workers = workers
+
+            if prepared_path is not None:
+                prepared.save(prepared_path)
+
+            if walls_path is not None:
+                save_walls(prepared, walls_path)
+
+            if occupancy_path is not None:
+                from dumat.occupancy import save_occupancy
+                save_occupancy(prepared, tile_size, occupancy_path)
+
+        def render(formats, render_report=report):
+            nonlocal prepared
+
+            if region is not None:
+                if prepared is None:
+                    prepared = prepare_floorplan(
+                        clip_data,
+                        tolerance,
+                        min_area,
+                        report
+                    )
+                    prepared.workers = workers
+
+                return render_region(
+                    *region,
+                    prepared,
+                    ground_data,
+                    wall_data,
+                    tile_size,
+                    formats,
+                    report=render_report,
+                    track_memory=track_memory,
+                    memory_budget=memory_budget,
+                    seed=seed,
+                    shading=shading,
+                    quality=quality,
+                    compression_level=compression_level,
+                    texture_format=texture_format,
+                    scale=scale,
+                    time_budget=time_budget)
+            elif prepared is not None:
+                return render_prepared(
+                    prepared,
+                    ground_data,
+                    wall_data,
+                    tile_size,
+                    formats,
+                    report=render_report,
+                    track_memory=track_memory,
+                    memory_budget=memory_budget,
+                    seed=seed,
+                    shading=shading,
+                    quality=quality,
+                    compression_level=compression_level,
+                    texture_format=texture_format,
+                    scale=scale,
+                    time_budget=time_budget)
+            else:
+                return render_room(
+                    ground_data,
+                    wall_data,
+                    clip_data,
+                    tile_size,
+                    formats,
+                    report=render_report,
+                    track_memory=track_memory,
+                    memory_budget=memory_budget,
+                    tolerance=tolerance,
+                    min_area=min_area,
+                    seed=seed,
+                    shading=shading,
+                    quality=quality,
+                    compression_level=compression_level,
+                    texture_format=texture_format,
+                    scale=scale,
+                    time_budget=time_budget,
+                    workers=workers)
+
+        if cache is not None:
+            from dumat.cache import cached_formats, render_options, report_sources
+
+            options = render_options(
+                tile_size=tile_size,
+                tolerance=tolerance,
+                min_area=min_area,
+                region=region,
+                seed=seed,
+                shading=shading,
+                quality=quality,
+                compression_level=compression_level,
+                texture_format=texture_format,
+                scale=scale,
+                time_budget=time_budget)
+            seed = options['seed']
+
+            rooms, sources = cached_formats(
+                cache,
+                (ground_data, wall_data, clip_data),
+                options,
+                formats,
+                render,
+                report
+            )
+            report_sources(report, format, sources)
+        else:
+            rooms = render(formats)
+
+    for path, (room, _) in zip(output_paths, rooms):
+        with open(path, 'wb') as op:
+            op.write(room)
+
+
+def save_walls(prepared, walls_path):
+    """
+    Saves the walls of a prepared floorplan as line segments, as JSON if the
+    file name ends in '.json' and in a compact binary format otherwise (see
+    dumat.walls). Needs NumPy.
+    """
+    from dumat.walls import WallIndex
+
+    WallIndex.from_floorplan(prepared).save(walls_path)
+
+
+def export_tiles_from_paths(args, report=None, memory_budget=None):
+    """ Loads the inputs named on the command line and exports tiles. """
+    from dumat.tiles import export_tile_pyramid
+
+    with buffers.mapped_file(args.floorplan) as clip_data:
+        prepared = prepare_floorplan(clip_data, args.simplify, args.min_area)
+
+    if args.save_prepared is not None:
+        prepared.save(args.save_prepared)
+
+    if args.walls is not None:
+        save_walls(prepared, args.walls)
+
+    if args.occupancy is not None:
+        from dumat.occupancy import save_occupancy
+        save_occupancy(prepared, args.tile_size, args.occupancy)
+
+    # The textures are memory mapped, by each tile worker for itself
+    export_tile_pyramid(
+        args.output,
+        prepared,
+        args.ground,
+        args.wall,
+        args.tile_size,
+        format=args.format,
+        tile_px=args.tile_px,
+        workers=args.workers,
+        seed=args.seed,
+        shading='baked' if args.bake_shading else 'filter',
+        quality=args.quality,
+        compression_level=args.compression_level,
+        texture_format=args.texture_format,
+        memory_budget=memory_budget,
+        report=report)
+
+
+def render_atlas_from_paths(args, report, memory_budget=None):
+    """
+    Renders the floorplan named on the command line and the --atlas ones into
+    one map.
+    """
+    from dumat.atlas import render_atlas
+
+    floorplans = [args.floorplan] + args.atlas
+    names = [
+        os.path.splitext(os.path.basename(path))[0] for path in floorplans
+    ]
+
+    rooms = render_atlas(
+        floorplans,
+        args.ground,
+        args.wall,
+        args.tile_size,
+        args.format,
+        names=names,
+        columns=args.atlas_columns,
+        report=report,
+        track_memory=args.report,
+        memory_budget=memory_budget,
+        tolerance=args.simplify,
+        min_area=args.min_area,
+        seed=args.seed,
+        shading='baked' if args.bake_shading else 'filter',
+        quality=args.quality,
+        compression_level=args.compression_level,
+        texture_format=args.texture_format,
+        scale=args.scale)
+
+    if isinstance(args.format, str):
+        rooms, output_paths = [rooms], [args.output]
+    else:
+        output_paths = args.output
+
+    for path, (room, _) in zip(output_paths, rooms):
+        with open(path, 'wb') as op:
+            op.write(room)
+
+
+def render_incremental_from_paths(args, report, memory_budget=None):
+    """
+    Loads the inputs named on the command line and renders incrementally,
+    reusing the state file from the last render if there is one.
+    """
+    from dumat.incremental import DEFAULT_SEED, RenderState, render_incremental
+
+    with buffers.mapped_file(args.floorplan) as clip_data:
+        prepared = prepare_floorplan(
+            clip_data,
+            args.simplify,
+            args.min_area,
+            report
+        )
+
+    if args.save_prepared is not None:
+        prepared.save(args.save_prepared)
+
+    if args.walls is not None:
+        save_walls(prepared, args.walls)
+
+    if args.occupancy is not None:
+        from dumat.occupancy import save_occupancy
+        save_occupancy(prepared, args.tile_size, args.occupancy)
+
+    previous = None
+    if os.path.exists(args.incremental):
+        previous = RenderState.load(args.incremental)
+
+    with ExitStack() as inputs:
+        ground_data, wall_data = (
+            inputs.enter_context(buffers.mapped_file(path))
+            for path in (args.ground, args.wall)
+        )
+
+        room, _, state = render_incremental(
+            prepared,
+            ground_data,
+            wall_data,
+            args.tile_size,
+            args.format,
+            previous=previous,
+            seed=DEFAULT_SEED if args.seed is None else args.seed,
+            report=report,
+            shading='baked' if args.bake_shading else 'filter',
+            quality=args.quality,
+            compression_level=args.compression_level,
+            memory_budget=memory_budget)
+
+    state.save(args.incremental)
+
+    with open(args.output, 'wb') as op:
         op.write(room)
 
 
+def parse_format(format_str):
+    """ Checks a "FORMAT[:PRESET]" command line argument. """
+    try:
+        encoders.parse_format(format_str)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+    return format_str
+
+
+def parse_texture_format(format_str):
+    """ Checks a texture "FORMAT[:PRESET]" command line argument. """
+    if format_str == textures.ORIGINAL_FORMAT:
+        return format_str
+
+    format_str = parse_format(format_str)
+    if not encoders.is_raster(format_str):
+        raise argparse.ArgumentTypeError("textures need a raster format")
+
+    return format_str
+
+
+def parse_region(region_str):
+    """ Parses an "X,Y,WIDTH,HEIGHT" command line argument. """
+    try:
+        x, y, width, height = (float(part) for part in region_str.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "region must be four numbers: X,Y,WIDTH,HEIGHT"
+        )
+
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError("region must have a positive size")
+
+    return x, y, width, height
+
+
 def main():
     """ Parse arguments and get things going. """
     parser = argparse.ArgumentParser(description=HELP_TEXT)
@@ -402,12 +1717,18 @@ def main():
             "supported by Pillow) or an SVG image. If it is a bitmap, it should"
             " be black where you want the ground to show and white everywhere "
             "else. The 'potrace' executable must be installed to be able to use"
-            " bitmaps. If the file is an SVG file, the first path in the file "
-            "will be used."
+            " bitmaps. If the file is an SVG file, all of the paths in the file"
+            " will be used. A prepared floorplan saved with --save-prepared can"
+            " also be given, in which case tracing is skipped."
         )
     )
     
-    parser.add_argument('output', help="Output file (Inkscape SVG)")
+    parser.add_argument(
+        'output',
+        help="Output file (Inkscape SVG by default). Several can be given, "
+             "with a --format for each, to render the map once and save it in "
+             "several formats.",
+        nargs='+')
     
     parser.add_argument(
         '-s', '--tile-size',
@@ -417,16 +1738,354 @@ def main():
         default=100)
  
     parser.add_argument(
-        '-f', '--format', choices=('svg', 'png', 'jpg'),
-        help="The format to render the map to.",
-        default='svg')
+        '-f', '--format',
+        help="The format to render the map to: {}. A preset can be added "
+             "after a colon to favour encoding speed or file size, eg. "
+             "'webp:small' ({}). png8 is a palette PNG. Give this once for "
+             "each output (default svg).".format(
+                 ', '.join(sorted(encoders.ENCODERS)),
+                 ', '.join(encoders.PRESETS)),
+        type=parse_format,
+        action='append',
+        metavar='FORMAT[:PRESET]')
+
+    parser.add_argument(
+        '--quality',
+        help="Encoder quality for lossy formats (1 to 100 for jpg, 0 to 100 "
+             "for webp), overriding the preset. Formats without a quality "
+             "setting ignore it.",
+        type=int)
+
+    parser.add_argument(
+        '--compression-level',
+        help="Encoder compression level (0 to 9 for png, 0 to 6 for webp), "
+             "overriding the preset.",
+        type=int,
+        metavar='LEVEL')
+
+    parser.add_argument(
+        '--report',
+        help="Print statistics about the render, including the peak memory "
+             "used by each stage, to stderr.",
+        action='store_true')
+
+    parser.add_argument(
+        '--memory-budget',
+        help="Fail the render if it uses more than this many MiB "
+             "(traced Python memory or resident set size) on top of what "
+             "the process started with.",
+        type=float,
+        metavar='MIB')
+
+    parser.add_argument(
+        '--save-prepared',
+        help="Also save the traced and prepared floorplan to this file. It can "
+             "be given as the floorplan for later renders with different "
+             "textures, tile sizes or formats.",
+        metavar='FILE')
+
+    parser.add_argument(
+        '--simplify',
+        help="Tolerance in px for simplifying the floorplan path before it is "
+             "used (default {}px, 0 to disable).".format(SIMPLIFY_TOLERANCE),
+        type=float,
+        default=SIMPLIFY_TOLERANCE,
+        metavar='PX')
+
+    parser.add_argument(
+        '--min-area',
+        help="Drop parts of the floorplan smaller than this many square px, eg. "
+             "specks in a scan (default {}).".format(SIMPLIFY_MIN_AREA),
+        type=float,
+        default=SIMPLIFY_MIN_AREA,
+        metavar='PX2')
+
+    parser.add_argument(
+        '--walls',
+        help="Also save the walls of the floorplan (before the hand drawn "
+             "jitter) as line segments, eg. for a virtual tabletop's dynamic "
+             "lighting. The file is JSON if its name ends in '.json', and a "
+             "compact binary format otherwise. Needs NumPy.",
+        metavar='FILE')
+
+    parser.add_argument(
+        '--occupancy',
+        help="Also save which grid squares are floor, eg. for token placement "
+             "or pathfinding: each square is walkable, partial or wall. The "
+             "file is a greyscale PNG with one pixel per square if its name "
+             "ends in '.png', and a packed grid of two bits per square "
+             "otherwise. Needs NumPy.",
+        metavar='FILE')
+
+    parser.add_argument(
+        '--region',
+        help="Only render this rectangle of the map (in floorplan px), given "
+             "as X,Y,WIDTH,HEIGHT.",
+        type=parse_region,
+        metavar='X,Y,W,H')
+
+    parser.add_argument(
+        '--tiles',
+        help="Write a Deep Zoom tile pyramid instead of a single image. The "
+             "output should then be a '.dzi' file; the tiles are written next "
+             "to it. The format must be png or jpg.",
+        action='store_true')
+
+    parser.add_argument(
+        '--tile-px',
+        help="The width and height of each tile in the pyramid (default 256).",
+        type=int,
+        default=256,
+        metavar='PX')
+
+    parser.add_argument(
+        '--workers',
+        help="The number of processes to render tiles with (default: one per "
+             "CPU), or to work out the outline of a very large floorplan with "
+             "(default: 1).",
+        type=int,
+        metavar='N')
+
+    parser.add_argument(
+        '--seed',
+        help="Seed for the hand drawn outline, so that the same floorplan "
+             "always gives the same map.",
+        type=int)
+
+    parser.add_argument(
+        '--texture-format',
+        help="Re-encode the textures in this format before embedding them, "
+             "eg. 'jpg:small' to make an SVG map smaller. By default they are "
+             "kept in their own format (but cropped to the map if they are "
+             "bigger).",
+        type=parse_texture_format,
+        default=textures.ORIGINAL_FORMAT,
+        metavar='FORMAT[:PRESET]')
+
+    parser.add_argument(
+        '--bake-shading',
+        help="Work out the wall shading now and embed it as an image, instead "
+             "of leaving an SVG filter for whatever displays the map. Much "
+             "quicker to display for large maps. Needs NumPy.",
+        action='store_true')
+
+    parser.add_argument(
+        '--scale',
+        help="Draw the map this much bigger or smaller than the floorplan "
+             "(default 1). Below 1, the textures, outline and shading are made "
+             "coarser to match, so the render is much quicker.",
+        type=float,
+        default=1.0,
+        metavar='FACTOR')
+
+    parser.add_argument(
+        '--preview',
+        help="Render a quick low resolution preview: --scale {} (unless "
+             "another scale is given), with the wall shading baked if NumPy is "
+             "installed.".format(PREVIEW_SCALE),
+        action='store_true')
+
+    parser.add_argument(
+        '--time-budget',
+        help="Try to finish the render in this many seconds, by lowering the "
+             "outline detail, baking the shading or lowering the scale if it "
+             "looks like it will take longer. --report lists what was "
+             "changed.",
+        type=float,
+        metavar='SECONDS')
+
+    parser.add_argument(
+        '--cache-dir',
+        help="Keep finished renders in this directory, and reuse them when "
+             "exactly the same render is asked for again. Renders are seeded "
+             "(see --seed) so that they can be reused.",
+        metavar='DIR')
+
+    parser.add_argument(
+        '--cache-size',
+        help="The most MiB to keep in the cache directory (default 1024). The "
+             "least recently used renders are removed first.",
+        type=float,
+        default=1024,
+        metavar='MIB')
+
+    parser.add_argument(
+        '--atlas',
+        help="Render this floorplan too, in the same map. Give this once for "
+             "each extra floorplan. The rooms are laid out on a grid, each in "
+             "its own layer, and share one copy of the textures and filters.",
+        action='append',
+        metavar='FLOORPLAN')
+
+    parser.add_argument(
+        '--atlas-columns',
+        help="The number of columns of rooms in an --atlas map (default: "
+             "roughly square).",
+        type=int,
+        metavar='N')
+
+    parser.add_argument(
+        '--incremental',
+        help="Keep the render state in this file and only redraw the parts of "
+             "the map around floorplan subpaths that changed since the last "
+             "render. The format must be png or jpg.",
+        metavar='STATE_FILE')
 
     args = parser.parse_args()
-    
-    return render_room_from_paths(
-        args.ground,
-        args.wall,
-        args.floorplan,
-        args.output,
-        args.tile_size,
-        args.format)
+
+    formats = args.format or ['svg']
+
+    if len(formats) != len(args.output):
+        parser.error("give one --format for each output")
+
+    if len(formats) == 1:
+        args.format = formats[0]
+        args.output = args.output[0]
+    elif args.tiles or args.incremental is not None:
+        parser.error("--tiles and --incremental only make one output")
+
+    if args.scale <= 0:
+        parser.error("--scale must be greater than zero")
+
+    try:
+        encoders.check_compression_level(args.compression_level)
+    except ValueError:
+        parser.error("--compression-level must be from 0 to {}".format(
+            encoders.MAX_COMPRESSION_LEVEL))
+
+    for spec in formats:
+        try:
+            encoders.check_quality(spec, args.quality)
+        except ValueError:
+            parser.error("--quality must be from {} to {} for {}".format(
+                *encoders.quality_range(spec),
+                encoders.parse_format(spec)[0]))
+
+    if args.preview:
+        if args.scale == 1:
+            args.scale = PREVIEW_SCALE
+
+        if not args.bake_shading:
+            # Baked shading is cheap at a small scale and spares whatever
+            # rasterises the map the filter, but it needs NumPy
+            from importlib.util import find_spec
+            args.bake_shading = find_spec('numpy') is not None
+
+    if args.scale != 1 and (args.tiles or args.incremental is not None):
+        parser.error("--scale and --preview can't be used with --tiles or "
+                     "--incremental")
+
+    if args.time_budget is not None:
+        if args.time_budget <= 0:
+            parser.error("--time-budget must be greater than zero")
+        if args.tiles or args.incremental is not None:
+            parser.error("--time-budget can't be used with --tiles or "
+                         "--incremental")
+
+    if args.atlas:
+        if (args.tiles or args.incremental is not None
+                or args.region is not None or args.time_budget is not None
+                or args.cache_dir is not None
+                or args.save_prepared is not None or args.walls is not None
+                or args.occupancy is not None):
+            parser.error("--atlas can't be used with --tiles, --incremental, "
+                         "--region, --time-budget, --cache-dir, "
+                         "--save-prepared, --walls or --occupancy")
+
+        if args.atlas_columns is not None and args.atlas_columns < 1:
+            parser.error("--atlas-columns must be at least 1")
+
+    report = {} if args.report else None
+
+    memory_budget = None
+    if args.memory_budget is not None:
+        memory_budget = int(args.memory_budget * MIB)
+
+    if args.tiles:
+        if not encoders.is_raster(args.format):
+            parser.error("--tiles needs a raster format")
+
+        try:
+            result = export_tiles_from_paths(args, report, memory_budget)
+        except MemoryBudgetExceeded as err:
+            parser.exit(1, '{}: {}\n'.format(parser.prog, err))
+
+        if report is not None:
+            for line in format_report(report):
+                print(line, file=sys.stderr)
+
+        return result
+
+    if args.incremental is not None:
+        if not encoders.is_raster(args.format):
+            parser.error("--incremental needs a raster format")
+        if args.region is not None:
+            parser.error("--incremental can't be used with --region")
+
+        try:
+            result = render_incremental_from_paths(args, report, memory_budget)
+        except MemoryBudgetExceeded as err:
+            parser.exit(1, '{}: {}\n'.format(parser.prog, err))
+
+        if report is not None:
+            for line in format_report(report):
+                print(line, file=sys.stderr)
+
+        return result
+
+    if args.atlas:
+        try:
+            result = render_atlas_from_paths(args, report, memory_budget)
+        except MemoryBudgetExceeded as err:
+            parser.exit(1, '{}: {}\n'.format(parser.prog, err))
+
+        if report is not None:
+            for line in format_report(report):
+                print(line, file=sys.stderr)
+
+        return result
+
+    cache = None
+    if args.cache_dir is not None:
+        from dumat.cache import RenderCache
+
+        cache = RenderCache(
+            args.cache_dir,
+            # Nothing lives long enough in this process to use the memory tier
+            memory_size=0,
+            disk_size=int(args.cache_size * MIB))
+
+    try:
+        result = render_room_from_paths(
+            args.ground,
+            args.wall,
+            args.floorplan,
+            args.output,
+            args.tile_size,
+            args.format,
+            report=report,
+            track_memory=args.report,
+            memory_budget=memory_budget,
+            prepared_path=args.save_prepared,
+            tolerance=args.simplify,
+            min_area=args.min_area,
+            region=args.region,
+            seed=args.seed,
+            shading='baked' if args.bake_shading else 'filter',
+            quality=args.quality,
+            compression_level=args.compression_level,
+            texture_format=args.texture_format,
+            scale=args.scale,
+            time_budget=args.time_budget,
+            cache=cache,
+            walls_path=args.walls,
+            occupancy_path=args.occupancy,
+            workers=1 if args.workers is None else args.workers)
+    except MemoryBudgetExceeded as err:
+        parser.exit(1, '{}: {}\n'.format(parser.prog, err))
+
+    if report is not None:
+        for line in format_report(report):
+            print(line, file=sys.stderr)
+
+    return result
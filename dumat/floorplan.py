@@ -0,0 +1,615 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+A floorplan that has already been traced and had its geometry worked out, so
+that it can be rendered many times with different textures, tile sizes and
+formats. Prepared floorplans can be saved to a compact binary file and loaded
+again in another process.
+"""
+from array import array
+from collections import OrderedDict
+import hashlib
+import random
+import struct
+import sys
+import zlib
+
+from dumat import cubicsuperpath, svgtools
+from dumat.spatial import GridIndex
+
+# Identifies a serialised prepared floorplan (the last byte is the version)
+PREPARED_MAGIC = b'DUMATPF\x02'
+
+# The start of the magic for every version, so that files of other versions
+# are recognised (and rejected with a clear error) rather than read as images
+PREPARED_PREFIX = PREPARED_MAGIC[:-1]
+
+# How many outline spacings to keep densified outlines for, most recently used
+DENSIFIED_CACHE_SIZE = 4
+
+# How many sets of jittered outline subpaths (as many as there are subpaths)
+# to keep, most recently used
+OUTLINE_CACHE_VARIANTS = 4
+
+# Maximum length of straight segments in the densified outline at full size
+# (relative to the tile size)
+OUTLINE_SPACING_SCALE = 0.5
+
+# Jitter smaller than this (in px) is barely visible, so the outline spacing is
+# stretched out to save nodes
+OUTLINE_VISIBLE_JITTER = 0.5
+
+# How much bends shorten the outline segments (see add_nodes_to_path)
+OUTLINE_CURVATURE = 1.0
+
+# Each node in a cubicsuperpath is three points of two coordinates
+NODE_COORDS = 6
+
+
+def is_prepared(data):
+    """
+    Returns True if the buffer holds a serialised prepared floorplan, of any
+    version.
+    """
+    return bytes(data[:len(PREPARED_PREFIX)]) == PREPARED_PREFIX
+
+
+def _remember(cache, key, value, size):
+    """
+    Adds an entry to an OrderedDict used as a least recently used cache, and
+    forgets the oldest entries if there are more than "size".
+    """
+    cache[key] = value
+    cache.move_to_end(key)
+
+    while len(cache) > size:
+        cache.popitem(last=False)
+
+    return value
+
+
+def outline_spacing(tile_size, jitter_radius, scale=1.0, detail=1.0):
+    """
+    Returns the maximum length of straight segments in the densified outline,
+    or None if the outline doesn't need densifying at all. Jitter only needs
+    node spacing proportional to the tile size. A map drawn smaller than full
+    size (scale below 1) can have segments that are as long in output px as
+    they would be at full size, so the spacing grows as the scale shrinks; if
+    the jitter is too small to see at that scale, it grows further still. A
+    detail below 1 stretches the spacing too, to save time at some cost to the
+    look of the outline.
+    """
+    if jitter_radius <= 0:
+        return None
+
+    spacing = OUTLINE_SPACING_SCALE * tile_size
+    stretch = 1.0 / scale if scale < 1 else 1.0
+    visible_jitter = jitter_radius * scale
+
+    if visible_jitter < OUTLINE_VISIBLE_JITTER:
+        stretch = max(stretch, OUTLINE_VISIBLE_JITTER / visible_jitter)
+
+    return spacing * stretch / detail
+
+
+def subpath_hash(subpath):
+    """
+    Returns a hash of the content of a cubicsuperpath subpath. Identical
+    subpaths have identical hashes, wherever they are in the path.
+    """
+    coords = array('d', (value for node in subpath for point in node for value in point))
+    return hashlib.blake2b(coords.tobytes(), digest_size=16).hexdigest()
+
+
+def _select(p, subpaths):
+    """
+    Returns the given subpaths (by number) of a cubicsuperpath, or all of them
+    if subpaths is None.
+    """
+    if subpaths is None:
+        return p
+    return [p[number] for number in subpaths]
+
+
+def _copies(p, subpaths):
+    """
+    Yields a copy of each of the given subpaths (by number) of a
+    cubicsuperpath, that can be modified without affecting the original.
+    """
+    for number in subpaths:
+        yield svgtools.copy_csp([p[number]])[0]
+
+
+def csp_coords(p):
+    """
+    Returns the number of nodes in each subpath of a cubicsuperpath and all of
+    its coordinates, as arrays (in native byte order).
+    """
+    lengths = array('I', (len(subpath) for subpath in p))
+    coords = array('d', (
+        value
+        for subpath in p
+        for node in subpath
+        for point in node
+        for value in point
+    ))
+    return lengths, coords
+
+
+def csp_from_coords(lengths, coords):
+    """ Builds a cubicsuperpath from the arrays returned by csp_coords(). """
+    p = []
+    pos = 0
+    for length in lengths:
+        subpath = []
+        for _ in range(length):
+            subpath.append([
+                [coords[pos], coords[pos + 1]],
+                [coords[pos + 2], coords[pos + 3]],
+                [coords[pos + 4], coords[pos + 5]],
+            ])
+            pos += NODE_COORDS
+        p.append(subpath)
+
+    return p
+
+
+def _pack_csp(p):
+    """ Packs a cubicsuperpath into bytes (little endian). """
+    lengths, coords = csp_coords(p)
+
+    if sys.byteorder != 'little':
+        lengths.byteswap()
+        coords.byteswap()
+
+    return (
+        struct.pack('<I', len(lengths))
+        + lengths.tobytes()
+        + coords.tobytes()
+    )
+
+
+def _unpack_csp(data, offset):
+    """
+    Unpacks a cubicsuperpath packed by _pack_csp() starting at the given
+    offset. Returns the path and the offset just past it.
+    """
+    (count,) = struct.unpack_from('<I', data, offset)
+    offset += 4
+
+    lengths = array('I')
+    lengths.frombytes(data[offset:offset + count * lengths.itemsize])
+    offset += count * lengths.itemsize
+
+    total = sum(lengths) * NODE_COORDS
+    coords = array('d')
+    coords.frombytes(data[offset:offset + total * coords.itemsize])
+    offset += total * coords.itemsize
+
+    if sys.byteorder != 'little':
+        lengths.byteswap()
+        coords.byteswap()
+
+    return csp_from_coords(lengths, coords), offset
+
+
+class PreparedFloorplan(object):
+    """
+    The geometry of a floorplan with all the work that doesn't depend on the
+    textures or output format already done: tracing, fusing transforms and
+    inverting the floor for the walls. The densified outline depends on the
+    tile size, so it is worked out on demand and kept for the last few tile
+    sizes. All paths are stored as cubicsuperpaths.
+    """
+
+    def __init__(self, width, height, floor, inverted):
+        """
+        @param width the width of the floorplan in px
+        @param height the height of the floorplan in px
+        @param floor the floor area
+        @param inverted the wall area (everything but the floor)
+        """
+        self.width = width
+        self.height = height
+        self.floor = floor
+        self.inverted = inverted
+        self._densified = OrderedDict()
+        self._index = None
+        self._hashes = None
+
+        # Jittered outline subpaths, keyed by (subpath hash, outline spacing,
+        # jitter radius, seed), least recently used first. Only seeded
+        # outlines are repeatable, so only they are kept, and only for the
+        # last OUTLINE_CACHE_VARIANTS settings or so. This can be filled in
+        # from an earlier render (see dumat.incremental) to reuse its
+        # geometry.
+        self.outline_cache = OrderedDict()
+
+        # How many processes to outline very large floors with (see
+        # dumat.parallel); 1 (the default) to never start any, None for one
+        # per CPU
+        self.workers = 1
+
+    @classmethod
+    def from_path(cls, path_string, width, height):
+        """
+        Prepares a floorplan from the "d" attribute of its (fused) floor path,
+        as returned by extract_image_path().
+        """
+        bounding_path = svgtools.create_bounding_path(width, height)
+        inverted_path = svgtools.path_difference(bounding_path, path_string)
+
+        return cls(
+            width,
+            height,
+            cubicsuperpath.parsePath(path_string),
+            cubicsuperpath.parsePath(inverted_path)
+        )
+
+    @property
+    def index(self):
+        """
+        A spatial index (GridIndex) of the bounding boxes of the floor
+        subpaths, built the first time it's needed. Item numbers are the
+        positions of the subpaths in self.floor.
+        """
+        if self._index is None:
+            self._index = GridIndex.from_csp(self.floor)
+        return self._index
+
+    def subpaths_in(self, bbox):
+        """
+        Returns the numbers of the floor subpaths whose bounding boxes overlap
+        the given one (x0, y0, x1, y1). Subpaths whose boxes don't overlap it
+        can't affect what's drawn there: they have no winding around any point
+        inside it.
+        """
+        return self.index.query(bbox)
+
+    def bounding_path(self):
+        """ Returns the "d" attribute of a rectangle around the floorplan. """
+        return svgtools.create_bounding_path(self.width, self.height)
+
+    def floor_path(self, subpaths=None):
+        """
+        Returns the "d" attribute of the floor area. If a list of subpath
+        numbers is given, only those subpaths are included.
+        """
+        return cubicsuperpath.formatPath(
+            _select(self.floor, subpaths),
+            terminate=True
+        )
+
+    def inverted_path(self):
+        """ Returns the "d" attribute of the wall area. """
+        return cubicsuperpath.formatPath(self.inverted, terminate=True)
+
+    def densified_outline(self, tile_size, jitter_radius, scale=1.0, detail=1.0):
+        """
+        Returns the floor outline as a cubicsuperpath with enough nodes for
+        jittering by the given radius to look hand drawn (see
+        outline_spacing). Don't modify it; it is kept for later renders.
+        """
+        return self._densified_at(
+            outline_spacing(tile_size, jitter_radius, scale, detail)
+        )
+
+    def _densified_at(self, spacing):
+        """ As for densified_outline(), for a given outline spacing. """
+        if spacing is None:
+            return self.floor
+
+        if spacing in self._densified:
+            self._densified.move_to_end(spacing)
+            return self._densified[spacing]
+
+        return _remember(
+            self._densified,
+            spacing,
+            svgtools.add_nodes_to_csp(
+                svgtools.copy_csp(self.floor),
+                'adaptive',
+                max_length=spacing,
+                curvature=OUTLINE_CURVATURE
+            ),
+            DENSIFIED_CACHE_SIZE
+        )
+
+    def subpath_hashes(self):
+        """ Returns the content hash of each floor subpath, in order. """
+        if self._hashes is None:
+            self._hashes = [subpath_hash(subpath) for subpath in self.floor]
+        return self._hashes
+
+    def outline_subpath(
+            self,
+            number,
+            tile_size,
+            jitter_radius,
+            seed,
+            scale=1.0,
+            detail=1.0):
+        """
+        Returns one subpath of the hand drawn outline, densified and jittered
+        with a random generator seeded from "seed" and the subpath's content.
+        An unchanged subpath therefore always comes out the same, even if the
+        rest of the floorplan changes. Don't modify the result; it is cached.
+        """
+        return self._outline_subpath_at(
+            number,
+            outline_spacing(tile_size, jitter_radius, scale, detail),
+            jitter_radius,
+            seed
+        )
+
+    def _outline_subpath_at(self, number, spacing, jitter_radius, seed):
+        """ As for outline_subpath(), for a given outline spacing. """
+        key = self._outline_key(number, spacing, jitter_radius, seed)
+
+        if key in self.outline_cache:
+            self.outline_cache.move_to_end(key)
+        else:
+            if spacing is None:
+                subpath = svgtools.copy_csp([self.floor[number]])
+            elif spacing in self._densified:
+                subpath = svgtools.copy_csp([self._densified[spacing][number]])
+            else:
+                # Only densify this subpath, not the whole floorplan
+                subpath = svgtools.add_nodes_to_csp(
+                    svgtools.copy_csp([self.floor[number]]),
+                    'adaptive',
+                    max_length=spacing,
+                    curvature=OUTLINE_CURVATURE
+                )
+
+            svgtools.jitter_csp(
+                subpath,
+                end=True,
+                ctrl=True,
+                radiusx=jitter_radius,
+                radiusy=jitter_radius,
+                norm=False,
+                rng=random.Random('{}:{}'.format(seed, key[0]))
+            )
+
+            self._remember_outline(key, subpath[0])
+
+        return self.outline_cache[key]
+
+    def _remember_outline(self, key, subpath):
+        """ Adds a jittered subpath to outline_cache, forgetting old ones. """
+        _remember(
+            self.outline_cache,
+            key,
+            subpath,
+            OUTLINE_CACHE_VARIANTS * max(len(self.floor), 1)
+        )
+
+    def _outline_key(self, number, spacing, jitter_radius, seed):
+        """ Returns the outline_cache key for a subpath's outline. """
+        return (self.subpath_hashes()[number], spacing, jitter_radius, seed)
+
+    def outline(
+            self,
+            tile_size,
+            jitter_radius,
+            subpaths=None,
+            seed=None,
+            scale=1.0,
+            detail=1.0):
+        """
+        Returns the hand drawn outline of the floor as a cubicsuperpath, with
+        nodes randomly moved by up to the given radius. If a list of subpath
+        numbers is given, only those subpaths are included. If a seed is
+        given, the jitter is repeatable (see outline_subpath). Very large
+        floors are outlined in several processes if "workers" allows it (see
+        dumat.parallel). The scale and detail set how many nodes the outline
+        has (see outline_spacing). The densified outline is kept for later
+        calls.
+        """
+        if seed is None and not self._should_parallelise(subpaths):
+            self._densified_at(
+                outline_spacing(tile_size, jitter_radius, scale, detail)
+            )
+
+        return list(self.iter_outline(
+            tile_size,
+            jitter_radius,
+            subpaths,
+            seed,
+            scale,
+            detail
+        ))
+
+    def iter_outline(
+            self,
+            tile_size,
+            jitter_radius,
+            subpaths=None,
+            seed=None,
+            scale=1.0,
+            detail=1.0):
+        """
+        As for outline(), but yields the subpaths one at a time. Without a
+        seed, each subpath is densified and jittered as it is asked for (from
+        the kept densified outline, if there is one) and nothing is kept, so
+        memory use doesn't grow with the size of the outline. Don't modify
+        the subpaths; seeded ones are cached.
+        """
+        spacing = outline_spacing(tile_size, jitter_radius, scale, detail)
+
+        if subpaths is None:
+            subpaths = range(len(self.floor))
+
+        if seed is not None:
+            missing = [
+                number for number in subpaths
+                if self._outline_key(number, spacing, jitter_radius, seed)
+                not in self.outline_cache
+            ]
+
+            if self._should_parallelise(missing):
+                hashes = self.subpath_hashes()
+                outline = self._parallel_outline(
+                    missing,
+                    spacing,
+                    jitter_radius,
+                    ['{}:{}'.format(seed, hashes[number]) for number in missing]
+                )
+
+                for number, subpath in zip(missing, outline):
+                    key = self._outline_key(number, spacing, jitter_radius, seed)
+                    self._remember_outline(key, subpath)
+
+            for number in subpaths:
+                yield self._outline_subpath_at(number, spacing, jitter_radius, seed)
+
+            return
+
+        if self._should_parallelise(subpaths):
+            # Still random, but each subpath needs its own generator so that
+            # the result doesn't depend on which process jittered it
+            base = random.getrandbits(64)
+
+            yield from self._parallel_outline(
+                subpaths,
+                spacing,
+                jitter_radius,
+                ['{}:{}'.format(base, number) for number in subpaths]
+            )
+            return
+
+        if spacing is None:
+            outline = _copies(self.floor, subpaths)
+        elif spacing in self._densified:
+            outline = _copies(self._densified[spacing], subpaths)
+        else:
+            outline = svgtools.densify_subpaths(
+                _copies(self.floor, subpaths),
+                'adaptive',
+                max_length=spacing,
+                curvature=OUTLINE_CURVATURE
+            )
+
+        yield from svgtools.jitter_subpaths(
+            outline,
+            end=True,
+            ctrl=True,
+            radiusx=jitter_radius,
+            radiusy=jitter_radius,
+            norm=False
+        )
+
+    def _should_parallelise(self, subpaths):
+        """
+        Returns True if outlining the given subpaths (by number, or None for
+        all of them) is worth doing in several processes.
+        """
+        if self.workers == 1:
+            return False
+
+        from dumat import parallel
+
+        return parallel.should_parallelise(_select(self.floor, subpaths), self.workers)
+
+    def _parallel_outline(self, subpaths, spacing, jitter_radius, seeds):
+        """
+        Densifies and jitters the given subpaths (by number) in several
+        processes, each with a random generator seeded from the matching seed.
+        """
+        from dumat import parallel
+
+        if spacing in self._densified:
+            # Already densified, so only jitter
+            source = _select(self._densified[spacing], subpaths)
+            spacing = None
+        else:
+            source = _select(self.floor, subpaths)
+
+        return parallel.parallel_outline(
+            source,
+            spacing,
+            OUTLINE_CURVATURE,
+            jitter_radius,
+            seeds,
+            self.workers
+        )
+
+    def outline_path(
+            self,
+            tile_size,
+            jitter_radius,
+            subpaths=None,
+            seed=None,
+            scale=1.0,
+            detail=1.0):
+        """
+        As for outline(), but returns the "d" attribute of a path. The
+        outline is formatted as it is made (see iter_outline).
+        """
+        return cubicsuperpath.formatPath(self.iter_outline(
+            tile_size,
+            jitter_radius,
+            subpaths,
+            seed,
+            scale,
+            detail
+        ))
+
+    def to_bytes(self):
+        """ Serialises the prepared floorplan to a compact byte string. """
+        payload = (
+            struct.pack('<dd', self.width, self.height)
+            + _pack_csp(self.floor)
+            + _pack_csp(self.inverted)
+        )
+
+        return PREPARED_MAGIC + zlib.compress(payload)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Loads a prepared floorplan serialised by to_bytes(). """
+        if not is_prepared(data):
+            raise ValueError("Not a prepared floorplan")
+
+        version = bytes(data[len(PREPARED_PREFIX):len(PREPARED_MAGIC)])
+        if version != PREPARED_MAGIC[len(PREPARED_PREFIX):]:
+            raise ValueError(
+                "Unsupported prepared floorplan version {}".format(
+                    version[0] if version else 'unknown'
+                )
+            )
+
+        payload = zlib.decompress(data[len(PREPARED_MAGIC):])
+
+        width, height = struct.unpack_from('<dd', payload, 0)
+        offset = struct.calcsize('<dd')
+
+        floor, offset = _unpack_csp(payload, offset)
+        inverted, offset = _unpack_csp(payload, offset)
+
+        return cls(width, height, floor, inverted)
+
+    def save(self, path):
+        """ Writes the prepared floorplan to a file. """
+        with open(path, 'wb') as output:
+            output.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a prepared floorplan from a file written by save(). """
+        with open(path, 'rb') as source:
+            return cls.from_bytes(source.read())
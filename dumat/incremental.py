@@ -0,0 +1,332 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Incremental re-rendering after a floorplan has been edited.
+
+The floorplan is still traced in full, but its subpaths are compared with the
+ones from the previous render by content hash. The jittered outlines of the
+subpaths that didn't change are reused as they are (the jitter is seeded per
+subpath, so they would come out the same anyway), and only the rectangles
+around the subpaths that were added or removed are rasterised again and pasted
+into the previous raster.
+
+The state kept between renders (RenderState) holds the subpath hashes and
+bounding boxes, the outline geometry and the raster itself. It is saved with
+pickle, so only load state files you wrote yourself.
+"""
+from collections import Counter
+import hashlib
+from io import BytesIO
+from math import ceil, floor
+import pickle
+
+from dumat import encoders, excavate
+from dumat.floorplan import PreparedFloorplan
+
+# Identifies a saved render state (the last byte is the version)
+STATE_MAGIC = b'DUMATRS\x01'
+
+# If the dirty rectangles cover more than this fraction of the map, it's
+# quicker to render the whole thing again
+FULL_RENDER_FRACTION = 0.5
+
+# The seed used when none is given; incremental renders need a fixed one
+DEFAULT_SEED = 0
+
+
+class RenderState(object):
+    """ Everything about a render that the next incremental render can reuse. """
+
+    def __init__(self, key, width, height, bboxes, outlines, raster):
+        """
+        @param key identifies the inputs other than the floorplan (see
+               render_key); a state is only reused for the same key
+        @param bboxes a dict of subpath hash to a list of the bounding boxes
+               of the subpaths with that hash
+        @param outlines the PreparedFloorplan outline cache
+        @param raster the rendered map as PNG data
+        """
+        self.key = key
+        self.width = width
+        self.height = height
+        self.bboxes = bboxes
+        self.outlines = outlines
+        self.raster = raster
+
+    def to_bytes(self):
+        """ Serialises the state. """
+        return STATE_MAGIC + pickle.dumps(
+            self.__dict__,
+            protocol=pickle.HIGHEST_PROTOCOL
+        )
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Loads a state serialised by to_bytes(). """
+        if bytes(data[:len(STATE_MAGIC)]) != STATE_MAGIC:
+            raise ValueError("Not a render state")
+
+        state = cls.__new__(cls)
+        state.__dict__.update(pickle.loads(data[len(STATE_MAGIC):]))
+        return state
+
+    def save(self, path):
+        """ Writes the state to a file. """
+        with open(path, 'wb') as output:
+            output.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a state from a file written by save(). """
+        with open(path, 'rb') as source:
+            return cls.from_bytes(source.read())
+
+
+def render_key(prepared, ground_data, wall_data, tile_size, seed, shading):
+    """
+    Returns a hash of everything other than the floorplan subpaths that
+    affects a render. If any of it changes, nothing can be reused.
+    """
+    key = hashlib.blake2b(digest_size=16)
+
+    settings = (prepared.width, prepared.height, tile_size, seed, shading)
+
+    for part in (
+            repr(settings).encode('ascii'),
+            ground_data,
+            wall_data):
+        key.update(hashlib.blake2b(part, digest_size=16).digest())
+
+    return key.hexdigest()
+
+
+def subpath_bboxes(prepared):
+    """
+    Returns a dict of subpath hash to a list of the bounding boxes of the
+    floor subpaths with that hash.
+    """
+    bboxes = {}
+
+    for subpath_hash, bbox in zip(prepared.subpath_hashes(), prepared.index.bboxes):
+        bboxes.setdefault(subpath_hash, []).append(bbox)
+
+    return bboxes
+
+
+def changed_bboxes(old, new):
+    """
+    Returns the bounding boxes of the subpaths that are in one of the given
+    hash to bounding box dicts but not the other, and the number of subpaths
+    that are in both.
+    """
+    old_counts = Counter({key: len(boxes) for key, boxes in old.items()})
+    new_counts = Counter({key: len(boxes) for key, boxes in new.items()})
+
+    changed = []
+
+    for boxes, others in ((old, new_counts), (new, old_counts)):
+        for key, key_boxes in boxes.items():
+            if len(key_boxes) != others[key]:
+                # Identical subpaths in different numbers; redraw all of them
+                changed.extend(key_boxes)
+
+    reused = sum(
+        count for key, count in new_counts.items() if old_counts[key] == count
+    )
+
+    return changed, reused
+
+
+def dirty_rects(bboxes, padding, width, height):
+    """
+    Returns the rectangles (x, y, width, height) that need rendering again for
+    the given changed bounding boxes: each box is padded, snapped out to whole
+    px and clipped to the map, and overlapping rectangles are merged.
+    """
+    rects = []
+
+    for x0, y0, x1, y1 in bboxes:
+        rect = [
+            max(floor(x0 - padding), 0),
+            max(floor(y0 - padding), 0),
+            min(ceil(x1 + padding), width),
+            min(ceil(y1 + padding), height),
+        ]
+
+        if rect[0] >= rect[2] or rect[1] >= rect[3]:
+            continue
+
+        # Merge with everything it overlaps until nothing does
+        merged = True
+        while merged:
+            merged = False
+            for other in rects:
+                if (rect[0] < other[2] and other[0] < rect[2]
+                        and rect[1] < other[3] and other[1] < rect[3]):
+                    rects.remove(other)
+                    rect = [
+                        min(rect[0], other[0]),
+                        min(rect[1], other[1]),
+                        max(rect[2], other[2]),
+                        max(rect[3], other[3]),
+                    ]
+                    merged = True
+                    break
+
+        rects.append(rect)
+
+    return [(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in rects]
+
+
+def render_incremental(
+        floorplan,
+        ground_data,
+        wall_data,
+        tile_size,
+        format='png',
+        previous=None,
+        seed=DEFAULT_SEED,
+        report=None,
+        tolerance=excavate.SIMPLIFY_TOLERANCE,
+        min_area=excavate.SIMPLIFY_MIN_AREA,
+        shading='filter',
+        quality=None,
+        compression_level=None,
+        memory_budget=None):
+    """
+    Renders the map, reusing as much as possible of a previous render. Returns
+    the image data, its MIME type and a RenderState for the next render.
+
+    @param floorplan a PreparedFloorplan, or floorplan data to prepare
+    @param format the output format, any raster format from dumat.encoders;
+           the cached raster is always kept as PNG so that repeated edits
+           don't lose quality
+    @param previous the RenderState returned by the previous render, or None
+           to render everything
+    @param seed the outline jitter seed; it must be the same for every render
+    @param report if not None, a dictionary that is filled in with statistics
+           about the render, including which parts were reused
+    @param shading 'filter' or 'baked' (see excavate.render_room)
+    @param quality the encoder quality, overriding the format's preset
+    @param compression_level the encoder compression level, overriding the
+           format's preset
+    @param memory_budget if not None, the most bytes the full render, or each
+           dirty rectangle, may use (see excavate.render_room)
+    """
+    from PIL import Image
+
+    if not encoders.is_raster(format):
+        raise ValueError('Incremental renders need a raster format')
+
+    if not isinstance(floorplan, PreparedFloorplan):
+        floorplan = excavate.prepare_floorplan(
+            floorplan,
+            tolerance,
+            min_area,
+            report
+        )
+
+    key = render_key(
+        floorplan,
+        ground_data,
+        wall_data,
+        tile_size,
+        seed,
+        shading
+    )
+    bboxes = subpath_bboxes(floorplan)
+    width = int(ceil(floorplan.width))
+    height = int(ceil(floorplan.height))
+
+    rects = None
+
+    if previous is not None and previous.key == key:
+        # Reuse the outlines of the unchanged subpaths
+        floorplan.outline_cache.update(previous.outlines)
+
+        changed, reused = changed_bboxes(previous.bboxes, bboxes)
+        rects = dirty_rects(
+            changed,
+            excavate.shading_padding(tile_size),
+            width,
+            height
+        )
+
+        dirty_area = sum(rect[2] * rect[3] for rect in rects)
+        if dirty_area > FULL_RENDER_FRACTION * width * height:
+            rects = None
+
+    if rects is None:
+        raster, _ = excavate.render_prepared(
+            floorplan,
+            ground_data,
+            wall_data,
+            tile_size,
+            'png',
+            seed=seed,
+            shading=shading,
+            memory_budget=memory_budget)
+        changed, reused = [], 0
+    elif rects:
+        image = Image.open(BytesIO(previous.raster))
+        image.load()
+
+        for rect in rects:
+            region_data, _ = excavate.render_region(
+                *rect,
+                floorplan,
+                ground_data,
+                wall_data,
+                tile_size,
+                'png',
+                seed=seed,
+                shading=shading,
+                memory_budget=memory_budget)
+
+            region = Image.open(BytesIO(region_data))
+            if region.mode != image.mode:
+                region = region.convert(image.mode)
+            image.paste(region, rect[:2])
+
+        output = BytesIO()
+        image.save(output, 'PNG')
+        raster = output.getvalue()
+    else:
+        raster = previous.raster
+
+    if report is not None:
+        report['full_render'] = rects is None
+        report['dirty_rects'] = len(rects or ())
+        report['changed_subpaths'] = len(changed)
+        report['reused_subpaths'] = reused
+
+    # Only keep the outlines of the current subpaths
+    hashes = set(bboxes)
+    outlines = {
+        cache_key: subpath
+        for cache_key, subpath in floorplan.outline_cache.items()
+        if cache_key[0] in hashes and cache_key[3] == seed
+    }
+
+    state = RenderState(key, width, height, bboxes, outlines, raster)
+    data, mime_type = encoders.encode_image(
+        Image.open(BytesIO(raster)),
+        format,
+        quality,
+        compression_level
+    )
+
+    return data, mime_type, state
@@ -0,0 +1,137 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Reading the paths of an SVG floorplan without building a document for it.
+
+SVG files saved by editors are often several MB, mostly embedded images and
+metadata that the floorplan doesn't need. Rather than parsing all of that into
+a BeautifulSoup document, the file is read with lxml's "iterparse": the root
+element's size and each rendered <path> (with the transforms of the elements
+around it) are picked out as they go past, and every element is thrown away
+as soon as it has been read, so memory stays flat however big the file is.
+Reading stops at the end of the root element.
+"""
+from dumat import buffers, cubicsuperpath, svgtools
+
+# Paths inside these SVG elements aren't drawn directly, so they aren't part of
+# the floorplan
+NON_RENDERED_ELEMENTS = frozenset((
+    'defs', 'clipPath', 'mask', 'pattern', 'symbol', 'marker', 'metadata'
+))
+
+# The identity transform, at the root of the document
+IDENTITY = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
+
+
+def local_name(tag):
+    """ Returns an element tag without its namespace, eg. 'path'. """
+    return tag.rpartition('}')[2]
+
+
+def _forget(element):
+    """
+    Frees an element that has been read, along with the siblings before it
+    (which have been read too).
+    """
+    element.clear()
+
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def read_svg_floorplan(svg_data):
+    """
+    Reads an SVG floorplan. Returns its width, its height and a cubicsuperpath
+    of the subpaths of every rendered path in it, with their transforms
+    applied.
+
+    @param svg_data a buffer of SVG data
+    """
+    from lxml import etree
+
+    events = etree.iterparse(
+        buffers.BufferReader(svg_data),
+        events=('start', 'end'),
+        remove_comments=True,
+        remove_pis=True,
+        # Embedded images can be bigger than lxml allows by default
+        huge_tree=True,
+        # Be as forgiving as BeautifulSoup was
+        recover=True
+    )
+
+    size = None
+    subpaths = []
+
+    # The transform for the children of each open element, and how many of
+    # the open elements aren't rendered
+    transforms = [IDENTITY]
+    hidden = 0
+
+    try:
+        for event, element in events:
+            if not isinstance(element.tag, str):
+                # Entities and the like
+                continue
+
+            name = local_name(element.tag)
+
+            if event == 'start':
+                if size is None:
+                    if name != 'svg':
+                        raise ValueError("Floorplan is not an SVG file")
+
+                    if element.get('width') is None or element.get('height') is None:
+                        raise ValueError("SVG floorplan has no width or height")
+
+                    size = (float(element.get('width')), float(element.get('height')))
+
+                transform = svgtools.parseTransform(
+                    element.get('transform', ''),
+                    transforms[-1]
+                )
+                transforms.append(transform)
+
+                if name in NON_RENDERED_ELEMENTS:
+                    hidden += 1
+
+                if name == 'path' and not hidden and element.get('d'):
+                    subpaths.extend(svgtools.transform_subpaths(
+                        transform,
+                        cubicsuperpath.iterParsePath(element.get('d'))
+                    ))
+            else:
+                transforms.pop()
+
+                if name in NON_RENDERED_ELEMENTS:
+                    hidden -= 1
+
+                if len(transforms) == 1:
+                    # The end of the root element
+                    break
+
+                _forget(element)
+    except etree.XMLSyntaxError as err:
+        raise ValueError("Cannot read SVG floorplan: {}".format(err))
+
+    if size is None:
+        raise ValueError("Cannot extract path from floorplan file")
+
+    width, height = size
+
+    return width, height, subpaths
@@ -0,0 +1,293 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Peak memory accounting for the stages of a render. Python allocations are
+measured with "tracemalloc"; memory held outside the Python heap (eg. by
+ImageMagick while rasterising) only shows up in the resident set size, so that
+is sampled by a background thread while each stage runs, and its peak is
+recorded as well.
+
+Both are measured from when tracking started, so the budget covers what the
+render itself allocates rather than the interpreter and whatever the caller
+already had loaded. The budget is checked cooperatively: before and after
+every stage, and wherever long running code calls MemoryTracker.check().
+Native code can't be stopped partway, so ImageMagick is given its own limit
+(see imagemagick_limit()).
+"""
+from contextlib import contextmanager
+import os
+import sys
+import threading
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Bytes in a mebibyte, used for human readable reports
+MIB = 1024 * 1024
+
+# Seconds between samples of the resident set size during a stage
+SAMPLE_INTERVAL = 0.005
+
+
+class MemoryBudgetExceeded(RuntimeError):
+    """ Raised when a render stage goes over the configured memory budget. """
+
+
+def current_rss():
+    """
+    Returns the current resident set size of this process in bytes, or None if
+    it can't be determined on this platform.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    # Fall back to the peak RSS, which is at least an upper bound
+    return peak_rss()
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size this process has ever had in bytes, or
+    None if it can't be determined on this platform.
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+@contextmanager
+def imagemagick_limit(limit):
+    """
+    Limits how much memory ImageMagick may allocate in the body of the "with"
+    block, and stops it spilling to disk instead. Going over the limit raises
+    MemoryBudgetExceeded.
+
+    @param limit the most bytes ImageMagick may allocate, or None for no limit
+           (in which case nothing is changed)
+    """
+    if limit is None:
+        yield
+        return
+
+    from wand.exceptions import CacheError, ResourceLimitError
+    from wand.resource import limits
+
+    saved_limits = {name: limits[name] for name in ('memory', 'disk')}
+    limits['memory'] = limit
+    limits['disk'] = 0
+
+    try:
+        yield
+    except (CacheError, ResourceLimitError) as err:
+        raise MemoryBudgetExceeded(
+            "Rasterising needs more than the {:.1f} MiB left in the memory "
+            "budget ({})".format(limit / MIB, err)
+        )
+    finally:
+        for name, value in saved_limits.items():
+            limits[name] = value
+
+
+class _RSSSampler(threading.Thread):
+    """ Samples the resident set size until stopped, keeping the peak. """
+
+    def __init__(self):
+        super(_RSSSampler, self).__init__(name='dumat-rss-sampler', daemon=True)
+        self.peak = current_rss()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            rss = current_rss()
+
+            if rss is None:
+                return
+
+            self.peak = max(self.peak or 0, rss)
+
+    def stop(self):
+        """ Stops sampling. """
+        self._stop_event.set()
+        self.join()
+
+
+class MemoryTracker(object):
+    """
+    Records the peak traced Python memory and the resident set size for each
+    stage of a render. Use it as a context manager around the whole render and
+    wrap each stage in "stage()":
+
+        with MemoryTracker(budget=512 * MIB) as tracker:
+            with tracker.stage('trace'):
+                ...
+
+    If tracking is disabled, the stages cost nothing and nothing is recorded.
+    """
+
+    def __init__(self, budget=None, enabled=True):
+        """
+        @param budget the maximum number of bytes the render may use on top of
+               what the process used when tracking started (either as traced
+               peak or as peak resident set size), or None for no limit
+        @param enabled whether to do any tracking at all
+        """
+        self.budget = budget
+        self.enabled = enabled or budget is not None
+        self.stages = []
+        self.base_rss = None
+        self.base_traced = 0
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.enabled:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+
+            self.base_traced, _ = tracemalloc.get_traced_memory()
+            self.base_rss = current_rss()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    def _rss_used(self, rss):
+        """ Returns how much of an RSS measurement counts against the budget. """
+        if rss is None or self.base_rss is None:
+            return None
+        return max(rss - self.base_rss, 0)
+
+    def headroom(self):
+        """
+        Returns how many more bytes the render can take before going over the
+        budget, for native code that needs its own limit, or None if there is
+        no budget (or the resident set size can't be determined).
+        """
+        if self.budget is None:
+            return None
+
+        used = self._rss_used(current_rss())
+        if used is None:
+            return None
+
+        return max(self.budget - used, 0)
+
+    def check(self, name=None):
+        """
+        Raises MemoryBudgetExceeded if the render is using more than the budget
+        right now. Long running stages can call this between steps to stop
+        early.
+
+        @param name the stage being checked, for the message
+        """
+        if self.budget is None:
+            return
+
+        traced, _ = tracemalloc.get_traced_memory()
+        used = max(
+            traced - self.base_traced,
+            self._rss_used(current_rss()) or 0
+        )
+
+        if used > self.budget:
+            self._exceeded(name, used)
+
+    def _exceeded(self, name, used):
+        """ Raises MemoryBudgetExceeded for the given stage. """
+        what = 'Render' if name is None else "Render stage '{}'".format(name)
+        raise MemoryBudgetExceeded(
+            "{} used {:.1f} MiB, over the budget of {:.1f} MiB".format(
+                what,
+                used / MIB,
+                self.budget / MIB
+            )
+        )
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Tracks the memory used while the body of the "with" block runs. Raises
+        MemoryBudgetExceeded before the stage starts if the render is already
+        over budget, and after it finishes if the stage took it over.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        self.check(name)
+
+        tracemalloc.reset_peak()
+        lifetime_peak = peak_rss()
+        sampler = _RSSSampler()
+        sampler.start()
+
+        try:
+            yield
+        finally:
+            sampler.stop()
+
+        _, peak = tracemalloc.get_traced_memory()
+        peak = max(peak - self.base_traced, 0)
+        rss = max(sampler.peak or 0, current_rss() or 0) or None
+
+        # A new lifetime peak can only have been reached during this stage,
+        # and catches spikes between samples
+        new_lifetime_peak = peak_rss()
+        if new_lifetime_peak is not None and new_lifetime_peak > lifetime_peak:
+            rss = max(rss or 0, new_lifetime_peak)
+
+        self.stages.append({
+            'stage': name,
+            'traced_peak': peak,
+            'rss': rss,
+        })
+
+        if self.budget is not None:
+            used = max(peak, self._rss_used(rss) or 0)
+            if used > self.budget:
+                self._exceeded(name, used)
+
+
+def format_memory_stages(stages):
+    """ Returns a list of human readable lines for the recorded stages. """
+    lines = []
+
+    for entry in stages:
+        rss = entry['rss']
+        rss_str = 'unknown' if rss is None else '{:.1f} MiB'.format(rss / MIB)
+        lines.append(
+            'memory: {:<12} peak {:8.1f} MiB  peak rss {}'.format(
+                entry['stage'],
+                entry['traced_peak'] / MIB,
+                rss_str
+            )
+        )
+
+    return lines
@@ -0,0 +1,187 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Which grid squares of a map are floor, for token placement and pathfinding.
+
+The floorplan is rasterised with the grid squares (tile_size px, starting at
+the top left corner of the map) as pixels, each sampled OCCUPANCY_SAMPLES
+times across and down (see raster.coverage_mask), and each square is marked as
+walkable, partial or wall by how much of it is floor.
+
+The grid can be saved as a greyscale PNG with one pixel per square (white for
+walkable, grey for partial and black for wall), or packed into two bits per
+square: OCCUPANCY_MAGIC, the number of columns and rows (little endian
+unsigned ints), the tile size (a little endian double), and then the squares
+row by row, four to a byte with the first in the high bits, as 0 for wall, 1
+for partial and 2 for walkable.
+
+NumPy is an optional dependency; this module is only imported when it's
+needed.
+"""
+from io import BytesIO
+from math import ceil
+import struct
+
+import numpy as np
+
+from dumat.raster import coverage_mask
+
+# Identifies a packed occupancy grid (the last byte is the version)
+OCCUPANCY_MAGIC = b'DUMATOG\x01'
+
+# The kinds of grid square
+OCCUPANCY_WALL = 0
+OCCUPANCY_PARTIAL = 1
+OCCUPANCY_WALKABLE = 2
+
+# Samples across (and down) each grid square
+OCCUPANCY_SAMPLES = 16
+
+# Squares with at least this fraction of floor are walkable, and those with at
+# most (1 - this) are wall; a little leeway keeps tracing noise at the edges
+# from making whole squares partial
+OCCUPANCY_THRESHOLD = 0.95
+
+# The grey level of each kind of square in a PNG grid
+PNG_LEVELS = {
+    OCCUPANCY_WALL: 0,
+    OCCUPANCY_PARTIAL: 128,
+    OCCUPANCY_WALKABLE: 255,
+}
+
+
+def grid_size(width, height, tile_size):
+    """
+    Returns the number of columns and rows of grid squares needed to cover a
+    map (the last ones may stick out past its edge).
+    """
+    return (
+        max(int(ceil(width / tile_size)), 1),
+        max(int(ceil(height / tile_size)), 1),
+    )
+
+
+def square_coverage(p, width, height, tile_size, samples=OCCUPANCY_SAMPLES):
+    """
+    Returns a (rows, columns) array of the fraction of each grid square that
+    is inside the floor (a cubicsuperpath) of a map of the given size.
+    """
+    columns, rows = grid_size(width, height, tile_size)
+
+    # Rasterise with one pixel per sample, and average each square's samples
+    mask = coverage_mask(
+        p,
+        columns * samples,
+        rows * samples,
+        supersample=1,
+        scale=samples / tile_size
+    )
+
+    return mask.reshape(rows, samples, columns, samples).mean(axis=(1, 3))
+
+
+def occupancy_grid(prepared, tile_size, samples=OCCUPANCY_SAMPLES):
+    """
+    Returns a (rows, columns) uint8 array of OCCUPANCY_WALKABLE,
+    OCCUPANCY_PARTIAL or OCCUPANCY_WALL for each grid square of a
+    PreparedFloorplan.
+    """
+    if tile_size <= 0:
+        raise ValueError('Tile size must be greater than zero')
+
+    coverage = square_coverage(
+        prepared.floor,
+        prepared.width,
+        prepared.height,
+        tile_size,
+        samples
+    )
+
+    grid = np.full(coverage.shape, OCCUPANCY_PARTIAL, dtype=np.uint8)
+    grid[coverage >= OCCUPANCY_THRESHOLD] = OCCUPANCY_WALKABLE
+    grid[coverage <= 1 - OCCUPANCY_THRESHOLD] = OCCUPANCY_WALL
+
+    return grid
+
+
+def occupancy_png(grid):
+    """ Returns an occupancy grid as greyscale PNG data. """
+    from PIL import Image
+
+    levels = np.zeros(max(PNG_LEVELS) + 1, dtype=np.uint8)
+    for kind, level in PNG_LEVELS.items():
+        levels[kind] = level
+
+    output = BytesIO()
+    Image.fromarray(levels[grid]).save(output, 'PNG', optimize=True)
+    return output.getvalue()
+
+
+def pack_occupancy(grid, tile_size):
+    """ Packs an occupancy grid into two bits per square (see above). """
+    rows, columns = grid.shape
+
+    codes = grid.ravel().astype(np.uint8)
+    codes = np.concatenate((codes, np.zeros(-len(codes) % 4, dtype=np.uint8)))
+
+    packed = (
+        codes[0::4] << 6 | codes[1::4] << 4 | codes[2::4] << 2 | codes[3::4]
+    ).astype(np.uint8)
+
+    return (
+        OCCUPANCY_MAGIC
+        + struct.pack('<IId', columns, rows, tile_size)
+        + packed.tobytes()
+    )
+
+
+def unpack_occupancy(data):
+    """
+    Unpacks an occupancy grid packed by pack_occupancy(). Returns the grid and
+    the tile size.
+    """
+    if bytes(data[:len(OCCUPANCY_MAGIC)]) != OCCUPANCY_MAGIC:
+        raise ValueError("Not an occupancy grid")
+
+    offset = len(OCCUPANCY_MAGIC)
+    columns, rows, tile_size = struct.unpack_from('<IId', data, offset)
+    offset += struct.calcsize('<IId')
+
+    count = columns * rows
+    packed = np.frombuffer(data, dtype=np.uint8, count=(count + 3) // 4, offset=offset)
+
+    codes = np.stack(
+        (packed >> 6, packed >> 4 & 3, packed >> 2 & 3, packed & 3),
+        axis=1
+    ).ravel()[:count]
+
+    return codes.reshape(rows, columns), tile_size
+
+
+def save_occupancy(prepared, tile_size, path, samples=OCCUPANCY_SAMPLES):
+    """
+    Works out the occupancy grid of a PreparedFloorplan and writes it to a
+    file, as a PNG if its name ends in '.png' and packed otherwise.
+    """
+    grid = occupancy_grid(prepared, tile_size, samples)
+
+    if path.lower().endswith('.png'):
+        data = occupancy_png(grid)
+    else:
+        data = pack_occupancy(grid, tile_size)
+
+    with open(path, 'wb') as output:
+        output.write(data)
@@ -0,0 +1,213 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Densifying and jittering the outlines of very large floorplans in parallel.
+
+Subpaths are independent, so they are split into chunks of roughly equal
+numbers of nodes and each chunk is handled by a worker process. The points of
+the floor are put in one shared memory buffer that every worker reads its
+chunk from, rather than being pickled for each of them. Each subpath is
+jittered with its own random generator seeded from a string, so the result
+doesn't depend on how the subpaths were split up or in which order the chunks
+finish; the results are put back together in the original order.
+
+Worker processes are only started when asked for (see
+PreparedFloorplan.workers), and they are spawned rather than forked: a render
+may have other threads running (eg. tracing), and forking a process with
+threads can leave locks held in the child that nothing will ever release.
+"""
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import random
+
+from dumat import svgtools
+from dumat.floorplan import NODE_COORDS, csp_coords, csp_from_coords
+
+# Below this many nodes, starting worker processes costs more than it saves.
+# This is a rough, deliberately cautious figure: outlining takes something
+# like a tenth of a millisecond a node, so this many is a couple of seconds of
+# work, against about a tenth of a second to spawn each worker and copy the
+# results back
+PARALLEL_MIN_NODES = 20000
+
+# How worker processes are started (see the module documentation)
+START_METHOD = 'spawn'
+
+# Chunks per worker; more than one evens out the work when some chunks turn
+# out to be slower than others
+CHUNKS_PER_WORKER = 4
+
+
+def worker_count(workers=None):
+    """ Returns the number of workers to use (None means one per CPU). """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return max(workers, 1)
+
+
+def should_parallelise(p, workers=None):
+    """
+    Returns True if a cubicsuperpath is big enough to be worth outlining in
+    parallel with the given number of workers.
+    """
+    return (
+        worker_count(workers) > 1
+        and svgtools.node_count(p) >= PARALLEL_MIN_NODES
+    )
+
+
+def chunk_subpaths(p, chunks):
+    """
+    Splits the subpath numbers of a cubicsuperpath into at most the given
+    number of runs with roughly equal numbers of nodes. Returns a list of
+    (start, stop) subpath number ranges.
+    """
+    total = svgtools.node_count(p)
+    target = max(total / max(chunks, 1), 1)
+
+    ranges = []
+    start = 0
+    nodes = 0
+
+    for number, subpath in enumerate(p):
+        nodes += len(subpath)
+        if nodes >= target:
+            ranges.append((start, number + 1))
+            start = number + 1
+            nodes = 0
+
+    if start < len(p):
+        ranges.append((start, len(p)))
+
+    return ranges
+
+
+def outline_subpath(subpath, spacing, curvature, jitter_radius, seed):
+    """
+    Densifies and jitters one subpath as for the hand drawn outline (see
+    PreparedFloorplan.outline_subpath), with a random generator seeded from
+    "seed". The subpath is modified. Returns the new subpath.
+    """
+    p = [subpath]
+
+    if spacing is not None:
+        p = svgtools.add_nodes_to_csp(
+            p,
+            'adaptive',
+            max_length=spacing,
+            curvature=curvature
+        )
+
+    svgtools.jitter_csp(
+        p,
+        end=True,
+        ctrl=True,
+        radiusx=jitter_radius,
+        radiusy=jitter_radius,
+        norm=False,
+        rng=random.Random(seed)
+    )
+
+    return p[0]
+
+
+def _outline_chunk(shm_name, first_node, lengths, seeds, spacing, curvature, jitter_radius):
+    """
+    Outlines a chunk of subpaths whose points are in shared memory, starting
+    at the given node. Runs in a worker process. Returns the lengths and
+    coordinates of the new subpaths, as arrays.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    try:
+        coords = array('d')
+        itemsize = coords.itemsize
+        start = first_node * NODE_COORDS * itemsize
+        stop = start + sum(lengths) * NODE_COORDS * itemsize
+
+        with shm.buf[start:stop] as view:
+            coords.frombytes(view)
+    finally:
+        shm.close()
+
+    chunk = csp_from_coords(lengths, coords)
+
+    outline = [
+        outline_subpath(subpath, spacing, curvature, jitter_radius, seed)
+        for subpath, seed in zip(chunk, seeds)
+    ]
+
+    return csp_coords(outline)
+
+
+def parallel_outline(p, spacing, curvature, jitter_radius, seeds, workers=None):
+    """
+    Densifies and jitters every subpath of a cubicsuperpath in a pool of
+    worker processes. Returns the new cubicsuperpath, in the same order. The
+    original isn't modified.
+
+    @param spacing the maximum length of straight segments, or None to not
+           densify (see floorplan.outline_spacing)
+    @param curvature how strongly bends shorten segments
+    @param jitter_radius how far nodes are moved
+    @param seeds a seed for each subpath (anything random.Random accepts)
+    @param workers the number of processes (None for one per CPU)
+    """
+    workers = worker_count(workers)
+    lengths, coords = csp_coords(p)
+
+    ranges = chunk_subpaths(p, workers * CHUNKS_PER_WORKER)
+    first_nodes = [0]
+    for length in lengths:
+        first_nodes.append(first_nodes[-1] + length)
+
+    shm = shared_memory.SharedMemory(
+        create=True,
+        size=max(len(coords) * coords.itemsize, 1)
+    )
+
+    try:
+        with shm.buf[:len(coords) * coords.itemsize] as view:
+            view[:] = coords.tobytes()
+
+        context = multiprocessing.get_context(START_METHOD)
+
+        with ProcessPoolExecutor(workers, mp_context=context) as executor:
+            jobs = [
+                executor.submit(
+                    _outline_chunk,
+                    shm.name,
+                    first_nodes[start],
+                    lengths[start:stop],
+                    seeds[start:stop],
+                    spacing,
+                    curvature,
+                    jitter_radius
+                )
+                for start, stop in ranges
+            ]
+
+            outline = []
+            for job in jobs:
+                outline.extend(csp_from_coords(*job.result()))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return outline
@@ -0,0 +1,356 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Rasterising floorplans with NumPy, for work that is better done once at render
+time than by every viewer of the map.
+
+The main use is baking the wall shading: the "wall-boundary-filter" in the
+template (an inner shadow and an outer glow, each a Gaussian blur of the floor)
+is worked out here and embedded as one greyscale image with alpha, so that
+displaying the map no longer costs more the bigger the blur is.
+
+NumPy is an optional dependency; this module is only imported when it's
+needed.
+"""
+from io import BytesIO
+from math import ceil, floor, pi, sqrt
+
+import numpy as np
+
+from dumat import cubicsuperpath
+
+# Maximum length in px of the straight pieces that curves are flattened into
+FLATTEN_STEP = 2.0
+
+# Pixels are split into this many rows and columns when rasterising, for
+# antialiasing
+SUPERSAMPLE = 2
+
+# Rows of output to rasterise at once, to limit memory use
+BAND_ROWS = 256
+
+# Blurs are done at a lower resolution where the blur is at least this wide (in
+# px), which looks the same and is much cheaper
+BLUR_MIN_SIGMA = 4.0
+
+# The opacity of the outer glow (from the last colour matrix in the filter)
+GLOW_OPACITY = 0.3
+
+
+def flatten_csp(p, step=FLATTEN_STEP):
+    """
+    Returns each subpath of a cubicsuperpath as an (n, 2) array of the points
+    of a polygon approximating it. Curves are split into pieces no longer than
+    about "step" px.
+    """
+    polygons = []
+
+    for subpath in p:
+        points = [np.array([subpath[0][1]], dtype=float)]
+
+        for sp1, sp2 in zip(subpath, subpath[1:]):
+            if cubicsuperpath.isLine(sp1, sp2):
+                points.append(np.array([sp2[1]], dtype=float))
+                continue
+
+            bez = np.array((sp1[1], sp1[2], sp2[0], sp2[1]), dtype=float)
+
+            # The control polygon is at least as long as the curve
+            length = np.hypot(*np.diff(bez, axis=0).T).sum()
+            t = np.linspace(0, 1, max(int(ceil(length / step)), 1) + 1)[1:, None]
+            mt = 1 - t
+
+            points.append(
+                mt ** 3 * bez[0]
+                + 3 * mt ** 2 * t * bez[1]
+                + 3 * mt * t ** 2 * bez[2]
+                + t ** 3 * bez[3]
+            )
+
+        polygons.append(np.concatenate(points))
+
+    return polygons
+
+
+def _crossings(polygons, scale, origin):
+    """
+    Returns where each polygon edge crosses the centre line of each (scaled)
+    pixel row, as arrays of row numbers, x positions and directions (+1 going
+    down, -1 going up), sorted by row.
+    """
+    starts = []
+    ends = []
+
+    for polygon in polygons:
+        # Subpaths are closed whether or not they end where they started
+        closed = (polygon - origin) * scale
+        starts.append(closed)
+        ends.append(np.roll(closed, -1, axis=0))
+
+    if not starts:
+        return np.empty(0, int), np.empty(0), np.empty(0, int)
+
+    p0 = np.concatenate(starts)
+    p1 = np.concatenate(ends)
+
+    direction = np.where(p1[:, 1] > p0[:, 1], 1, -1)
+    y_min = np.minimum(p0[:, 1], p1[:, 1])
+    y_max = np.maximum(p0[:, 1], p1[:, 1])
+
+    # Rows whose centres (row + 0.5) are in [y_min, y_max)
+    first = np.ceil(y_min - 0.5).astype(int)
+    last = np.ceil(y_max - 0.5).astype(int)
+    counts = np.maximum(last - first, 0)
+
+    edge = np.repeat(np.arange(len(p0)), counts)
+    rows = np.repeat(first, counts) + (
+        np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    )
+
+    x0, y0 = p0[edge, 0], p0[edge, 1]
+    x1, y1 = p1[edge, 0], p1[edge, 1]
+    xs = x0 + (rows + 0.5 - y0) * (x1 - x0) / (y1 - y0)
+
+    order = np.argsort(rows, kind='stable')
+    return rows[order], xs[order], direction[edge][order]
+
+
+def coverage_mask(p, width, height, x=0, y=0, supersample=SUPERSAMPLE, scale=1.0):
+    """
+    Returns a (height, width) float32 array of how much of each pixel is inside
+    a cubicsuperpath (with the non-zero fill rule), for the rectangle of the
+    given size with its top left corner at (x, y). If the scale isn't 1, the
+    path is drawn that much bigger or smaller (the size of the rectangle is in
+    scaled pixels, but its corner isn't).
+    """
+    mask = np.zeros((height, width), dtype=np.float32)
+    rows, xs, direction = _crossings(
+        flatten_csp(p, FLATTEN_STEP / scale),
+        supersample * scale,
+        np.array((x, y), dtype=float)
+    )
+
+    sub_width = width * supersample
+    columns = np.clip(np.ceil(xs - 0.5).astype(int), 0, sub_width)
+
+    for band_start in range(0, height, BAND_ROWS):
+        band_end = min(band_start + BAND_ROWS, height)
+        row0 = band_start * supersample
+        row1 = band_end * supersample
+
+        lo, hi = np.searchsorted(rows, (row0, row1))
+
+        # Add the direction of each crossing at its column; the running sum
+        # along each row is then the winding number at each pixel centre
+        winding = np.zeros((row1 - row0, sub_width + 1), dtype=np.int32)
+        np.add.at(winding, (rows[lo:hi] - row0, columns[lo:hi]), direction[lo:hi])
+        inside = np.cumsum(winding, axis=1)[:, :sub_width] != 0
+
+        mask[band_start:band_end] = inside.reshape(
+            band_end - band_start, supersample, width, supersample
+        ).mean(axis=(1, 3))
+
+    return mask
+
+
+def box_sizes(sigma):
+    """
+    Returns the sizes of the three box blurs that approximate a Gaussian blur,
+    as described in the SVG specification for feGaussianBlur. If the first two
+    are even, the first is centred half a pixel to the left of each output
+    pixel and the second half a pixel to the right (see _box_blur).
+    """
+    d = int(floor(sigma * 3 * sqrt(2 * pi) / 4 + 0.5))
+
+    if d % 2:
+        return d, d, d
+
+    return d, d, d + 1
+
+
+def _box_blur(values, size, axis, right=False):
+    """
+    Blurs an array along one axis with a box of the given size. Everything
+    outside the array is taken to be zero (transparent). A box of even size
+    is centred half a pixel to the left of each output pixel, or to the right
+    if "right" is True.
+    """
+    if size <= 1:
+        return values
+
+    before = size // 2
+    after = size - before - 1
+
+    if right:
+        before, after = after, before
+
+    pad = [(0, 0)] * values.ndim
+    pad[axis] = (before + 1, after)
+    total = np.cumsum(np.pad(values, pad), axis=axis, dtype=np.float64)
+
+    length = values.shape[axis]
+    upper = np.take(total, np.arange(size, size + length), axis=axis)
+    lower = np.take(total, np.arange(0, length), axis=axis)
+
+    return ((upper - lower) / size).astype(np.float32)
+
+
+def gaussian_blur(values, sigma):
+    """
+    Returns a Gaussian blur of a 2D array with the given standard deviation,
+    approximated with three box blurs in each direction. Wide blurs are done
+    at a lower resolution and scaled back up.
+    """
+    if sigma <= 0:
+        return values
+
+    from PIL import Image
+
+    height, width = values.shape
+    factor = max(int(sigma // BLUR_MIN_SIGMA), 1)
+
+    if factor > 1:
+        small_height = int(ceil(height / factor))
+        small_width = int(ceil(width / factor))
+        padded = np.zeros((small_height * factor, small_width * factor), np.float32)
+        padded[:height, :width] = values
+        blurred = padded.reshape(
+            small_height, factor, small_width, factor
+        ).mean(axis=(1, 3))
+    else:
+        blurred = values
+
+    for number, size in enumerate(box_sizes(sigma / factor)):
+        # The two even boxes lean opposite ways, so the blur stays centred
+        right = number == 1
+        blurred = _box_blur(blurred, size, 1, right)
+        blurred = _box_blur(blurred, size, 0, right)
+
+    if factor > 1:
+        # Scale back up so that each small pixel covers "factor" big ones
+        image = Image.fromarray(blurred.astype(np.float32)).resize(
+            (small_width * factor, small_height * factor),
+            Image.BILINEAR
+        )
+        blurred = np.asarray(image)[:height, :width]
+
+    return blurred
+
+
+def wall_shading(floor_mask, blur_inside, blur_outside):
+    """
+    Works out what the template's wall boundary filter draws for the given
+    floor coverage. Returns arrays of the grey level and the alpha (both 0 to
+    1). Inside the floor there is a black shadow fading away from the walls,
+    and outside there is a faint white glow.
+    """
+    # The filter greys the floor by how far it is from the walls (the floor
+    # "in" its own blur, over white), keeps it only where there is floor, and
+    # turns that grey level into the shadow's alpha with luminanceToAlpha.
+    # Both the grey floor and the shadow are blended over themselves first,
+    # which leaves the grey level alone but thickens the shadow from s to
+    # s(2 - s). Where there is no floor at all the grey level is lost, and so
+    # is the shadow.
+    shadow = 1 - floor_mask * gaussian_blur(floor_mask, blur_inside)
+    inside = np.where(floor_mask > 0, shadow * (2 - shadow), 0).astype(np.float32)
+
+    outer_blur = gaussian_blur(floor_mask, blur_outside)
+    glow = GLOW_OPACITY * (
+        floor_mask * (1 - outer_blur) + outer_blur * (1 - floor_mask)
+    )
+
+    # The shadow is composited over the glow
+    alpha = inside + glow * (1 - inside)
+    grey = np.divide(
+        glow * (1 - inside),
+        alpha,
+        out=np.zeros_like(alpha),
+        where=alpha > 0
+    )
+
+    return grey, alpha
+
+
+def shading_size(region, scale=1.0):
+    """
+    Returns the (width, height) in px of the baked shading for a region (x, y,
+    width, height) of the map drawn at the given scale. The pixels start at
+    the corner of the region, as those of the drawn region do, and there are
+    enough of them to cover it.
+    """
+    _, _, width, height = region
+    return int(ceil(width * scale)), int(ceil(height * scale))
+
+
+def wall_shading_png(
+        p,
+        width,
+        height,
+        blur_inside,
+        blur_outside,
+        region=None,
+        scale=1.0):
+    """
+    Returns the baked wall shading for the floor (a cubicsuperpath) as PNG
+    data: a greyscale image with alpha, covering the map or the region (see
+    shading_size).
+
+    @param blur_inside the standard deviation of the inner shadow in px
+    @param blur_outside the standard deviation of the outer glow in px
+    @param region if not None, a tuple (x, y, width, height) of the part of
+           the map to draw
+    @param scale how big to draw the shading relative to the map; the image
+           is that much smaller (or bigger), with the blurs to match
+    """
+    from PIL import Image
+
+    if region is None:
+        region = (0, 0, width, height)
+
+    x, y, _, _ = region
+    columns, rows = shading_size(region, scale)
+
+    # Work in scaled pixels from here on
+    blur_inside *= scale
+    blur_outside *= scale
+
+    # The blurs reach about three standard deviations, so take that much of
+    # the floor around the region into account
+    padding = int(ceil(3 * max(blur_inside, blur_outside)))
+
+    mask = coverage_mask(
+        p,
+        columns + 2 * padding,
+        rows + 2 * padding,
+        x - padding / scale,
+        y - padding / scale,
+        scale=scale
+    )
+    grey, alpha = wall_shading(mask, blur_inside, blur_outside)
+
+    crop = (
+        slice(padding, padding + rows),
+        slice(padding, padding + columns),
+    )
+
+    pixels = np.stack((grey[crop], alpha[crop]), axis=-1)
+    image = Image.fromarray(
+        np.clip(np.rint(pixels * 255), 0, 255).astype(np.uint8)
+    )
+
+    output = BytesIO()
+    image.save(output, 'PNG', optimize=True)
+    return output.getvalue()
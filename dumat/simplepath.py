@@ -74,7 +74,13 @@ def parsePath(d):
     Removes all shorthand notation.
     Converts coordinates to absolute.
     """
-    retval = []
+    return list(iterPath(d))
+
+def iterPath(d):
+    """
+    As for parsePath, but yields the segments one at a time instead of
+    building a list of them. (Added by JH.)
+    """
     lexer = lexPath(d)
 
     pen = (0.0,0.0)
@@ -157,13 +163,23 @@ def parsePath(d):
             lastControl = pen
         lastCommand = command
 
-        retval.append([outputCommand,params])
-    return retval
+        yield [outputCommand,params]
 
 def formatPath(a):
     """Format SVG path data from an array"""
     # Edited by JH to fix spacing issue
-    return " ".join(" ".join(str(el) for el in [cmd] + params) for cmd, params in a)
+    return "".join(iterFormatPath(a))
+
+def iterFormatPath(a):
+    """
+    As for formatPath, but takes any iterable of segments and yields the path
+    data a segment at a time, so that it can be written out as it is made.
+    (Added by JH.)
+    """
+    separator = ""
+    for cmd, params in a:
+        yield separator + " ".join(str(el) for el in [cmd] + params)
+        separator = " "
 
 def translatePath(p, x, y):
     for cmd,params in p:
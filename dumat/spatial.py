@@ -0,0 +1,174 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Bounding boxes for cubicsuperpaths and a uniform grid index over them, so that
+region queries only have to look at the subpaths near the region rather than
+the whole map.
+
+Bounding boxes are tuples of (x0, y0, x1, y1) with x0 <= x1 and y0 <= y1.
+"""
+from collections import defaultdict
+import math
+
+from dumat import bezmisc, cubicsuperpath
+
+
+def segment_bbox(sp1, sp2):
+    """
+    Returns the exact bounding box of the segment between two cubicsuperpath
+    nodes. The extremes of a cubic are at its ends or where its tangent is
+    horizontal or vertical.
+    """
+    points = [sp1[1], sp2[1]]
+
+    if not cubicsuperpath.isLine(sp1, sp2):
+        bez = (sp1[1], sp1[2], sp2[0], sp2[1])
+
+        # Vertical tangents (extremes in x), then horizontal ones (in y)
+        for slope in ((1, 0), (0, 1)):
+            for t in bezmisc.beziertatslope(bez, slope):
+                points.append(bezmisc.bezierpointatt(bez, t))
+
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def subpath_bbox(subpath):
+    """ Returns the bounding box of a cubicsuperpath subpath. """
+    if len(subpath) == 1:
+        x, y = subpath[0][1]
+        return x, y, x, y
+
+    return union_bbox(
+        segment_bbox(sp1, sp2) for sp1, sp2 in zip(subpath, subpath[1:])
+    )
+
+
+def union_bbox(bboxes):
+    """ Returns the smallest bounding box containing all of the given ones. """
+    x0 = y0 = math.inf
+    x1 = y1 = -math.inf
+
+    for bx0, by0, bx1, by1 in bboxes:
+        x0 = min(x0, bx0)
+        y0 = min(y0, by0)
+        x1 = max(x1, bx1)
+        y1 = max(y1, by1)
+
+    return x0, y0, x1, y1
+
+
+def bbox_intersects(bbox, other):
+    """ Returns True if two bounding boxes overlap (or touch). """
+    return (
+        bbox[0] <= other[2] and other[0] <= bbox[2]
+        and bbox[1] <= other[3] and other[1] <= bbox[3]
+    )
+
+
+class GridIndex(object):
+    """
+    A uniform grid of square cells, each holding the numbers of the items whose
+    bounding boxes overlap it. A query only looks at the cells its region
+    covers.
+    """
+
+    def __init__(self, cell_size):
+        """ @param cell_size the width and height of a cell in px """
+        self.cell_size = float(cell_size)
+        self.bboxes = []
+        self._cells = defaultdict(list)
+
+    @classmethod
+    def from_csp(cls, p, cell_size=None):
+        """
+        Indexes the subpaths of a cubicsuperpath by number. If no cell size is
+        given, one is chosen so there is about one subpath per cell.
+        """
+        bboxes = [subpath_bbox(subpath) for subpath in p]
+
+        if cell_size is None:
+            cell_size = cls.auto_cell_size(bboxes)
+
+        index = cls(cell_size)
+        for bbox in bboxes:
+            index.insert(bbox)
+
+        return index
+
+    @staticmethod
+    def auto_cell_size(bboxes):
+        """
+        Returns a cell size for indexing the given bounding boxes that gives
+        about one box per cell, but no smaller than the typical box.
+        """
+        if not bboxes:
+            return 1.0
+
+        x0, y0, x1, y1 = union_bbox(bboxes)
+        area = max((x1 - x0) * (y1 - y0), 1.0)
+
+        sizes = sorted(max(bx1 - bx0, by1 - by0) for bx0, by0, bx1, by1 in bboxes)
+        median = sizes[len(sizes) // 2]
+
+        return max(math.sqrt(area / len(bboxes)), median, 1.0)
+
+    def _cell_range(self, bbox):
+        """ Returns the ranges of cell columns and rows covering a box. """
+        x0, y0, x1, y1 = bbox
+        return (
+            range(math.floor(x0 / self.cell_size), math.floor(x1 / self.cell_size) + 1),
+            range(math.floor(y0 / self.cell_size), math.floor(y1 / self.cell_size) + 1),
+        )
+
+    def insert(self, bbox):
+        """ Adds an item with the given bounding box. Returns its number. """
+        number = len(self.bboxes)
+        self.bboxes.append(bbox)
+
+        columns, rows = self._cell_range(bbox)
+        for column in columns:
+            for row in rows:
+                self._cells[column, row].append(number)
+
+        return number
+
+    def query(self, bbox):
+        """
+        Returns the numbers (in ascending order) of the items whose bounding
+        boxes overlap the given one.
+        """
+        found = set()
+        columns, rows = self._cell_range(bbox)
+
+        # A huge region would visit lots of empty cells, so check every item
+        if len(columns) * len(rows) > len(self._cells):
+            candidates = range(len(self.bboxes))
+        else:
+            candidates = (
+                number
+                for column in columns
+                for row in rows
+                for number in self._cells.get((column, row), ())
+            )
+
+        for number in candidates:
+            if number not in found and bbox_intersects(self.bboxes[number], bbox):
+                found.add(number)
+
+        return sorted(found)
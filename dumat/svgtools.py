@@ -29,6 +29,9 @@ it's useful.
 from dumat import bezmisc, cubicsuperpath, simplepath
 import random, math, copy, re
 
+# Relative tolerance for recognising quadratic segments stored as cubics
+QUADRATIC_TOLERANCE = 1e-9
+
 # From inkscape/share/extensions/addnodes.py.
 # Copyright (C) 2005,2007 Aaron Spike, aaron@ekips.org
 def cspbezsplit(sp1, sp2, t = 0.5):
@@ -50,10 +53,127 @@ def tpoint(point1, point2, t = 0.5):
     return [x1+t*(x2-x1),y1+t*(y2-y1)]
 
 
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+def segment_kind(sp1, sp2):
+    """
+    Support function for add_nodes_to_path. CubicSuperPath stores every
+    segment as a cubic, but lines and quadratics can still be recognised:
+    returns 'L' for a straight line (control points on the nodes), 'Q' for a
+    degree-elevated quadratic and 'C' for anything else.
+    """
+    if cubicsuperpath.isLine(sp1, sp2):
+        return 'L'
+
+    (x0, y0), (x1, y1), (x2, y2), (x3, y3) = sp1[1], sp1[2], sp2[0], sp2[1]
+    scale = 1.0 + max(abs(x0), abs(y0), abs(x3), abs(y3))
+
+    # The cubic coefficient vanishes for an elevated quadratic
+    if (abs(x0 - 3*x1 + 3*x2 - x3) <= QUADRATIC_TOLERANCE * scale
+            and abs(y0 - 3*y1 + 3*y2 - y3) <= QUADRATIC_TOLERANCE * scale):
+        return 'Q'
+
+    return 'C'
+
+
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+def quadratic_coefficients(sp1, sp2):
+    """
+    Support function for add_nodes_to_path. For a quadratic segment, returns
+    (a, b, c) such that the speed along the curve at t is 2*sqrt(at^2 + bt + c).
+    """
+    (x0, y0), (x1, y1), (x3, y3) = sp1[1], sp1[2], sp2[1]
+
+    # The quadratic control point
+    qx = (3*x1 - x0)/2.0
+    qy = (3*y1 - y0)/2.0
+
+    ax = x0 - 2*qx + x3
+    ay = y0 - 2*qy + y3
+    bx = qx - x0
+    by = qy - y0
+
+    return ax*ax + ay*ay, 2*(ax*bx + ay*by), bx*bx + by*by
+
+
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+def quadratic_length(coefficients, t=1.0):
+    """
+    Support function for add_nodes_to_path. Returns the exact length of a
+    quadratic segment from 0 to t, or None if the closed form is numerically
+    unreliable for it (eg. it doubles back on itself).
+    """
+    a, b, c = coefficients
+
+    if a <= QUADRATIC_TOLERANCE * (b*b + c + 1.0):
+        # No acceleration, so constant speed
+        return 2*math.sqrt(c)*t
+
+    def primitive(u):
+        q = math.sqrt(max(a*u*u + b*u + c, 0.0))
+        inner = 2*a*u + b + 2*math.sqrt(a)*q
+        if inner <= 0:
+            raise ValueError
+        return (
+            (2*a*u + b)*q/(4*a)
+            + (4*a*c - b*b)/(8*a**1.5)*math.log(inner)
+        )
+
+    try:
+        return 2*(primitive(t) - primitive(0.0))
+    except ValueError:
+        return None
+
+
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+def quadratic_tatlength(coefficients, length, total, tolerance=0.001):
+    """
+    Support function for add_nodes_to_path. Returns the parameter t at which a
+    quadratic segment (of the given total length) reaches the given length,
+    using Newton's method on the closed form length.
+    """
+    a, b, c = coefficients
+    low, high = 0.0, 1.0
+    t = length/total
+
+    for _ in range(32):
+        error = quadratic_length(coefficients, t) - length
+        if abs(error) <= tolerance:
+            break
+
+        if error > 0:
+            high = t
+        else:
+            low = t
+
+        speed = 2*math.sqrt(max(a*t*t + b*t + c, 0.0))
+        step = t - error/speed if speed else -1
+
+        # Fall back to bisection if Newton leaves the bracket
+        t = step if low < step < high else (low + high)/2.0
+
+    return t
+
+
 # From inkscape/share/extensions/addnodes.py.
 # Copyright (C) 2005,2007 Aaron Spike, aaron@ekips.org
+# Copyright (C) 2014 Jason Heeris, jason.heeris@gmail.com
 def cspbezsplitatlength(sp1, sp2, l = 0.5, tolerance = 0.001):
     """ Support function for add_nodes_to_path. """
+    kind = segment_kind(sp1, sp2)
+
+    if kind == 'L':
+        # Lines split exactly, and stay lines
+        m = list(tpoint(sp1[1], sp2[1], l))
+        return [[sp1[0][:], sp1[1][:], sp1[1][:]], [m, m[:], m[:]],
+                [sp2[1][:], sp2[1][:], sp2[2][:]]]
+
+    if kind == 'Q':
+        coefficients = quadratic_coefficients(sp1, sp2)
+        total = quadratic_length(coefficients)
+        if total:
+            t = quadratic_tatlength(coefficients, l*total, total, tolerance)
+            return cspbezsplit(sp1, sp2, t)
+
     bez = (sp1[1][:],sp1[2][:],sp2[0][:],sp2[1][:])
     t = bezmisc.beziertatlength(bez, l, tolerance)
     return cspbezsplit(sp1, sp2, t)
@@ -61,29 +181,90 @@ def cspbezsplitatlength(sp1, sp2, l = 0.5, tolerance = 0.001):
 
 # From inkscape/share/extensions/addnodes.py.
 # Copyright (C) 2005,2007 Aaron Spike, aaron@ekips.org
+# Copyright (C) 2014 Jason Heeris, jason.heeris@gmail.com
 def cspseglength(sp1,sp2, tolerance = 0.001):
     """ Support function for add_nodes_to_path. """
+    kind = segment_kind(sp1, sp2)
+
+    if kind == 'L':
+        return math.hypot(sp2[1][0] - sp1[1][0], sp2[1][1] - sp1[1][1])
+
+    if kind == 'Q':
+        length = quadratic_length(quadratic_coefficients(sp1, sp2))
+        if length is not None:
+            return length
+
     bez = (sp1[1][:],sp1[2][:],sp2[0][:],sp2[1][:])
     return bezmisc.bezierlength(bez, tolerance)    
 
 
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+def turning_angle(sp1, sp2):
+    """
+    Support function for add_nodes_to_path. Returns the total angle (in
+    radians) that the control polygon of the segment between two nodes turns
+    through. This is zero for a straight segment and grows with curvature.
+    """
+    points = (sp1[1], sp1[2], sp2[0], sp2[1])
+
+    edges = []
+    for (x1, y1), (x2, y2) in zip(points, points[1:]):
+        if x1 != x2 or y1 != y2:
+            edges.append((x2 - x1, y2 - y1))
+
+    total = 0.0
+    for (ax, ay), (bx, by) in zip(edges, edges[1:]):
+        total += abs(math.atan2(ax*by - ay*bx, ax*bx + ay*by))
+
+    return total
+
+
+def node_count(p):
+    """ Returns the number of nodes in a cubicsuperpath. """
+    return sum(len(subpath) for subpath in p)
+
+
 # Based on SplitIt.effect in inkscape/share/extensions/addnodes.py.
 # Copyright (C) 2005,2007 Aaron Spike, aaron@ekips.org
 # Copyright (C) 2014 Jason Heeris, jason.heeris@gmail.com
-def add_nodes_to_path(path_string, method, max_length=10, max_num=2):
+def add_nodes_to_path(
+        path_string,
+        method,
+        max_length=10,
+        max_num=2,
+        curvature=1.0,
+        sink=None):
     """
     @return the new "d" attribute of an SVG path
     
     @param path_string the "d" attribute of an SVG path    
     @param method 'bynum' to create a maximum number of segments; 'bymax' to
-           create a maximum segment length
+           create a maximum segment length; 'adaptive' to create a maximum
+           segment length that shrinks where the path bends
     @param max_length if method is 'bymax', the maximum length in px for any
-           segment (ignored otherwise)
+           segment; if method is 'adaptive', the maximum length for straight
+           segments (ignored otherwise)
     @param max_num if method is 'bynum', the maximum number of segments to
            create
+    @param curvature if method is 'adaptive', how strongly bends shorten the
+           segments: a segment that turns through an angle "a" (in radians) is
+           limited to max_length/(1 + curvature*a)
+    @param sink if not None, a file-like object to write the new path data
+           to as it is made, instead of returning it
+    """
+    p = cubicsuperpath.iterParsePath(path_string)
+    new = densify_subpaths(p, method, max_length, max_num, curvature)
+    return _format_or_write(new, sink)
+
+
+# Based on SplitIt.effect in inkscape/share/extensions/addnodes.py.
+# Copyright (C) 2005,2007 Aaron Spike, aaron@ekips.org
+# Copyright (C) 2014 Jason Heeris, jason.heeris@gmail.com
+def add_nodes_to_csp(p, method, max_length=10, max_num=2, curvature=1.0):
+    """
+    As for add_nodes_to_path, but works on (and modifies) a parsed
+    cubicsuperpath. Returns a new cubicsuperpath.
     """
-    p = cubicsuperpath.parsePath(path_string)
-    
     #lens, total = csplength(p)
     #avg = total/numlengths(lens)
     #inkex.debug("average segment length: %s" % avg)
@@ -97,6 +278,9 @@ def add_nodes_to_path(path_string, method, max_length=10, max_num=2):
             
             if method == 'bynum':
                 splits = max_num
+            elif method == 'adaptive':
+                bend = turning_angle(new[-1][-1], sub[i])
+                splits = math.ceil(length*(1 + curvature*bend)/max_length)
             else:
                 splits = math.ceil(length/max_length)
 
@@ -106,18 +290,22 @@ def add_nodes_to_path(path_string, method, max_length=10, max_num=2):
             new[-1].append(sub[i])
             i+=1
         
-    return cubicsuperpath.formatPath(new)
+    return new
 
 # From inkscape/share/extensions/radiusrand.py
 # Copyright (C) 2005 Aaron Spike, aaron@ekips.org
-def randomize(point, rx, ry, norm):
-    """ Support function for jitter_nodes. """
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+def randomize(point, rx, ry, norm, rng=random):
+    """
+    Support function for jitter_nodes. "rng" is the source of randomness, eg.
+    a seeded random.Random instance for repeatable results.
+    """
     (x, y) = point
     if norm:
-        r = abs(random.normalvariate(0.0,0.5*max(rx, ry)))
+        r = abs(rng.normalvariate(0.0,0.5*max(rx, ry)))
     else:
-        r = random.uniform(0.0,max(rx, ry))
-    a = random.uniform(0.0,2*math.pi)
+        r = rng.uniform(0.0,max(rx, ry))
+    a = rng.uniform(0.0,2*math.pi)
     x += math.cos(a)*rx
     y += math.sin(a)*ry
     return [x, y]
@@ -131,7 +319,8 @@ def jitter_nodes(
         ctrl=False,
         radiusx=10,
         radiusy=10,
-        norm=True):
+        norm=True,
+        sink=None):
     """
     Randomly moves path nodes (and optionally their tangents).
     
@@ -142,15 +331,36 @@ def jitter_nodes(
     @param radiusx horizontal distance to move nodes
     @param radiusy vertical distance to move nodes
     @param norm use normal distribution instead of uniform   
+    @param sink if not None, a file-like object to write the new path data
+           to as it is made, instead of returning it
     
     @return a path with randomly shifted nodes, as the "d" attribute of an SVG
             path
     """
-    p = cubicsuperpath.parsePath(path_string)
+    p = cubicsuperpath.iterParsePath(path_string)
+    new = jitter_subpaths(p, end, ctrl, radiusx, radiusy, norm)
+    return _format_or_write(new, sink)
+
+
+# Based on RadiusRandomize.effect from inkscape/share/extensions/radiusrand.py
+# Copyright 2005 Aaron Spike, aaron@ekips.org
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+def jitter_csp(
+        p,
+        end=True,
+        ctrl=False,
+        radiusx=10,
+        radiusy=10,
+        norm=True,
+        rng=random):
+    """
+    As for jitter_nodes, but shifts the nodes of a parsed cubicsuperpath in
+    place. "rng" is the source of randomness (see randomize).
+    """
     for subpath in p:
         for csp in subpath:
             if end:
-                delta=randomize([0,0], radiusx, radiusy, norm)
+                delta=randomize([0,0], radiusx, radiusy, norm, rng)
                 csp[0][0]+=delta[0] 
                 csp[0][1]+=delta[1] 
                 csp[1][0]+=delta[0] 
@@ -158,10 +368,117 @@ def jitter_nodes(
                 csp[2][0]+=delta[0] 
                 csp[2][1]+=delta[1] 
             if ctrl:
-                csp[0]=randomize(csp[0], radiusx, radiusy, norm)
-                csp[2]=randomize(csp[2], radiusx, radiusy, norm)
-    
-    return cubicsuperpath.formatPath(p)
+                csp[0]=randomize(csp[0], radiusx, radiusy, norm, rng)
+                csp[2]=randomize(csp[2], radiusx, radiusy, norm, rng)
+
+
+# Streaming versions of the above. Each stage takes an iterable of subpaths and
+# yields them one at a time, so that stages can be chained from parsing
+# (cubicsuperpath.iterParsePath) to writing (cubicsuperpath.writePath) while
+# only ever holding one subpath, however long the whole path is.
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+
+def densify_subpaths(subpaths, method, max_length=10, max_num=2, curvature=1.0):
+    """
+    As for add_nodes_to_csp, but yields each new subpath in turn. The
+    subpaths are modified.
+    """
+    for subpath in subpaths:
+        yield add_nodes_to_csp([subpath], method, max_length, max_num, curvature)[0]
+
+
+def jitter_subpaths(
+        subpaths,
+        end=True,
+        ctrl=False,
+        radiusx=10,
+        radiusy=10,
+        norm=True,
+        rng=random):
+    """
+    As for jitter_csp, but yields each subpath in turn after shifting its
+    nodes in place. The random numbers are drawn in the same order, so a
+    seeded "rng" gives the same result as jitter_csp.
+    """
+    for subpath in subpaths:
+        jitter_csp([subpath], end, ctrl, radiusx, radiusy, norm, rng)
+        yield subpath
+
+
+def transform_subpaths(mat, subpaths):
+    """
+    As for applyTransformToPath, but yields each subpath in turn after
+    transforming it in place.
+    """
+    for subpath in subpaths:
+        applyTransformToPath(mat, [subpath])
+        yield subpath
+
+
+def stream_path(
+        path_string,
+        sink,
+        transform=None,
+        max_length=None,
+        curvature=1.0,
+        jitter_radius=None,
+        rng=random,
+        terminate=False):
+    """
+    Parses, transforms, densifies and jitters path data and writes the result
+    to a file-like object, a subpath at a time. Memory use doesn't grow with
+    the length of the path (other than for the input string itself).
+
+    @param path_string the "d" attribute of an SVG path
+    @param sink a file-like object with a write() method that takes strings
+    @param transform an SVG transform string to apply, or None
+    @param max_length if not None, densify with the 'adaptive' method of
+           add_nodes_to_path using this maximum segment length
+    @param curvature how strongly bends shorten segments when densifying
+    @param jitter_radius if not None, move every node and control point by
+           up to this distance (see jitter_csp)
+    @param rng the source of randomness for the jitter
+    @param terminate whether to close the path with 'Z'
+    """
+    p = cubicsuperpath.iterParsePath(path_string)
+
+    if transform is not None:
+        p = transform_subpaths(parseTransform(transform), p)
+
+    if max_length is not None:
+        p = densify_subpaths(p, 'adaptive', max_length=max_length, curvature=curvature)
+
+    if jitter_radius is not None:
+        p = jitter_subpaths(
+            p,
+            end=True,
+            ctrl=True,
+            radiusx=jitter_radius,
+            radiusy=jitter_radius,
+            norm=False,
+            rng=rng
+        )
+
+    cubicsuperpath.writePath(p, sink, terminate)
+
+
+def _format_or_write(subpaths, sink, terminate=False):
+    """
+    Returns the path data for an iterable of subpaths, or writes it to "sink"
+    if that isn't None.
+    """
+    if sink is None:
+        return cubicsuperpath.formatPath(subpaths, terminate)
+
+    cubicsuperpath.writePath(subpaths, sink, terminate)
+
+
+def copy_csp(p):
+    """
+    Returns a copy of a cubicsuperpath that can be modified without affecting
+    the original. Much quicker than copy.deepcopy().
+    """
+    return [[[pt[:] for pt in csp] for csp in subpath] for subpath in p]
 
 
 # From inkscape/share/extensions/simpletransform.py
@@ -262,15 +579,15 @@ def applyTransformToPath(mat,path):
 # Copyright 2006 Jean-Francois Barraud, barraud@math.univ-lille1.fr
 # Copyright 2010 Alvin Penner, penner@vaxxine.com
 # Copyright 2014 Jason Heeris, jason.heeris@gmail.com
-def fuseTransform(transform_string, path_string):
+def fuseTransform(transform_string, path_string, sink=None):
     """
     Takes an SVG transform string and an SVG path "d" string and applies the
-    transform to the path. Returns a new path string.
+    transform to the path. Returns a new path string, or writes it to "sink"
+    (a file-like object) if that is given.
     """    
     m = parseTransform(transform_string)
-    p = cubicsuperpath.parsePath(path_string)
-    applyTransformToPath(m,p)
-    return cubicsuperpath.formatPath(p, terminate=True)
+    p = cubicsuperpath.iterParsePath(path_string)
+    return _format_or_write(transform_subpaths(m, p), sink, terminate=True)
 
 
 # From inkscape/share/extensions/render_alphabetsoup.py
@@ -328,20 +645,37 @@ def winding_sign(path_string):
     
     winding = 0
     last_point = None
+    start_point = None
     
     for kind, coords in path:
-        # simplepath.parsePath only creates absolute coordinates
+        # simplepath.parsePath only creates absolute coordinates, and
+        # expands H and V into L
         if kind == 'M':
+            # Each subpath is summed separately, without the jump between them
+            this_point = coords[0:2]
+            start_point = this_point
+            last_point = None
+
+        if kind == 'L':
             this_point = coords[0:2]
             
         if kind == 'C':
             this_point = coords[4:6]
             
+        if kind == 'Q':
+            this_point = coords[2:4]
+
+        if kind == 'A':
+            this_point = coords[5:7]
+
+        if kind == 'Z':
+            this_point = start_point
+
         if last_point is not None:
             curl = (last_point[0] + this_point[0])*(last_point[1] - this_point[1])
             winding += curl
             
-        last_point = coords
+        last_point = this_point
     
     return winding
 
@@ -361,10 +695,13 @@ def path_difference(minuend_path_string, subtrahend_path_string):
     return simplepath.formatPath(minuend_path)
 
 # Copyright 2014 Jason Heeris, jason.heeris@gmail.com
-def create_bounding_path(width, height):
-    """ Creates a rectangular path that borders the image. """
+def create_bounding_path(width, height, x=0, y=0):
+    """
+    Creates a rectangular path that borders the image (or, if x and y are
+    given, a rectangle of that size with its top left corner there).
+    """
     path = [
-        ['m', [0, 0]  ],
+        ['m', [x, y]  ],
         ['v', [height]],
         ['h', [width ]],
         ['v', [-height]],
@@ -373,3 +710,180 @@ def create_bounding_path(width, height):
     
     return simplepath.formatPath(path)
 
+
+
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+def update_style(style_string, properties):
+    """
+    Sets properties in an SVG "style" attribute, keeping the order of any that
+    are already present. Returns the new attribute value.
+
+    @param style_string the "style" attribute of an SVG element
+    @param properties a dictionary of CSS property names and values to set
+    """
+    declarations = []
+    remaining = dict(properties)
+
+    for declaration in style_string.split(';'):
+        name, sep, value = declaration.partition(':')
+        name = name.strip()
+
+        if not sep or not name:
+            continue
+
+        if name in remaining:
+            value = remaining.pop(name)
+
+        declarations.append((name, value.strip()))
+
+    declarations.extend(remaining.items())
+
+    return ';'.join('{}:{}'.format(name, value) for name, value in declarations)
+
+
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+def subpath_area(subpath):
+    """
+    Returns the signed area enclosed by a cubicsuperpath subpath, including
+    the bulge of its curves. If the subpath isn't closed, it is closed with a
+    straight line.
+    """
+    area = 0.0
+
+    for sp1, sp2 in zip(subpath, subpath[1:]):
+        area += _segment_area(sp1[1], sp1[2], sp2[0], sp2[1])
+
+    # Close the subpath (this adds nothing if it is already closed)
+    (x1, y1), (x2, y2) = subpath[-1][1], subpath[0][1]
+    area += (x1*y2 - x2*y1) / 2.0
+
+    return area
+
+
+def _segment_area(p0, p1, p2, p3):
+    """
+    Support function for subpath_area. Returns the integral of (x dy - y dx)/2
+    along a cubic bezier, by Green's theorem the segment's share of the signed
+    area of a closed path.
+    """
+    def cross(a, b):
+        return a[0]*b[1] - a[1]*b[0]
+
+    return (
+        6*cross(p0, p1) + 3*cross(p0, p2) + cross(p0, p3)
+        + 3*cross(p1, p2) + 3*cross(p1, p3) + 6*cross(p2, p3)
+    ) / 20.0
+
+
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+def point_line_distance(point, start, end):
+    """ Returns the distance from a point to the line through start and end. """
+    (px, py), (x1, y1), (x2, y2) = point, start, end
+    dx = x2 - x1
+    dy = y2 - y1
+    chord = math.hypot(dx, dy)
+
+    if not chord:
+        return math.hypot(px - x1, py - y1)
+
+    return abs(dx*(y1 - py) - dy*(x1 - px)) / chord
+
+
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+def douglas_peucker(points, tolerance):
+    """
+    Returns the indices of the points to keep when simplifying a polyline with
+    the Douglas-Peucker algorithm. The first and last points are always kept.
+    """
+    keep = {0, len(points) - 1}
+    stack = [(0, len(points) - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        furthest = None
+        furthest_distance = tolerance
+
+        for index in range(first + 1, last):
+            distance = point_line_distance(
+                points[index],
+                points[first],
+                points[last]
+            )
+            if distance > furthest_distance:
+                furthest = index
+                furthest_distance = distance
+
+        if furthest is not None:
+            keep.add(furthest)
+            stack.append((first, furthest))
+            stack.append((furthest, last))
+
+    return sorted(keep)
+
+
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+def simplify_subpath(subpath, tolerance):
+    """
+    Support function for simplify_csp. Replaces runs of (nearly) straight
+    segments with as few straight segments as the tolerance allows. Curved
+    segments are left alone.
+    """
+    def is_flat(sp1, sp2):
+        return (
+            point_line_distance(sp1[2], sp1[1], sp2[1]) <= tolerance
+            and point_line_distance(sp2[0], sp1[1], sp2[1]) <= tolerance
+        )
+
+    new = [[pt[:] for pt in subpath[0]]]
+    i = 0
+
+    while i < len(subpath) - 1:
+        # Find the end of the run of flat segments starting here
+        j = i
+        while j < len(subpath) - 1 and is_flat(subpath[j], subpath[j + 1]):
+            j += 1
+
+        if j == i:
+            # A curved segment, keep it as it is
+            new.append([pt[:] for pt in subpath[i + 1]])
+            i += 1
+            continue
+
+        points = [subpath[k][1] for k in range(i, j + 1)]
+        kept = douglas_peucker(points, tolerance)
+
+        # The segments of the run become straight lines
+        new[-1][2] = new[-1][1][:]
+        for index in kept[1:-1]:
+            point = points[index]
+            new.append([point[:], point[:], point[:]])
+
+        end = subpath[j]
+        new.append([end[1][:], end[1][:], end[2][:]])
+        i = j
+
+    return new
+
+
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+def simplify_csp(p, tolerance, min_area=0):
+    """
+    Simplifies a cubicsuperpath (eg. a noisy trace). Returns a new path.
+
+    @param tolerance the maximum distance in px that a straight run of nodes
+           may be moved by; zero leaves the segments alone
+    @param min_area subpaths enclosing less than this many px^2 (eg. specks of
+           noise in a scan) are dropped
+    """
+    new = []
+
+    for subpath in p:
+        if min_area and abs(subpath_area(subpath)) < min_area:
+            continue
+
+        if tolerance > 0 and len(subpath) > 2:
+            subpath = simplify_subpath(subpath, tolerance)
+
+        new.append(subpath)
+
+    return new
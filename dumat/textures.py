@@ -0,0 +1,265 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Preparing textures before they are embedded in the map.
+
+Textures are tiled over the map at their own size, so any part of a texture
+beyond the edge of the map is never seen and a texture bigger than the map is
+cropped to it. Likewise when only a region of the map is drawn (eg. one tile
+of a tile pyramid), a texture bigger than the region only needs the part of
+it that lands in the region, drawn once. When the map is drawn smaller than
+full size (a scale below 1) the texture's pixels are downscaled to match,
+since the extra detail would be thrown away when rasterising anyway.
+
+Textures that have to be changed are re-encoded with one of the raster formats
+from dumat.encoders; textures that don't are embedded as they are. Either way
+they are labelled with their real MIME type. Textures in formats that viewers
+can't be relied on to show (anything but PNG, JPEG, GIF, BMP and WebP) are
+always re-encoded as PNG.
+
+Prepared textures are kept in a small cache, since the same textures are
+usually used for many renders. Textures that are embedded as they are aren't
+cached, and aren't copied either: the buffer given is returned.
+"""
+from collections import OrderedDict
+import hashlib
+from math import ceil, floor
+import struct
+import threading
+
+from dumat import buffers, encoders
+
+# Keep the texture's own format unless it has to be re-encoded, in which case
+# use the same format as the original
+ORIGINAL_FORMAT = 'original'
+
+# How many prepared textures to keep
+TEXTURE_CACHE_SIZE = 16
+
+# Leading bytes of the image formats we can recognise, and their MIME types
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+# The MIME type of data that isn't one of the formats above
+UNKNOWN_MIME_TYPE = 'application/octet-stream'
+
+# The encoder to re-encode a texture with for each original MIME type; other
+# types become PNG
+MIME_ENCODERS = {
+    'image/jpeg': 'jpg',
+    'image/webp': 'webp',
+}
+
+# Prepared textures by cache key, least recently used first. Textures can be
+# prepared on several threads at once, so the cache has a lock.
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def image_mime_type(image_data):
+    """
+    Returns the MIME type of image data from its first few bytes, or
+    UNKNOWN_MIME_TYPE if it isn't recognised.
+    """
+    header = bytes(image_data[:16])
+
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+
+    return UNKNOWN_MIME_TYPE
+
+
+def png_size(image_data):
+    """ Returns the size of a PNG from its header, or None if it isn't one. """
+    header = bytes(image_data[:24])
+    if header.startswith(IMAGE_SIGNATURES[0][0]) and header[12:16] == b'IHDR':
+        return struct.unpack('>II', header[16:24])
+    return None
+
+
+def clear_cache():
+    """ Forgets all prepared textures. """
+    with _cache_lock:
+        _cache.clear()
+
+
+def texture_window(size, dimensions, region):
+    """
+    Returns, for each axis, the (start, length) in map px of the single copy
+    of a texture of the given size that covers the region, or None if the
+    region is at least as long as the texture along that axis (so the texture
+    has to be tiled as usual).
+
+    @param dimensions the size (width, height) of the map in px
+    @param region the part of the map being drawn (x0, y0, x1, y1)
+    """
+    window = []
+
+    axes = zip(size, dimensions, region[:2], region[2:])
+
+    for length, limit, low, high in axes:
+        start = max(int(floor(low)), 0)
+        end = min(int(ceil(high)), int(ceil(limit)))
+        window.append((start, end - start) if end - start < length else None)
+
+    return tuple(window)
+
+
+def prepare_texture(
+        image_data,
+        dimensions,
+        scale=1.0,
+        format=ORIGINAL_FORMAT,
+        region=None):
+    """
+    Returns a texture ready to embed in the map, as a tuple of the image data,
+    its MIME type, its size (width, height) in map px and where to put it. The
+    size of the image data itself is smaller than that if it was downscaled.
+    The last item is a tuple of the x and y to draw the texture at, each of
+    which is None if the texture is tiled along that axis (see
+    texture_window).
+
+    @param image_data a buffer of image data in any format Pillow can read;
+           if the texture doesn't need changing, this is what is returned
+    @param dimensions the size (width, height) of the map in px
+    @param scale how big the map will be drawn relative to its size in px; if
+           it is less than 1, the texture is downscaled to match
+    @param format 'original', or a raster format (with an optional preset)
+           from dumat.encoders to re-encode every texture in
+    @param region if not None, the part of the map being drawn (x0, y0, x1,
+           y1); a texture bigger than it is cut down to the part that is seen
+    """
+    width, height = dimensions
+    key = (
+        hashlib.blake2b(image_data, digest_size=16).digest(),
+        width,
+        height,
+        scale,
+        format,
+        region,
+    )
+
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    prepared = _prepare_texture(image_data, dimensions, scale, format, region)
+
+    if prepared[0] is image_data:
+        # Nothing was done to it, and it may be a view of a file that is about
+        # to be closed
+        return prepared
+
+    with _cache_lock:
+        _cache[key] = prepared
+        while len(_cache) > TEXTURE_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return prepared
+
+
+def _prepare_texture(image_data, dimensions, scale, format, region):
+    """ Does the work for prepare_texture(). """
+    mime_type = image_mime_type(image_data)
+    size = png_size(image_data)
+    known = mime_type != UNKNOWN_MIME_TYPE
+
+    if size is None or format != ORIGINAL_FORMAT or scale < 1 or not known:
+        # We'll need to look inside it
+        image = _open_texture(image_data)
+        size = image.size
+    else:
+        image = None
+
+    # Only a texture bigger than the map can be cropped
+    crop = (
+        min(size[0], max(int(ceil(dimensions[0])), 1)),
+        min(size[1], max(int(ceil(dimensions[1])), 1)),
+    )
+
+    window = (None, None)
+    if region is not None:
+        window = texture_window(crop, dimensions, region)
+
+    origin = tuple(None if axis is None else axis[0] for axis in window)
+    drawn = tuple(
+        length if axis is None else axis[1]
+        for length, axis in zip(crop, window)
+    )
+
+    if (drawn == size and scale >= 1 and format == ORIGINAL_FORMAT
+            and known):
+        return image_data, mime_type, size, origin
+
+    if image is None:
+        image = _open_texture(image_data)
+
+    if crop != size:
+        image = image.crop((0, 0) + crop)
+
+    if drawn != crop:
+        from PIL import ImageChops
+
+        # Bring the part under the region to the corner (wrapping around, as
+        # the tiles would) and keep just that
+        shift = tuple(
+            0 if axis is None else -(axis[0] % length)
+            for length, axis in zip(crop, window)
+        )
+        image = ImageChops.offset(image, *shift).crop((0, 0) + drawn)
+
+    if scale < 1:
+        from PIL import Image
+
+        image = image.resize(
+            (
+                max(int(round(drawn[0] * scale)), 1),
+                max(int(round(drawn[1] * scale)), 1),
+            ),
+            Image.LANCZOS
+        )
+
+    if format == ORIGINAL_FORMAT:
+        format = MIME_ENCODERS.get(mime_type, 'png')
+
+    if image.mode not in ('RGB', 'RGBA'):
+        has_alpha = 'A' in image.mode or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    data, mime_type = encoders.encode_image(image, format)
+
+    return data, mime_type, drawn, origin
+
+
+def _open_texture(image_data):
+    """
+    Opens texture data with Pillow. Raises ValueError if it isn't an image
+    that Pillow can read.
+    """
+    try:
+        return buffers.open_image(image_data)
+    except (OSError, SyntaxError) as err:
+        raise ValueError("Texture isn't a readable image ({})".format(err))
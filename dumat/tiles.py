@@ -0,0 +1,499 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Exports a map as a Deep Zoom tile pyramid for web viewers (eg. OpenSeadragon)
+instead of one enormous image.
+
+The full resolution level is rendered tile by tile (in parallel) with
+render_region(). Each coarser level is made by stitching together and
+downsampling the four tiles below it, rather than rendering again. Tiles with
+no floor anywhere near them are nothing but wall texture, so they are filled
+in with the tiled texture instead of being rendered. Wall tiles that come out
+the same (the same size and offset into the texture) are only encoded once;
+the rest are hard links to the first one.
+
+For an output path of "map.dzi" the layout is:
+
+    map.dzi                       Deep Zoom descriptor
+    map.json                      manifest, including the wall-only tiles
+    map_files/<level>/<col>_<row>.<extension>
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+import json
+import math
+import os
+import shutil
+
+from dumat import buffers, encoders, excavate, textures
+from dumat.floorplan import PreparedFloorplan
+
+# Default width and height of a tile in px
+TILE_PX = 256
+
+# The seed used when none is given; every tile has to jitter the outline the
+# same way, or the walls won't line up where tiles meet
+DEFAULT_SEED = 0
+
+DZI_TEMPLATE = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008"
+       Format="{format}" Overlap="0" TileSize="{tile_px}">
+  <Size Width="{width}" Height="{height}"/>
+</Image>
+"""
+
+# State for the rendering processes, set up once per process by _init_worker
+_worker_state = {}
+
+
+def level_count(width, height):
+    """
+    Returns the number of Deep Zoom levels for an image of the given size.
+    Level 0 is a single pixel and the last level is full resolution.
+    """
+    return int(math.ceil(math.log2(max(width, height, 1)))) + 1
+
+
+def level_size(width, height, level, levels):
+    """ Returns the size in px of the image at the given level. """
+    scale = 2 ** (levels - 1 - level)
+    return (
+        max(int(math.ceil(width / scale)), 1),
+        max(int(math.ceil(height / scale)), 1),
+    )
+
+
+def tile_grid(size, tile_px):
+    """ Returns the number of (columns, rows) of tiles for a level size. """
+    return (
+        int(math.ceil(size[0] / tile_px)),
+        int(math.ceil(size[1] / tile_px)),
+    )
+
+
+def tile_box(column, row, size, tile_px):
+    """
+    Returns the (x, y, width, height) of a tile within a level of the given
+    size. Tiles at the right and bottom edges are cropped to the level.
+    """
+    x = column * tile_px
+    y = row * tile_px
+    return x, y, min(tile_px, size[0] - x), min(tile_px, size[1] - y)
+
+
+def is_wall_only(prepared, box, tile_size):
+    """
+    Returns True if a full resolution tile can't contain any floor or shading.
+    A closed subpath has no winding around points outside its bounding box, so
+    if no subpath's box comes near the tile it must be all wall.
+    """
+    x, y, width, height = box
+    padding = excavate.shading_padding(tile_size)
+
+    return not prepared.subpaths_in((
+        x - padding,
+        y - padding,
+        x + width + padding,
+        y + height + padding,
+    ))
+
+
+def tile_path(files_dir, level, column, row, format):
+    """ Returns the path of a tile file. """
+    return os.path.join(
+        files_dir,
+        str(level),
+        '{}_{}.{}'.format(column, row, format)
+    )
+
+
+def _init_worker(
+        prepared,
+        ground_data,
+        wall_data,
+        tile_size,
+        format,
+        seed,
+        shading,
+        quality,
+        compression_level,
+        texture_format,
+        memory_budget):
+    """
+    Keeps the render inputs in the worker process. Textures given as file
+    names are memory mapped here, so that each process maps them itself
+    rather than being sent a copy; the mappings are kept until
+    _close_worker() is called (or the process ends).
+    """
+    # The tiles are already spread over processes; don't start more
+    prepared.workers = 1
+
+    inputs = ExitStack()
+    ground_data, wall_data = (
+        inputs.enter_context(buffers.input_buffer(source))
+        for source in (ground_data, wall_data)
+    )
+
+    _worker_state.update(
+        inputs=inputs,
+        prepared=prepared,
+        ground_data=ground_data,
+        wall_data=wall_data,
+        tile_size=tile_size,
+        format=format,
+        seed=seed,
+        shading=shading,
+        quality=quality,
+        compression_level=compression_level,
+        texture_format=texture_format,
+        memory_budget=memory_budget,
+    )
+
+
+def _close_worker():
+    """ Lets go of the render inputs kept by _init_worker(). """
+    _worker_state.pop('inputs').close()
+    _worker_state.clear()
+
+
+def _write_tile(path, data):
+    """
+    Writes a tile file, replacing rather than writing through it if it is a
+    hard link left by an earlier export.
+    """
+    if os.path.lexists(path):
+        os.remove(path)
+
+    with open(path, 'wb') as output:
+        output.write(data)
+
+
+def _render_tile(box, path):
+    """ Renders one full resolution tile to a file (in a worker process). """
+    data, _ = excavate.render_region(
+        *box,
+        _worker_state['prepared'],
+        _worker_state['ground_data'],
+        _worker_state['wall_data'],
+        _worker_state['tile_size'],
+        _worker_state['format'],
+        seed=_worker_state['seed'],
+        shading=_worker_state['shading'],
+        quality=_worker_state['quality'],
+        compression_level=_worker_state['compression_level'],
+        texture_format=_worker_state['texture_format'],
+        memory_budget=_worker_state['memory_budget'])
+
+    _write_tile(path, data)
+
+
+def _texture_size(wall_image, scale):
+    """ Returns the size of the wall texture at the given scale. """
+    return (
+        max(int(round(wall_image.width * scale)), 1),
+        max(int(round(wall_image.height * scale)), 1),
+    )
+
+
+def _wall_tile(wall_image, scale, box):
+    """
+    Returns a Pillow image of the wall texture tiled over the given box of a
+    level that is "scale" times the full resolution.
+    """
+    from PIL import Image
+
+    x, y, width, height = box
+
+    texture_width, texture_height = _texture_size(wall_image, scale)
+    texture = wall_image.resize((texture_width, texture_height), Image.BOX)
+
+    tile = Image.new(wall_image.mode, (width, height))
+
+    for ty in range(-(y % texture_height), height, texture_height):
+        for tx in range(-(x % texture_width), width, texture_width):
+            tile.paste(texture, (tx, ty))
+
+    return tile
+
+
+def _write_wall_tile(path, wall_image, scale, box, written, encode):
+    """
+    Writes a tile that is nothing but wall texture. Returns True if it had to
+    be encoded, or False if it is a link to an identical one.
+
+    @param written a dictionary of the wall tiles written so far, which is
+           updated; tiles with the same size and offset into the texture are
+           the same
+    @param encode a function that encodes a Pillow image as tile data
+    """
+    x, y, width, height = box
+    texture_width, texture_height = _texture_size(wall_image, scale)
+    key = (scale, x % texture_width, y % texture_height, width, height)
+
+    if key in written:
+        if os.path.lexists(path):
+            os.remove(path)
+
+        try:
+            os.link(written[key], path)
+        except OSError:
+            # Eg. the file system doesn't support hard links
+            shutil.copyfile(written[key], path)
+
+        return False
+
+    _write_tile(path, encode(_wall_tile(wall_image, scale, box)))
+    written[key] = path
+    return True
+
+
+def export_tile_pyramid(
+        output_path,
+        floorplan,
+        ground_data,
+        wall_data,
+        tile_size,
+        format='png',
+        tile_px=TILE_PX,
+        workers=None,
+        skip_wall=True,
+        seed=DEFAULT_SEED,
+        shading='filter',
+        quality=None,
+        compression_level=None,
+        texture_format=textures.ORIGINAL_FORMAT,
+        memory_budget=None,
+        report=None):
+    """
+    Renders the map as a Deep Zoom tile pyramid. Returns the manifest (which
+    is also written next to the descriptor).
+
+    @param output_path the path of the ".dzi" descriptor to write
+    @param floorplan a PreparedFloorplan, or floorplan data to prepare
+    @param ground_data the ground texture, as a file name (which is memory
+           mapped rather than read, see dumat.buffers) or any buffer
+    @param wall_data the wall texture, in the same way
+    @param format the tile format, any raster format (with an optional
+           preset) from dumat.encoders
+    @param tile_px the width and height of the tiles in px
+    @param workers the number of processes to render tiles with (None for one
+           per CPU, 1 to render in this process)
+    @param skip_wall don't render tiles that are nothing but wall texture, but
+           fill them in with the tiled texture, which is much quicker
+    @param seed the seed for jittering the outline; every tile uses the same
+           one so that the walls match up (None for DEFAULT_SEED)
+    @param shading 'filter' or 'baked' (see excavate.render_room)
+    @param quality the encoder quality, overriding the preset
+    @param compression_level the encoder compression level, overriding the
+           preset
+    @param texture_format the format to re-encode the textures in (see
+           textures.prepare_texture)
+    @param memory_budget if not None, the most bytes rendering each tile may
+           use (see excavate.render_room)
+    @param report if not None, a dictionary that is filled in with the number
+           of tiles rendered, made from other tiles and filled with wall
+    """
+    from PIL import Image
+
+    if not encoders.is_raster(format):
+        raise ValueError('Tiles need a raster format')
+
+    extension = encoders.extension(format)
+
+    if seed is None:
+        seed = DEFAULT_SEED
+
+    if not isinstance(floorplan, PreparedFloorplan):
+        floorplan = excavate.prepare_floorplan(floorplan)
+
+    base, _ = os.path.splitext(output_path)
+    files_dir = base + '_files'
+
+    width = int(math.ceil(floorplan.width))
+    height = int(math.ceil(floorplan.height))
+    levels = level_count(width, height)
+    top = levels - 1
+
+    for level in range(levels):
+        os.makedirs(os.path.join(files_dir, str(level)), exist_ok=True)
+
+    def encode(image):
+        data, _ = encoders.encode_image(
+            image,
+            format,
+            quality,
+            compression_level
+        )
+        return data
+
+    with buffers.input_buffer(wall_data) as wall_buffer:
+        wall_image = buffers.open_image(wall_buffer).convert('RGB')
+    written = {}
+    wall_encoded = 0
+
+    # Render the full resolution level
+    wall_only = {level: set() for level in range(levels)}
+    jobs = []
+    columns, rows = tile_grid((width, height), tile_px)
+
+    for row in range(rows):
+        for column in range(columns):
+            box = tile_box(column, row, (width, height), tile_px)
+            path = tile_path(files_dir, top, column, row, extension)
+
+            if skip_wall and is_wall_only(floorplan, box, tile_size):
+                wall_only[top].add((column, row))
+                wall_encoded += _write_wall_tile(
+                    path,
+                    wall_image,
+                    1.0,
+                    box,
+                    written,
+                    encode
+                )
+            else:
+                jobs.append((box, path))
+
+    init_args = (
+        floorplan,
+        ground_data,
+        wall_data,
+        tile_size,
+        format,
+        seed,
+        shading,
+        quality,
+        compression_level,
+        texture_format,
+        memory_budget,
+    )
+
+    if workers == 1:
+        _init_worker(*init_args)
+        try:
+            for box, path in jobs:
+                _render_tile(box, path)
+        finally:
+            _close_worker()
+    else:
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=init_args) as executor:
+            for future in [executor.submit(_render_tile, *job) for job in jobs]:
+                future.result()
+
+    # Build each coarser level from the one below it
+    downsampled = 0
+
+    for level in range(top - 1, -1, -1):
+        size = level_size(width, height, level, levels)
+        child_size = level_size(width, height, level + 1, levels)
+        scale = 2.0 ** (level - top)
+        child_scale = 2 * scale
+        columns, rows = tile_grid(size, tile_px)
+        child_columns, child_rows = tile_grid(child_size, tile_px)
+
+        for row in range(rows):
+            for column in range(columns):
+                children = [
+                    (child_column, child_row)
+                    for child_row in (2 * row, 2 * row + 1)
+                    for child_column in (2 * column, 2 * column + 1)
+                    if child_column < child_columns and child_row < child_rows
+                ]
+
+                box = tile_box(column, row, size, tile_px)
+                path = tile_path(files_dir, level, column, row, extension)
+
+                if all(child in wall_only[level + 1] for child in children):
+                    wall_only[level].add((column, row))
+                    wall_encoded += _write_wall_tile(
+                        path,
+                        wall_image,
+                        scale,
+                        box,
+                        written,
+                        encode
+                    )
+                    continue
+
+                origin = (2 * column * tile_px, 2 * row * tile_px)
+                canvas = Image.new(
+                    'RGB',
+                    (
+                        min(2 * tile_px, child_size[0] - origin[0]),
+                        min(2 * tile_px, child_size[1] - origin[1]),
+                    )
+                )
+
+                for child in children:
+                    child_box = tile_box(*child, child_size, tile_px)
+
+                    if child in wall_only[level + 1]:
+                        image = _wall_tile(wall_image, child_scale, child_box)
+                    else:
+                        image = Image.open(
+                            tile_path(files_dir, level + 1, *child, extension)
+                        ).convert('RGB')
+
+                    canvas.paste(
+                        image,
+                        (child_box[0] - origin[0], child_box[1] - origin[1])
+                    )
+
+                tile = canvas.resize((box[2], box[3]), Image.LANCZOS)
+                _write_tile(path, encode(tile))
+
+                downsampled += 1
+
+    manifest = {
+        'width': width,
+        'height': height,
+        'tile_px': tile_px,
+        'format': extension,
+        'levels': levels,
+        'tiles': os.path.basename(files_dir) + '/{level}/{column}_{row}.' + extension,
+        'wall_only': {
+            str(level): sorted(tiles)
+            for level, tiles in wall_only.items()
+            if tiles
+        },
+    }
+
+    with open(output_path, 'w') as output:
+        output.write(DZI_TEMPLATE.format(
+            format=extension,
+            tile_px=tile_px,
+            width=width,
+            height=height,
+        ))
+
+    with open(base + '.json', 'w') as output:
+        json.dump(manifest, output, indent=2)
+
+    if report is not None:
+        report.update(
+            levels=levels,
+            seed=seed,
+            tiles_rendered=len(jobs),
+            tiles_downsampled=downsampled,
+            tiles_wall=sum(len(tiles) for tiles in wall_only.values()),
+            tiles_wall_encoded=wall_encoded,
+        )
+
+    return manifest
@@ -0,0 +1,454 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+The walls of a floorplan as straight line segments, for virtual tabletops that
+do their own dynamic lighting, and fast line of sight queries against them.
+
+The segments follow the edge of the floor as it was traced (not the jittered
+outline that is drawn), with curves flattened into pieces no longer than
+WALL_STEP px. They can be saved as JSON:
+
+    {"width": 1000, "height": 800, "segments": [[x0, y0, x1, y1], ...]}
+
+or as a compact binary file: WALLS_MAGIC, the width and height (little endian
+doubles), the number of segments (a little endian unsigned int) and then the
+x0, y0, x1, y1 of each segment (little endian floats).
+
+Line of sight queries are done for many rays at once with NumPy. The segments
+are put in a uniform grid; each ray only tests the segments in the cells it
+passes through, which are found for all rays together by stepping them across
+the grid one cell at a time. A ray that hits a piece of a curve can have the
+hit moved onto the curve itself (see bezmisc.linebezierintersect).
+
+NumPy is an optional dependency; this module is only imported when it's
+needed.
+"""
+import json
+from math import ceil, hypot
+import struct
+
+import numpy as np
+
+from dumat import bezmisc, cubicsuperpath
+from dumat.spatial import GridIndex
+
+# Identifies a binary wall segment file (the last byte is the version)
+WALLS_MAGIC = b'DUMATWL\x01'
+
+# Maximum length in px of the straight pieces that curved walls are flattened
+# into
+WALL_STEP = 4.0
+
+# Decimal places kept for coordinates in JSON
+JSON_PRECISION = 2
+
+# Segments are put in the grid cells that their bounding box grown by this
+# much (in px) overlaps, so that rays through a cell corner don't miss them
+CELL_MARGIN = 1e-6
+
+
+def flatten_walls(p, step=WALL_STEP):
+    """
+    Returns the edges of the subpaths of a cubicsuperpath as line segments.
+    Subpaths are closed if they aren't already. Returns an (n, 4) array of the
+    segments (x0, y0, x1, y1), a list of the cubic Bezier curves (as the four
+    points bezmisc uses) that were flattened, and an array of the number of
+    the curve each segment came from (-1 for straight segments).
+    """
+    segments = []
+    curves = []
+    curve_numbers = []
+
+    for subpath in p:
+        if not subpath:
+            continue
+
+        for sp1, sp2 in zip(subpath, subpath[1:]):
+            if cubicsuperpath.isLine(sp1, sp2):
+                if sp1[1] != sp2[1]:
+                    segments.append((sp1[1][0], sp1[1][1], sp2[1][0], sp2[1][1]))
+                    curve_numbers.append(-1)
+                continue
+
+            bez = (tuple(sp1[1]), tuple(sp1[2]), tuple(sp2[0]), tuple(sp2[1]))
+
+            # The control polygon is at least as long as the curve
+            length = sum(
+                hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(bez, bez[1:])
+            )
+            pieces = max(int(ceil(length / step)), 1)
+
+            points = [bez[0]] + [
+                bezmisc.bezierpointatt(bez, piece / pieces)
+                for piece in range(1, pieces)
+            ] + [bez[3]]
+
+            for a, b in zip(points, points[1:]):
+                segments.append((a[0], a[1], b[0], b[1]))
+                curve_numbers.append(len(curves))
+
+            curves.append(bez)
+
+        start, end = subpath[0][1], subpath[-1][1]
+        if start != end:
+            # Close it with a straight line
+            segments.append((end[0], end[1], start[0], start[1]))
+            curve_numbers.append(-1)
+
+    return (
+        np.array(segments, dtype=float).reshape(-1, 4),
+        curves,
+        np.array(curve_numbers, dtype=int),
+    )
+
+
+class WallIndex(object):
+    """
+    Wall segments in a uniform grid, for batched ray casting. The grid is
+    kept as one array of segment numbers sorted by cell, and the offset of
+    each cell's run in it, so a whole batch of rays can look their cells up
+    at once.
+    """
+
+    def __init__(
+            self,
+            width,
+            height,
+            segments,
+            curves=(),
+            curve_numbers=None,
+            cell_size=None):
+        """
+        @param segments an (n, 4) array of segments (x0, y0, x1, y1)
+        @param curves the cubic Bezier curves that segments were flattened
+               from, if any (see flatten_walls)
+        @param curve_numbers the curve each segment came from (-1 for none),
+               or None if they are all straight
+        @param cell_size the width and height of a grid cell in px, or None
+               to choose one with about one segment per cell
+        """
+        self.width = float(width)
+        self.height = float(height)
+        self.segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+        self.curves = list(curves)
+
+        if curve_numbers is None:
+            curve_numbers = np.full(len(self.segments), -1, dtype=int)
+        self.curve_numbers = np.asarray(curve_numbers, dtype=int)
+
+        if cell_size is None:
+            cell_size = GridIndex.auto_cell_size(self._bboxes())
+        self.cell_size = float(cell_size)
+
+        self._build_grid()
+
+    @classmethod
+    def from_floorplan(cls, prepared, step=WALL_STEP, cell_size=None):
+        """ Indexes the walls of a PreparedFloorplan. """
+        segments, curves, curve_numbers = flatten_walls(prepared.floor, step)
+        return cls(
+            prepared.width,
+            prepared.height,
+            segments,
+            curves,
+            curve_numbers,
+            cell_size
+        )
+
+    def _bboxes(self):
+        """ Returns the bounding box of each segment, as a list of tuples. """
+        s = self.segments
+        return list(zip(
+            np.minimum(s[:, 0], s[:, 2]),
+            np.minimum(s[:, 1], s[:, 3]),
+            np.maximum(s[:, 0], s[:, 2]),
+            np.maximum(s[:, 1], s[:, 3]),
+        ))
+
+    def _build_grid(self):
+        """ Puts every segment in the cells its bounding box overlaps. """
+        s = self.segments
+        size = self.cell_size
+
+        first = np.floor(
+            (np.minimum(s[:, :2], s[:, 2:]) - CELL_MARGIN) / size
+        ).astype(int)
+        last = np.floor(
+            (np.maximum(s[:, :2], s[:, 2:]) + CELL_MARGIN) / size
+        ).astype(int)
+
+        if len(s):
+            self._origin = first.min(axis=0)
+            self._shape = last.max(axis=0) - self._origin + 1
+        else:
+            self._origin = np.zeros(2, dtype=int)
+            self._shape = np.ones(2, dtype=int)
+
+        first -= self._origin
+        last -= self._origin
+
+        # Every (segment, cell) pair; segments are short, so there are few
+        spans = last - first + 1
+        counts = spans[:, 0] * spans[:, 1]
+        numbers = np.repeat(np.arange(len(s)), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        columns = first[numbers, 0] + within % spans[numbers, 0]
+        rows = first[numbers, 1] + within // spans[numbers, 0]
+
+        cells = rows * self._shape[0] + columns
+        order = np.argsort(cells, kind='stable')
+
+        self._cell_segments = numbers[order]
+        self._cell_starts = np.searchsorted(
+            cells[order],
+            np.arange(self._shape[0] * self._shape[1] + 1)
+        )
+
+    def _ray_cells(self, origins, deltas):
+        """
+        Steps each ray (origin + t * delta, for t from 0 to 1) through the
+        grid. Returns arrays of the ray number and grid cell number of every
+        cell that a ray passes through.
+        """
+        size = self.cell_size
+        start = origins / size - self._origin
+        cell = np.floor(start).astype(int)
+        step = np.where(deltas > 0, 1, -1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # The t at which each ray crosses into the next column and row,
+            # and how much t it takes to cross a whole cell
+            boundary = cell + (step > 0)
+            t_next = np.where(deltas != 0, (boundary - start) * size / deltas, np.inf)
+            t_delta = np.where(deltas != 0, size / np.abs(deltas), np.inf)
+
+        rays = np.arange(len(origins))
+        found_rays = []
+        found_cells = []
+
+        while len(rays):
+            inside = (
+                (cell[:, 0] >= 0) & (cell[:, 0] < self._shape[0])
+                & (cell[:, 1] >= 0) & (cell[:, 1] < self._shape[1])
+            )
+            found_rays.append(rays[inside])
+            found_cells.append(cell[inside, 1] * self._shape[0] + cell[inside, 0])
+
+            # Step across whichever boundary comes first
+            axis = (t_next[:, 1] < t_next[:, 0]).astype(int)
+            picked = np.arange(len(rays))
+            t = t_next[picked, axis]
+
+            # Stop rays that have reached their end, or have left the grid
+            # heading away from it
+            moving = t <= 1
+            cell[picked, axis] += step[picked, axis]
+            t_next[picked, axis] += t_delta[picked, axis]
+
+            leaving = (
+                ((cell[:, 0] < 0) & (step[:, 0] < 0))
+                | ((cell[:, 0] >= self._shape[0]) & (step[:, 0] > 0))
+                | ((cell[:, 1] < 0) & (step[:, 1] < 0))
+                | ((cell[:, 1] >= self._shape[1]) & (step[:, 1] > 0))
+            )
+            keep = moving & ~leaving
+
+            rays = rays[keep]
+            cell = cell[keep]
+            step = step[keep]
+            t_next = t_next[keep]
+            t_delta = t_delta[keep]
+
+        return np.concatenate(found_rays), np.concatenate(found_cells)
+
+    def cast_rays(self, origins, targets, refine=False):
+        """
+        Finds where each ray from an origin towards its target first hits a
+        wall, if it does before reaching the target. Returns an array of the
+        fraction of the way to the target of each hit (np.inf where there
+        isn't one) and an array of the number of the segment hit (-1 where
+        there isn't one).
+
+        @param origins an (n, 2) array of ray origins
+        @param targets an (n, 2) array of ray ends
+        @param refine move hits on flattened curves onto the curves themselves
+        """
+        origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+        deltas = np.asarray(targets, dtype=float).reshape(-1, 2) - origins
+
+        fractions = np.full(len(origins), np.inf)
+        hit_segments = np.full(len(origins), -1, dtype=int)
+
+        if not len(origins) or not len(self.segments):
+            return fractions, hit_segments
+
+        ray_numbers, cells = self._ray_cells(origins, deltas)
+
+        # Every (ray, segment) pair to test
+        starts = self._cell_starts[cells]
+        counts = self._cell_starts[cells + 1] - starts
+        pair_rays = np.repeat(ray_numbers, counts)
+        pair_segments = self._cell_segments[
+            np.repeat(starts, counts)
+            + np.arange(counts.sum())
+            - np.repeat(np.cumsum(counts) - counts, counts)
+        ]
+
+        # Intersect origin + t * delta with start + u * (end - start)
+        p = origins[pair_rays]
+        r = deltas[pair_rays]
+        q = self.segments[pair_segments, :2]
+        s = self.segments[pair_segments, 2:] - q
+        qp = q - p
+
+        denominator = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (qp[:, 0] * s[:, 1] - qp[:, 1] * s[:, 0]) / denominator
+            u = (qp[:, 0] * r[:, 1] - qp[:, 1] * r[:, 0]) / denominator
+
+        # Parallel segments don't block
+        hits = (denominator != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        pair_rays = pair_rays[hits]
+        pair_segments = pair_segments[hits]
+        t = t[hits]
+
+        # The nearest hit for each ray
+        order = np.lexsort((t, pair_rays))
+        pair_rays = pair_rays[order]
+        first = np.ones(len(pair_rays), dtype=bool)
+        first[1:] = pair_rays[1:] != pair_rays[:-1]
+
+        fractions[pair_rays[first]] = t[order][first]
+        hit_segments[pair_rays[first]] = pair_segments[order][first]
+
+        if refine:
+            self._refine_hits(origins, deltas, fractions, hit_segments)
+
+        return fractions, hit_segments
+
+    def _refine_hits(self, origins, deltas, fractions, hit_segments):
+        """
+        Moves the hits on flattened curves onto the curves, where the ray
+        crosses the curve near the flattened hit.
+        """
+        curved = np.flatnonzero(hit_segments >= 0)
+        curved = curved[self.curve_numbers[hit_segments[curved]] >= 0]
+
+        for ray in curved:
+            bez = self.curves[self.curve_numbers[hit_segments[ray]]]
+            # bezmisc tells real roots from complex ones by their Python type,
+            # so it needs plain floats rather than NumPy scalars
+            (ox, oy), (dx, dy) = origins[ray].tolist(), deltas[ray].tolist()
+
+            if dx == 0 and dy == 0:
+                continue
+
+            line = ((ox, oy), (ox + dx, oy + dy))
+
+            best = None
+            for x, y in bezmisc.linebezierintersect((line, bez)):
+                # Where the point is along the ray
+                t = ((x - ox) * dx + (y - oy) * dy) / (dx * dx + dy * dy)
+                if 0 <= t <= 1 and (
+                        best is None
+                        or abs(t - fractions[ray]) < abs(best - fractions[ray])):
+                    best = t
+
+            if best is not None:
+                fractions[ray] = best
+
+    def line_of_sight(self, origins, targets):
+        """
+        Returns a boolean array of whether each target can be seen from its
+        origin, ie. no wall crosses the line between them.
+        """
+        fractions, _ = self.cast_rays(origins, targets)
+        return np.isinf(fractions)
+
+    def hit_points(self, origins, targets, refine=False):
+        """
+        Returns an (n, 2) array of where each ray from an origin towards its
+        target stops: at the first wall it hits, or at the target.
+        """
+        origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+        targets = np.asarray(targets, dtype=float).reshape(-1, 2)
+        fractions, _ = self.cast_rays(origins, targets, refine)
+        fractions = np.minimum(fractions, 1.0)[:, None]
+        return origins + fractions * (targets - origins)
+
+    def to_json(self):
+        """ Returns the wall segments as JSON (see the module description). """
+        return json.dumps({
+            'width': self.width,
+            'height': self.height,
+            'segments': np.round(self.segments, JSON_PRECISION).tolist(),
+        }, separators=(',', ':'))
+
+    def to_bytes(self):
+        """ Returns the wall segments in the compact binary format. """
+        return (
+            WALLS_MAGIC
+            + struct.pack('<ddI', self.width, self.height, len(self.segments))
+            + self.segments.astype('<f4').tobytes()
+        )
+
+    @classmethod
+    def from_bytes(cls, data, cell_size=None):
+        """ Loads wall segments saved by to_bytes(). """
+        if bytes(data[:len(WALLS_MAGIC)]) != WALLS_MAGIC:
+            raise ValueError("Not a wall segment file")
+
+        offset = len(WALLS_MAGIC)
+        width, height, count = struct.unpack_from('<ddI', data, offset)
+        offset += struct.calcsize('<ddI')
+
+        segments = np.frombuffer(data, dtype='<f4', count=count * 4, offset=offset)
+
+        return cls(width, height, segments.astype(float), cell_size=cell_size)
+
+    @classmethod
+    def from_json(cls, text, cell_size=None):
+        """ Loads wall segments saved by to_json(). """
+        walls = json.loads(text)
+        return cls(
+            walls['width'],
+            walls['height'],
+            walls['segments'],
+            cell_size=cell_size
+        )
+
+    def save(self, path):
+        """
+        Writes the wall segments to a file, as JSON if its name ends in
+        '.json' and in the binary format otherwise.
+        """
+        if path.lower().endswith('.json'):
+            with open(path, 'w') as output:
+                output.write(self.to_json())
+        else:
+            with open(path, 'wb') as output:
+                output.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path, cell_size=None):
+        """ Reads wall segments from a file written by save(). """
+        with open(path, 'rb') as source:
+            data = source.read()
+
+        if data.startswith(WALLS_MAGIC):
+            return cls.from_bytes(data, cell_size)
+
+        return cls.from_json(data.decode('utf-8'), cell_size)
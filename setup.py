@@ -29,9 +29,14 @@ setup(
         'BeautifulSoup4',
         'lxml',
         'pillow',
-        'cssutils',
         'wand',
     ],
+
+    extras_require = {
+        'baked': ['numpy'],
+        'walls': ['numpy'],
+        'occupancy': ['numpy'],
+    },
     
     entry_points = {
         'console_scripts': [
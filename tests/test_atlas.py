@@ -0,0 +1,102 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for dumat.atlas. """
+from collections import Counter
+from io import BytesIO
+import re
+
+import pytest
+
+from dumat import atlas
+from dumat.floorplan import PreparedFloorplan
+
+
+def test_layout_square_grid():
+    positions, total = atlas.atlas_layout([(100, 80), (60, 120), (90, 90)])
+
+    # Two columns: the first as wide as rooms 1 and 3, the second as room 2
+    assert positions == [(0, 0), (100, 0), (0, 120)]
+    assert total == (160, 210)
+
+
+def test_layout_columns_and_gap():
+    positions, total = atlas.atlas_layout(
+        [(10, 10), (20.2, 5), (5, 30)],
+        columns=3,
+        gap=4
+    )
+
+    # Sizes are rounded up to whole px
+    assert positions == [(0, 0), (14, 0), (39, 0)]
+    assert total == (44, 30)
+
+
+def test_layout_errors():
+    with pytest.raises(ValueError, match='at least one room'):
+        atlas.atlas_layout([])
+
+    with pytest.raises(ValueError, match='at least one column'):
+        atlas.atlas_layout([(1, 1)], columns=0)
+
+
+def _room(width, height):
+    return PreparedFloorplan.from_path(
+        'M 10,10 L {0},10 L {0},{1} L 10,{1} Z'.format(width - 10, height - 10),
+        width,
+        height
+    )
+
+
+def _texture(colour):
+    Image = pytest.importorskip('PIL.Image')
+    output = BytesIO()
+    Image.new('RGB', (32, 32), colour).save(output, 'PNG')
+    return output.getvalue()
+
+
+def test_render_svg_atlas():
+    pytest.importorskip('bs4')
+
+    report = {}
+    data, mime_type = atlas.render_atlas(
+        [_room(100, 80), _room(60, 120), _room(90, 90)],
+        _texture((10, 20, 30)),
+        _texture((40, 50, 60)),
+        20,
+        seed=1,
+        report=report
+    )
+    svg = data.decode('utf-8')
+
+    assert mime_type == 'image/svg+xml'
+    assert [(room['x'], room['y']) for room in report['rooms']] == [
+        (0, 0), (120, 0), (0, 140)
+    ]
+
+    ids = Counter(re.findall(r'\bid="([^"]+)"', svg))
+
+    # IDs are unique, the textures are embedded once, and every room has its
+    # own (prefixed) clip paths
+    assert max(ids.values()) == 1
+    assert svg.count('data:image/png;base64,') == 2
+    for number in (1, 2, 3):
+        assert 'room-{}-clip-path-floor'.format(number) in ids
+
+    # Every reference is to something in the atlas
+    for reference in re.findall(r'url\(#([\w.:-]+)\)', svg):
+        assert reference in ids
+
+    assert 'dumat-deferred-path' not in svg
@@ -0,0 +1,199 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for dumat.budget. """
+import pytest
+
+from dumat import budget, cubicsuperpath
+from dumat.floorplan import PreparedFloorplan
+
+
+@pytest.fixture(autouse=True)
+def reference_machine(monkeypatch):
+    """ Plans as if on the reference machine, rather than probing this one. """
+    monkeypatch.setattr(budget, '_machine_factor', 1.0)
+
+
+def _prepared(width=4000, height=4000):
+    return PreparedFloorplan(
+        width,
+        height,
+        cubicsuperpath.parsePath(
+            'M 100,100 L 3900,100 L 3900,3900 L 100,3900 Z '
+            'M 2000,2000 L 2100,2000 L 2100,2100 Z'
+        ),
+        []
+    )
+
+
+def test_outline_stats():
+    p = cubicsuperpath.parsePath('M 0,0 L 3,4 L 3,0 Z M 10,10 L 11,10')
+
+    length, segments = budget.outline_stats(p)
+
+    assert length == pytest.approx(5 + 4 + 3 + 1)
+    assert segments == 4 + 2
+
+
+def test_estimate_grows_with_scale_and_detail():
+    stats = {'length': 10000, 'segments': 100, 'area': 1000 * 1000}
+
+    def estimate(shading='filter', scale=1.0, detail=1.0):
+        return budget.estimate_seconds(stats, 50, True, shading, scale, detail)
+
+    assert estimate(scale=0.5) < estimate()
+    assert estimate(detail=0.5) < estimate()
+    assert budget.estimate_seconds(stats, 50, False, 'filter', 1.0, 1.0) < estimate()
+
+
+def test_generous_budget_changes_nothing():
+    plan = budget.plan_render(_prepared(), 50, True, 'filter', 1.0, 1e6)
+
+    assert plan['degradations'] == []
+    assert (plan['shading'], plan['scale'], plan['detail']) == ('filter', 1.0, 1.0)
+
+
+def test_tight_budget_degrades_in_order():
+    # Lots of thin rooms, so the outline is a big part of the cost
+    thin_rooms = PreparedFloorplan(
+        1000,
+        1000,
+        cubicsuperpath.parsePath(' '.join(
+            'M {0},10 L {1},10 L {1},990 L {0},990 Z'.format(x, x + 1)
+            for x in range(0, 1000, 2)
+        )),
+        []
+    )
+
+    plan = budget.plan_render(thin_rooms, 50, True, 'filter', 1.0, 0.0)
+    kinds = [degradation.split('=')[0] for degradation in plan['degradations']]
+
+    assert kinds[0] == 'outline_detail'
+    assert kinds == sorted(kinds, key=['outline_detail', 'shading', 'scale'].index)
+    assert plan['detail'] < 1
+    assert plan['scale'] == budget.MIN_BUDGET_SCALE
+
+
+def test_vector_output_is_never_scaled():
+    plan = budget.plan_render(_prepared(), 50, False, 'filter', 1.0, 0.0)
+
+    assert plan['scale'] == 1.0
+    assert plan['shading'] == 'filter'
+
+
+def test_degraded_plan_fits_when_it_can():
+    prepared = _prepared()
+    full = budget.plan_render(prepared, 50, True, 'filter', 1.0, 1e6)
+
+    plan = budget.plan_render(
+        prepared,
+        50,
+        True,
+        'filter',
+        1.0,
+        full['estimated_seconds'] / 4
+    )
+
+    assert plan['degradations']
+    assert plan['estimated_seconds'] <= full['estimated_seconds'] / 4
+
+
+def test_region_costs_less():
+    prepared = _prepared()
+
+    whole = budget.plan_render(prepared, 50, True, 'filter', 1.0, 1e6)
+    region = budget.plan_render(
+        prepared,
+        50,
+        True,
+        'filter',
+        1.0,
+        1e6,
+        region=(0, 0, 500, 500)
+    )
+
+    assert region['estimated_seconds'] < whole['estimated_seconds']
+
+
+def test_estimate_scales_with_machine_factor():
+    stats = {'length': 10000, 'segments': 100, 'area': 1000 * 1000}
+    reference = budget.estimate_seconds(stats, 50, True, 'filter', 1.0, 1.0)
+
+    slow = budget.estimate_seconds(stats, 50, True, 'filter', 1.0, 1.0, 3.0)
+
+    assert slow == pytest.approx(3 * reference)
+
+
+def test_slower_machine_degrades_more():
+    prepared = _prepared()
+    full = budget.plan_render(prepared, 50, True, 'filter', 1.0, 1e6)
+    seconds = full['estimated_seconds'] * 2
+
+    quick = budget.plan_render(prepared, 50, True, 'filter', 1.0, seconds)
+    slow = budget.plan_render(
+        prepared,
+        50,
+        True,
+        'filter',
+        1.0,
+        seconds,
+        factor=4.0
+    )
+
+    assert quick['degradations'] == []
+    assert slow['degradations']
+    assert slow['estimated_seconds'] <= seconds
+
+
+def test_plan_uses_measured_factor(monkeypatch):
+    prepared = _prepared()
+    reference = budget.plan_render(prepared, 50, True, 'filter', 1.0, 1e6)
+
+    monkeypatch.setattr(budget, '_machine_factor', 2.0)
+    plan = budget.plan_render(prepared, 50, True, 'filter', 1.0, 1e6)
+
+    assert plan['estimated_seconds'] == pytest.approx(
+        2 * reference['estimated_seconds']
+    )
+
+
+def test_machine_factor_is_measured_once(monkeypatch):
+    probes = []
+
+    def probe():
+        probes.append(None)
+        return budget.PROBE_REFERENCE_SECONDS * 2
+
+    monkeypatch.setattr(budget, '_machine_factor', None)
+    monkeypatch.setattr(budget, 'probe_seconds', probe)
+
+    assert budget.machine_factor() == pytest.approx(2)
+    assert budget.machine_factor() == pytest.approx(2)
+    assert len(probes) == 1
+
+
+@pytest.mark.parametrize('probe, factor', [
+    (0.0, budget.MIN_MACHINE_FACTOR),
+    (1e6, budget.MAX_MACHINE_FACTOR),
+])
+def test_machine_factor_limits(monkeypatch, probe, factor):
+    monkeypatch.setattr(budget, '_machine_factor', None)
+    monkeypatch.setattr(budget, 'probe_seconds', lambda: probe)
+
+    assert budget.machine_factor() == factor
+
+
+def test_probe_seconds():
+    assert 0 < budget.probe_seconds() < 1
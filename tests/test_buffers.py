@@ -0,0 +1,89 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for dumat.buffers. """
+from array import array
+import io
+
+import pytest
+
+from dumat import buffers
+
+
+def test_mapped_file(tmp_path):
+    path = tmp_path / 'texture.bin'
+    path.write_bytes(b'texture data')
+
+    with buffers.mapped_file(str(path)) as view:
+        assert isinstance(view, memoryview)
+        assert bytes(view) == b'texture data'
+
+
+def test_mapped_empty_file(tmp_path):
+    path = tmp_path / 'empty.bin'
+    path.write_bytes(b'')
+
+    with buffers.mapped_file(path) as view:
+        assert bytes(view) == b''
+
+
+def test_input_buffer(tmp_path):
+    path = tmp_path / 'floorplan.svg'
+    path.write_bytes(b'<svg/>')
+    data = b'<svg/>'
+
+    with buffers.input_buffer(str(path)) as view:
+        assert bytes(view) == data
+
+    with buffers.input_buffer(data) as view:
+        assert view is data
+
+    # Other buffers are viewed as bytes, without copying
+    source = array('H', [1, 2])
+    with buffers.input_buffer(source) as view:
+        assert view.format == 'B'
+        assert bytes(view) == source.tobytes()
+
+
+def test_buffer_reader():
+    reader = buffers.BufferReader(bytearray(b'0123456789'))
+
+    assert reader.read(3) == b'012'
+    assert reader.tell() == 3
+
+    reader.seek(-2, io.SEEK_END)
+    assert reader.read() == b'89'
+    assert reader.read(5) == b''
+
+    reader.seek(2)
+    reader.seek(3, io.SEEK_CUR)
+    assert reader.read(2) == b'56'
+
+    with pytest.raises(ValueError):
+        reader.seek(-1)
+
+    reader.close()
+    assert reader.closed
+
+
+def test_open_image():
+    Image = pytest.importorskip('PIL.Image')
+
+    output = io.BytesIO()
+    Image.new('RGB', (7, 3)).save(output, 'PNG')
+
+    image = buffers.open_image(memoryview(output.getvalue()))
+
+    assert image.size == (7, 3)
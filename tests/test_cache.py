@@ -0,0 +1,165 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for dumat.cache. """
+import os
+
+import pytest
+
+from dumat import cache
+from dumat.cache import RenderCache, cached_formats
+
+
+def test_key():
+    key = RenderCache.key([b'ground', b'wall'], {'tile_size': 20, 'seed': 0})
+
+    assert key == RenderCache.key([b'ground', b'wall'], {'seed': 0, 'tile_size': 20})
+    assert key != RenderCache.key([b'wall', b'ground'], {'tile_size': 20, 'seed': 0})
+    assert key != RenderCache.key([b'ground', b'wall'], {'tile_size': 21, 'seed': 0})
+
+
+def test_memory_tier():
+    render_cache = RenderCache(memory_size=10)
+
+    render_cache.put('a', b'12345', 'image/png')
+    render_cache.put('b', b'6789', 'image/png')
+
+    assert render_cache.lookup('a') == ((b'12345', 'image/png'), 'memory')
+
+    # 'b' is now the least recently used, so it goes first
+    render_cache.put('c', b'abc', 'image/png')
+
+    assert render_cache.get('b') is None
+    assert render_cache.get('a') is not None
+    assert render_cache.get('c') is not None
+
+    metrics = render_cache.metrics()
+    assert metrics['evictions'] == 1
+    assert metrics['hit_rate'] == pytest.approx(3 / 4)
+
+
+def test_too_big_for_memory():
+    render_cache = RenderCache(memory_size=4)
+    render_cache.put('a', b'12345', 'image/png')
+
+    assert render_cache.get('a') is None
+
+
+def test_disk_tier(tmp_path):
+    directory = str(tmp_path)
+
+    RenderCache(directory).put('a', b'<svg/>', 'image/svg+xml')
+
+    # A new cache (eg. in another process) finds it on disk
+    render_cache = RenderCache(directory)
+    assert render_cache.lookup('a') == ((b'<svg/>', 'image/svg+xml'), 'disk')
+    assert render_cache.lookup('a')[1] == 'memory'
+
+    render_cache.clear()
+    assert RenderCache(directory).get('a') is None
+
+
+def test_disk_eviction(tmp_path):
+    render_cache = RenderCache(str(tmp_path), memory_size=0, disk_size=50)
+
+    for name in 'abc':
+        render_cache.put(name, b'x' * 20, 'image/png')
+        # Make sure the modification times are in order
+        os.utime(render_cache._entry_path(name), (ord(name), ord(name)))
+
+    assert render_cache.get('a') is None
+    assert render_cache.get('c') == (b'x' * 20, 'image/png')
+
+
+def test_failed_write_leaves_no_temporary_file(tmp_path, monkeypatch):
+    render_cache = RenderCache(str(tmp_path))
+
+    def fail(source, destination):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(cache.os, 'replace', fail)
+
+    with pytest.raises(OSError):
+        render_cache.put('a', b'data', 'image/png')
+
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_render_options():
+    assert cache.render_options(tile_size=20, seed=None) == {'tile_size': 20, 'seed': 0}
+    assert cache.render_options(seed=5) == {'seed': 5}
+
+
+def _renderer(degradations=None):
+    calls = []
+
+    def render(formats, report):
+        calls.append(list(formats))
+        if degradations:
+            report['degradations'] = degradations
+        return [(spec.encode('ascii'), 'text/plain') for spec in formats]
+
+    return render, calls
+
+
+def test_cached_formats():
+    render_cache = RenderCache()
+    render, calls = _renderer()
+
+    results, sources = cached_formats(render_cache, [b'in'], {}, ['svg'], render)
+    assert results == [(b'svg', 'text/plain')]
+    assert sources == [None]
+
+    # Only the format that isn't cached yet is rendered
+    results, sources = cached_formats(render_cache, [b'in'], {}, ['svg', 'png'], render)
+    assert results == [(b'svg', 'text/plain'), (b'png', 'text/plain')]
+    assert sources == ['memory', None]
+    assert calls == [['svg'], ['png']]
+
+
+def test_degraded_renders_are_not_cached():
+    render_cache = RenderCache()
+    render, calls = _renderer(['outline'])
+    report = {}
+
+    for _ in range(2):
+        cached_formats(
+            render_cache,
+            [b'in'],
+            {'time_budget': 1.0},
+            ['png'],
+            render,
+            report
+        )
+
+    assert calls == [['png'], ['png']]
+    assert report['degradations'] == ['outline']
+
+
+def test_time_budget_is_not_keyed():
+    render_cache = RenderCache()
+    render, calls = _renderer()
+
+    cached_formats(render_cache, [b'in'], {}, ['png'], render)
+    _, sources = cached_formats(
+        render_cache,
+        [b'in'],
+        {'time_budget': 0.5},
+        ['png'],
+        render
+    )
+
+    assert sources == ['memory']
+    assert calls == [['png']]
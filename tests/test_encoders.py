@@ -0,0 +1,166 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for the output format registry in dumat.encoders. """
+from io import BytesIO
+
+import pytest
+
+from dumat import encoders
+
+
+def test_parse_format():
+    assert encoders.parse_format('png') == ('png', 'default')
+    assert encoders.parse_format('webp:small') == ('webp', 'small')
+
+    with pytest.raises(ValueError, match="Unknown format 'gif'"):
+        encoders.parse_format('gif')
+
+    with pytest.raises(ValueError, match="Unknown preset 'tiny'"):
+        encoders.parse_format('png:tiny')
+
+
+def test_parse_formats():
+    assert encoders.parse_formats('svg') == ['svg']
+    assert encoders.parse_formats(('svg', 'png:fast')) == ['svg', 'png:fast']
+
+    with pytest.raises(ValueError):
+        encoders.parse_formats([])
+
+
+def test_format_properties():
+    assert not encoders.is_raster('svg')
+    assert encoders.is_raster('jpg:small')
+    assert encoders.extension('png8') == 'png'
+    assert encoders.extension('webp') == 'webp'
+
+
+def test_encoder_options():
+    assert encoders.encoder_options('png', 'small') == {
+        'compression_level': 9,
+        'optimize': True,
+    }
+    assert encoders.encoder_options('png', 'small', compression_level=3) == {
+        'compression_level': 3,
+        'optimize': True,
+    }
+    assert encoders.encoder_options('jpg', quality=50) == {'quality': 50}
+
+
+@pytest.mark.parametrize('level', [-1, 10])
+def test_compression_level_range(level):
+    with pytest.raises(ValueError, match='Compression level must be from 0 to 9'):
+        encoders.encoder_options('png', compression_level=level)
+
+
+def test_register_encoder_checks_presets():
+    with pytest.raises(ValueError, match="Unknown preset 'tiny'"):
+        encoders.register_encoder(
+            'test',
+            lambda image: b'',
+            'image/x-test',
+            presets={'tiny': {}}
+        )
+
+    assert 'test' not in encoders.ENCODERS
+
+
+def test_encode_svg_passes_through():
+    assert encoders.encode(b'<svg/>', 'svg') == (b'<svg/>', 'image/svg+xml')
+
+
+@pytest.mark.parametrize('spec, mime_type, mode', [
+    ('png', 'image/png', 'RGBA'),
+    ('png:fast', 'image/png', 'RGBA'),
+    ('png8', 'image/png', 'P'),
+    ('jpg:small', 'image/jpeg', 'RGB'),
+])
+def test_encode_image(spec, mime_type, mode):
+    Image = pytest.importorskip('PIL.Image')
+
+    image = Image.new('RGBA', (16, 8), (200, 100, 50, 255))
+
+    data, encoded_mime_type = encoders.encode_image(image, spec)
+    decoded = Image.open(BytesIO(data))
+
+    assert encoded_mime_type == mime_type
+    assert decoded.size == (16, 8)
+    assert decoded.mode == mode
+
+
+def test_encode_image_rejects_svg():
+    Image = pytest.importorskip('PIL.Image')
+
+    with pytest.raises(ValueError, match="'svg' is not a raster format"):
+        encoders.encode_image(Image.new('RGB', (1, 1)), 'svg')
+
+
+def test_quality_range():
+    assert encoders.quality_range('jpg:small') == (1, 100)
+    assert encoders.quality_range('webp') == (0, 100)
+    assert encoders.quality_range('png') is None
+
+
+@pytest.mark.parametrize('spec, quality', [
+    ('jpg', 0),
+    ('jpg', 101),
+    ('webp', -1),
+    ('webp:small', 150),
+])
+def test_quality_out_of_range(spec, quality):
+    with pytest.raises(ValueError, match='Quality for .* must be from'):
+        encoders.check_quality(spec, quality)
+
+    with pytest.raises(ValueError, match='Quality for .* must be from'):
+        encoders.encoder_options(spec.partition(':')[0], quality=quality)
+
+
+def test_quality_in_range():
+    encoders.check_quality('jpg', 1)
+    encoders.check_quality('webp', 0)
+    encoders.check_quality('jpg', None)
+    # Formats without a quality setting ignore it
+    encoders.check_quality('png', 500)
+
+
+def test_register_encoder_checks_preset_quality():
+    with pytest.raises(ValueError, match='must be from 1 to 10'):
+        encoders.register_encoder(
+            'test',
+            lambda image: b'',
+            'image/x-test',
+            presets={'small': {'quality': 20}},
+            quality_range=(1, 10)
+        )
+
+    assert 'test' not in encoders.ENCODERS
+
+
+@pytest.mark.parametrize('arguments, message', [
+    (['-f', 'jpg', '--quality', '101'], 'must be from 1 to 100 for jpg'),
+    (['-f', 'png', '-f', 'webp', '--quality', '-5'], 'from 0 to 100 for webp'),
+])
+def test_command_line_quality(monkeypatch, capsys, arguments, message):
+    from dumat import excavate
+
+    inputs = ['ground.png', 'wall.png', 'floor.png']
+    outputs = ['map{}'.format(number) for number in range(arguments.count('-f'))]
+    monkeypatch.setattr('sys.argv', ['excavate'] + arguments + inputs + outputs)
+
+    with pytest.raises(SystemExit) as exit_info:
+        excavate.main()
+
+    assert exit_info.value.code == 2
+    assert message in capsys.readouterr().err
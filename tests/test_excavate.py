@@ -0,0 +1,68 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for writing deferred paths into the map in dumat.excavate. """
+import pytest
+
+from dumat import cubicsuperpath, excavate
+
+pytest.importorskip('bs4')
+
+FLOOR = 'M 10,10 L 90,10 C 95,30 95,50 90,70 L 10,70 Z M 120,20 L 180,20 L 180,60 Z'
+
+OUTLINE = 'M 12,9 L 88,11 L 91,69 L 9,71 Z'
+
+
+def _document(deferred_paths):
+    map_doc = excavate.load_template()
+
+    excavate.defer_path(
+        map_doc.find(id='clip-path-floor-path'),
+        iter(cubicsuperpath.parsePath(FLOOR)),
+        deferred_paths,
+        terminate=True
+    )
+    excavate.defer_path(
+        map_doc.find(id='path-wall-outline'),
+        iter(cubicsuperpath.parsePath(OUTLINE)),
+        deferred_paths
+    )
+
+    return map_doc
+
+
+def test_deferred_paths_match_formatted_paths():
+    deferred_paths = {}
+    map_doc = _document(deferred_paths)
+
+    assert len(deferred_paths) == 2
+    assert map_doc.find(id='clip-path-floor-path')['d'] == excavate.DEFERRED_PATH.format(0)
+
+    streamed = excavate.serialize_document(map_doc, deferred_paths)
+    direct = excavate.serialize_document(_document(None))
+
+    assert streamed == direct
+    assert b'dumat-deferred-path' not in streamed
+    assert cubicsuperpath.formatPath(
+        cubicsuperpath.parsePath(FLOOR), terminate=True
+    ).encode('ascii') in streamed
+
+
+def test_counted():
+    report = {}
+    subpaths = list(excavate._counted(cubicsuperpath.parsePath(FLOOR), report, 'nodes'))
+
+    assert len(subpaths) == 2
+    assert report['nodes'] == 5 + 4
@@ -0,0 +1,161 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for dumat.floorplan. """
+import pytest
+
+from dumat import cubicsuperpath
+from dumat.floorplan import (
+    DENSIFIED_CACHE_SIZE,
+    OUTLINE_CACHE_VARIANTS,
+    PREPARED_MAGIC,
+    PreparedFloorplan,
+    is_prepared,
+    outline_spacing,
+)
+
+FLOOR = (
+    'M 10,10 L 90,10 C 95,30 95,50 90,70 L 10,70 Z '
+    'M 120,20 L 180,20 L 180,60 L 120,60 Z'
+)
+
+INVERTED = 'M 0,0 L 200,0 L 200,100 L 0,100 Z'
+
+
+def _prepared():
+    prepared = PreparedFloorplan(
+        200,
+        100,
+        cubicsuperpath.parsePath(FLOOR),
+        cubicsuperpath.parsePath(INVERTED)
+    )
+    prepared.workers = 1
+    return prepared
+
+
+def test_round_trip():
+    prepared = _prepared()
+    data = prepared.to_bytes()
+
+    assert is_prepared(data)
+
+    loaded = PreparedFloorplan.from_bytes(data)
+
+    assert (loaded.width, loaded.height) == (200, 100)
+    assert loaded.floor == prepared.floor
+    assert loaded.inverted == prepared.inverted
+    assert loaded.floor_path() == prepared.floor_path()
+
+
+def test_round_trip_file(tmp_path):
+    path = str(tmp_path / 'floorplan.dpf')
+
+    _prepared().save(path)
+
+    assert PreparedFloorplan.load(path).floor == _prepared().floor
+
+
+def test_not_prepared():
+    assert not is_prepared(b'<svg/>')
+
+    with pytest.raises(ValueError, match='Not a prepared floorplan'):
+        PreparedFloorplan.from_bytes(b'<svg/>')
+
+
+def test_unsupported_version():
+    data = PREPARED_MAGIC[:-1] + b'\x09' + _prepared().to_bytes()[len(PREPARED_MAGIC):]
+
+    assert is_prepared(data)
+
+    with pytest.raises(ValueError, match='Unsupported prepared floorplan version 9'):
+        PreparedFloorplan.from_bytes(data)
+
+
+def test_seeded_outline_is_repeatable():
+    first = _prepared().outline(20, 3, seed=7)
+    second = _prepared().outline(20, 3, seed=7)
+    other = _prepared().outline(20, 3, seed=8)
+
+    assert first == second
+    assert first != other
+    assert len(first) == 2
+
+
+def test_iter_outline_matches_outline():
+    prepared = _prepared()
+
+    assert list(prepared.iter_outline(20, 3, seed=7)) == prepared.outline(20, 3, seed=7)
+    assert prepared.outline_path(20, 3, seed=7) == cubicsuperpath.formatPath(
+        prepared.outline(20, 3, seed=7)
+    )
+
+
+def test_outline_subset():
+    prepared = _prepared()
+
+    assert prepared.outline(20, 3, subpaths=[1], seed=7) == [
+        prepared.outline(20, 3, seed=7)[1]
+    ]
+
+
+def test_unseeded_outline_is_jittered_within_radius():
+    prepared = _prepared()
+    densified = prepared.densified_outline(20, 3)
+    outline = prepared.outline(20, 3)
+
+    assert len(outline) == len(densified)
+
+    for subpath, original in zip(outline, densified):
+        assert len(subpath) == len(original)
+        for node, original_node in zip(subpath, original):
+            # The end point moves by up to the radius, and each control point
+            # by up to the radius again on top of that
+            for point, original_point, radius in zip(node, original_node, (6, 3, 6)):
+                assert abs(point[0] - original_point[0]) <= radius
+                assert abs(point[1] - original_point[1]) <= radius
+
+
+def test_caches_are_bounded():
+    prepared = _prepared()
+
+    for tile_size in range(10, 10 + 3 * DENSIFIED_CACHE_SIZE):
+        prepared.densified_outline(tile_size, 3)
+        prepared.outline(tile_size, 3, seed=1)
+
+    assert len(prepared._densified) == DENSIFIED_CACHE_SIZE
+    assert len(prepared.outline_cache) == OUTLINE_CACHE_VARIANTS * len(prepared.floor)
+
+
+def test_outline_spacing():
+    assert outline_spacing(20, 0) is None
+    assert outline_spacing(20, 2) == pytest.approx(10)
+    # Drawn larger, the jitter has the same shape, so the spacing is the same
+    assert outline_spacing(20, 2, scale=2) == pytest.approx(10)
+    assert outline_spacing(20, 2, detail=0.5) == pytest.approx(20)
+
+
+def test_outline_spacing_grows_as_the_scale_shrinks():
+    spacings = [outline_spacing(20, 2, scale) for scale in (1, 0.5, 0.25, 0.1)]
+
+    # The segments stay the same length in output px
+    assert spacings == pytest.approx([10, 20, 40, 100])
+
+
+def test_outline_spacing_for_invisible_jitter():
+    # Jitter of a quarter px is stretched as if it were half a px...
+    assert outline_spacing(20, 0.25) == pytest.approx(20)
+    # ...which is more than the scale alone would stretch it
+    assert outline_spacing(20, 0.25, scale=0.5) == pytest.approx(40)
+    assert outline_spacing(20, 0.25, scale=0.5) > outline_spacing(20, 2, 0.5)
@@ -0,0 +1,153 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for encoding one render in several formats with dumat.excavate. """
+from io import BytesIO
+
+import pytest
+
+from dumat import encoders, excavate
+from dumat.floorplan import PreparedFloorplan
+from dumat.memory import MemoryTracker
+
+Image = pytest.importorskip('PIL.Image')
+pytest.importorskip('bs4')
+
+FLOORPLAN = (
+    b'<svg xmlns="http://www.w3.org/2000/svg" width="200" height="150">'
+    b'<path d="M 20,20 L 120,20 L 120,100 L 20,100 Z"/></svg>'
+)
+
+
+@pytest.fixture
+def rasterized(monkeypatch):
+    """
+    Replaces rasterising (which needs ImageMagick) with a plain image, and
+    returns a list that each rasterised document is added to.
+    """
+    documents = []
+
+    def fake_rasterize(room_data):
+        documents.append(room_data)
+        return Image.new('RGBA', (200, 150), (90, 60, 30, 255))
+
+    monkeypatch.setattr(encoders, 'rasterize', fake_rasterize)
+    return documents
+
+
+def _png(colour):
+    output = BytesIO()
+    Image.new('RGB', (32, 32), colour).save(output, 'PNG')
+    return output.getvalue()
+
+
+def _encode(format):
+    prepared = PreparedFloorplan.from_path(
+        'M 20,20 L 120,20 L 120,100 L 20,100 Z',
+        200,
+        150
+    )
+    map_doc = excavate.build_room_document(
+        prepared,
+        _png((10, 20, 30)),
+        _png((40, 50, 60)),
+        10,
+        seed=1
+    )
+    tracker = MemoryTracker(enabled=False)
+
+    with tracker:
+        return excavate.encode_document(map_doc, format, tracker)
+
+
+def test_one_raster_for_every_format(rasterized):
+    rendered = _encode(['svg', 'png', 'jpg:small', 'png8'])
+
+    assert len(rasterized) == 1
+    assert [mime_type for _, mime_type in rendered] == [
+        'image/svg+xml',
+        'image/png',
+        'image/jpeg',
+        'image/png',
+    ]
+
+    # The SVG is the document that was rasterised
+    assert rendered[0][0] == rasterized[0]
+
+    for data, _ in rendered[1:]:
+        assert Image.open(BytesIO(data)).size == (200, 150)
+
+
+def test_vector_formats_are_not_rasterised(rasterized):
+    data, mime_type = _encode('svg')
+
+    assert mime_type == 'image/svg+xml'
+    assert rasterized == []
+
+
+def test_single_format_is_not_a_list(rasterized):
+    assert isinstance(_encode('png'), tuple)
+    assert isinstance(_encode(['png']), list)
+
+
+def test_render_from_paths_writes_each_format(tmp_path, rasterized):
+    ground, wall, floorplan = (
+        tmp_path / name for name in ('ground.png', 'wall.png', 'floor.svg')
+    )
+    ground.write_bytes(_png((10, 20, 30)))
+    wall.write_bytes(_png((40, 50, 60)))
+    floorplan.write_bytes(FLOORPLAN)
+
+    outputs = [str(tmp_path / name) for name in ('map.svg', 'map.png')]
+
+    excavate.render_room_from_paths(
+        str(ground),
+        str(wall),
+        str(floorplan),
+        outputs,
+        10,
+        ['svg', 'png'],
+        seed=1
+    )
+
+    with open(outputs[0], 'rb') as svg_file:
+        assert svg_file.read() == rasterized[0]
+
+    assert Image.open(outputs[1]).format == 'PNG'
+
+    with pytest.raises(ValueError, match='one output path for each format'):
+        excavate.render_room_from_paths(
+            str(ground),
+            str(wall),
+            str(floorplan),
+            outputs[:1],
+            10,
+            ['svg', 'png']
+        )
+
+
+@pytest.mark.parametrize('arguments, message', [
+    (['-f', 'svg', '-f', 'png', 'map.svg'], 'one --format for each output'),
+    (['-f', 'png', '-f', 'jpg', '--tiles', 'a', 'b'], 'only make one output'),
+])
+def test_command_line_formats(monkeypatch, capsys, arguments, message):
+    inputs = ['ground.png', 'wall.png', 'floor.png']
+    monkeypatch.setattr('sys.argv', ['excavate'] + inputs + arguments)
+
+    with pytest.raises(SystemExit) as exit_info:
+        excavate.main()
+
+    assert exit_info.value.code == 2
+    assert message in capsys.readouterr().err
@@ -0,0 +1,85 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests that the heavy dependencies are only imported when needed. """
+import os
+import subprocess
+import sys
+
+import pytest
+
+# The top of the source tree, so the subprocess imports this copy of dumat
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = (
+    'numpy', 'wand', 'PIL', 'cssutils', 'pkg_resources', 'bs4', 'lxml'
+)
+
+
+def _loaded_modules(code):
+    """
+    Runs the code in a fresh interpreter and returns the heavy modules it
+    loaded.
+    """
+    script = code + (
+        '\nimport sys\n'
+        'loaded = [m for m in {!r} if m in sys.modules]\n'
+        'print("LOADED:" + ",".join(loaded))\n'
+    ).format(HEAVY_MODULES)
+
+    output = subprocess.check_output(
+        [sys.executable, '-c', script],
+        cwd=SOURCE_DIR,
+        universal_newlines=True
+    )
+    # The list comes after anything the code printed
+    loaded = output.rpartition('LOADED:')[2].strip()
+    return [name for name in loaded.split(',') if name]
+
+
+@pytest.mark.parametrize('module', [
+    'dumat.excavate',
+    'dumat.floorplan',
+    'dumat.encoders',
+    'dumat.textures',
+    'dumat.memory',
+])
+def test_import_is_light(module):
+    assert _loaded_modules('import ' + module) == []
+
+
+def test_help_is_light():
+    code = (
+        'import sys\n'
+        'sys.argv = ["excavate", "--help"]\n'
+        'from dumat.excavate import main\n'
+        'try:\n'
+        '    main()\n'
+        'except SystemExit:\n'
+        '    pass\n'
+    )
+
+    assert _loaded_modules(code) == []
+
+
+def test_template_without_pkg_resources():
+    pytest.importorskip('bs4')
+
+    code = (
+        'from dumat.excavate import load_template\n'
+        'assert load_template().find(id="clip-path-floor-path") is not None\n'
+    )
+
+    assert 'pkg_resources' not in _loaded_modules(code)
@@ -0,0 +1,204 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for the change tracking and re-rendering in dumat.incremental. """
+import pytest
+
+from dumat import cubicsuperpath, incremental
+from dumat.floorplan import PreparedFloorplan
+
+ROOM = 'M 10,10 L 50,10 L 50,50 L 10,50 Z'
+CORRIDOR = 'M 100,20 L 180,20 L 180,30 L 100,30 Z'
+MOVED_CORRIDOR = 'M 100,60 L 180,60 L 180,70 L 100,70 Z'
+
+INVERTED = 'M 0,0 L 200,0 L 200,100 L 0,100 Z'
+
+
+def _prepared(d):
+    return PreparedFloorplan(
+        200,
+        100,
+        cubicsuperpath.parsePath(d),
+        cubicsuperpath.parsePath(INVERTED)
+    )
+
+
+def test_changed_bboxes_unchanged():
+    bboxes = incremental.subpath_bboxes(_prepared(ROOM + CORRIDOR))
+
+    assert incremental.changed_bboxes(bboxes, bboxes) == ([], 2)
+
+
+def test_changed_bboxes_moved_subpath():
+    old = incremental.subpath_bboxes(_prepared(ROOM + CORRIDOR))
+    new = incremental.subpath_bboxes(_prepared(ROOM + MOVED_CORRIDOR))
+
+    changed, reused = incremental.changed_bboxes(old, new)
+
+    # Both where the corridor was and where it is now need redrawing
+    assert sorted(changed) == [(100, 20, 180, 30), (100, 60, 180, 70)]
+    assert reused == 1
+
+
+def test_changed_bboxes_duplicate_subpaths():
+    old = incremental.subpath_bboxes(_prepared(ROOM))
+    new = incremental.subpath_bboxes(_prepared(ROOM + ROOM))
+
+    changed, reused = incremental.changed_bboxes(old, new)
+
+    assert changed == [(10, 10, 50, 50)] * 3
+    assert reused == 0
+
+
+def test_dirty_rects_pad_clip_and_merge():
+    rects = incremental.dirty_rects(
+        [(10.5, 10.5, 20.2, 20.2), (25, 10, 30, 12), (150, 80, 190, 99)],
+        5,
+        200,
+        100
+    )
+
+    assert sorted(rects) == [(5, 5, 30, 21), (145, 75, 50, 25)]
+
+
+def test_dirty_rects_outside_map():
+    assert incremental.dirty_rects([(300, 300, 310, 310)], 5, 200, 100) == []
+
+
+def test_render_state_round_trip():
+    state = incremental.RenderState(
+        'key',
+        200,
+        100,
+        {'hash': [(0, 0, 1, 1)]},
+        {('hash', 10.0, 3, 0): [[[0, 0], [0, 0], [0, 0]]]},
+        b'png'
+    )
+
+    loaded = incremental.RenderState.from_bytes(state.to_bytes())
+
+    assert loaded.__dict__ == state.__dict__
+
+    with pytest.raises(ValueError, match='Not a render state'):
+        incremental.RenderState.from_bytes(b'DUMATPF\x02')
+
+
+def test_render_key():
+    prepared = _prepared(ROOM)
+    key = incremental.render_key(prepared, b'ground', b'wall', 20, 0, 'filter')
+
+    assert key == incremental.render_key(_prepared(CORRIDOR), b'ground', b'wall', 20, 0, 'filter')
+    assert key != incremental.render_key(prepared, b'ground', b'wall', 20, 1, 'filter')
+    assert key != incremental.render_key(prepared, b'ground2', b'wall', 20, 0, 'filter')
+
+
+# Colours the stand-in rasteriser draws with
+FLOOR_COLOUR = (255, 0, 0, 255)
+WALL_COLOUR = (0, 0, 255, 255)
+
+
+def _fake_rasterize(room_data):
+    # Stands in for ImageMagick: the right size, in one colour for documents
+    # with some floor and another for documents with none
+    from bs4 import BeautifulSoup
+    from PIL import Image
+
+    doc = BeautifulSoup(room_data, 'xml')
+    svg = doc.find('svg')
+    size = (int(float(svg['width'])), int(float(svg['height'])))
+
+    if doc.find(id='clip-path-floor-path')['d']:
+        return Image.new('RGBA', size, FLOOR_COLOUR)
+    return Image.new('RGBA', size, WALL_COLOUR)
+
+
+def _render(monkeypatch, d, previous=None):
+    pytest.importorskip('bs4')
+    pytest.importorskip('PIL')
+    from dumat import encoders
+
+    monkeypatch.setattr(encoders, 'rasterize', _fake_rasterize)
+
+    prepared = PreparedFloorplan.from_path(d, 400, 200)
+    prepared.workers = 1
+    report = {}
+
+    data, _, state = incremental.render_incremental(
+        prepared,
+        _texture(),
+        _texture(),
+        10,
+        previous=previous,
+        report=report
+    )
+
+    return data, state, report
+
+
+def _texture():
+    from io import BytesIO
+    from PIL import Image
+
+    output = BytesIO()
+    Image.new('RGB', (16, 16), (0, 255, 0)).save(output, 'PNG')
+    return output.getvalue()
+
+
+def _pixel(data, point):
+    from io import BytesIO
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as image:
+        return image.convert('RGBA').getpixel(point)
+
+
+def test_render_after_deleting_a_room(monkeypatch):
+    _, state, _ = _render(monkeypatch, ROOM + CORRIDOR)
+
+    # The rectangle where the corridor was now holds nothing but wall
+    data, _, report = _render(monkeypatch, ROOM, state)
+
+    assert report['full_render'] is False
+    assert report['dirty_rects'] == 1
+    assert report['reused_subpaths'] == 1
+    assert _pixel(data, (140, 25)) == WALL_COLOUR
+    # Away from it, the previous render is kept
+    assert _pixel(data, (30, 30)) == FLOOR_COLOUR
+    assert _pixel(data, (300, 150)) == FLOOR_COLOUR
+
+
+def test_render_after_shrinking_a_room(monkeypatch):
+    _, state, _ = _render(monkeypatch, ROOM + CORRIDOR)
+
+    data, new_state, report = _render(
+        monkeypatch,
+        ROOM + 'M 100,20 L 140,20 L 140,30 L 100,30 Z',
+        state
+    )
+
+    assert report['full_render'] is False
+    # Where it was and where it is now overlap, so they are drawn together
+    assert report['dirty_rects'] == 1
+    assert report['changed_subpaths'] == 2
+    assert _pixel(data, (120, 25)) == FLOOR_COLOUR
+    assert (new_state.width, new_state.height) == (400, 200)
+
+    # Nothing changed since, so nothing is drawn again
+    _, _, report = _render(
+        monkeypatch,
+        ROOM + 'M 100,20 L 140,20 L 140,30 L 100,30 Z',
+        new_state
+    )
+    assert report['dirty_rects'] == 0
@@ -0,0 +1,82 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for dumat.ingest. """
+import pytest
+
+from dumat import cubicsuperpath
+from dumat.ingest import read_svg_floorplan
+
+pytest.importorskip('lxml')
+
+FLOORPLAN = b"""\
+<?xml version="1.0" encoding="UTF-8"?>
+<!-- Saved by an editor -->
+<svg xmlns="http://www.w3.org/2000/svg" width="200" height="100.5">
+  <metadata><path d="M 0,0 L 1,1"/></metadata>
+  <defs>
+    <clipPath id="clip"><path d="M 0,0 L 200,0 L 200,100 Z"/></clipPath>
+  </defs>
+  <path d="M 10,10 L 20,10 L 20,20 Z"/>
+  <g transform="translate(100,0)">
+    <g transform="scale(2)">
+      <path d="M 5,5 L 10,5 L 10,10 Z"/>
+    </g>
+    <path d=""/>
+  </g>
+</svg>
+<svg>trailing rubbish is never read</svg>
+"""
+
+
+def _points(subpath):
+    return [node[1] for node in subpath]
+
+
+def test_read_svg_floorplan():
+    width, height, subpaths = read_svg_floorplan(FLOORPLAN)
+
+    assert (width, height) == (200, 100.5)
+    assert len(subpaths) == 2
+    assert _points(subpaths[0]) == [[10, 10], [20, 10], [20, 20], [10, 10]]
+    # Both transforms are applied, innermost first
+    assert _points(subpaths[1]) == [[110, 10], [120, 10], [120, 20], [110, 10]]
+
+
+def test_read_from_memoryview():
+    _, _, subpaths = read_svg_floorplan(memoryview(FLOORPLAN))
+
+    assert len(subpaths) == 2
+
+
+def test_matches_parsed_path():
+    svg = (
+        b'<svg xmlns="http://www.w3.org/2000/svg" width="50" height="50">'
+        b'<path d="M 1,2 C 3,4 5,6 7,8 Q 9,10 11,12 Z"/></svg>'
+    )
+
+    _, _, subpaths = read_svg_floorplan(svg)
+
+    assert subpaths == cubicsuperpath.parsePath('M 1,2 C 3,4 5,6 7,8 Q 9,10 11,12 Z')
+
+
+@pytest.mark.parametrize('data, message', [
+    (b'<html><body/></html>', 'not an SVG file'),
+    (b'<svg xmlns="http://www.w3.org/2000/svg" width="5"/>', 'no width or height'),
+    (b'', 'Cannot'),
+])
+def test_errors(data, message):
+    with pytest.raises(ValueError, match=message):
+        read_svg_floorplan(data)
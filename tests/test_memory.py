@@ -0,0 +1,142 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for dumat.memory. """
+import pytest
+
+from dumat.memory import (
+    MIB,
+    MemoryBudgetExceeded,
+    MemoryTracker,
+    current_rss,
+    format_memory_stages,
+    imagemagick_limit,
+)
+
+
+def test_disabled_tracker_records_nothing():
+    tracker = MemoryTracker(enabled=False)
+
+    with tracker:
+        with tracker.stage('trace'):
+            pass
+
+    assert tracker.stages == []
+
+
+def test_stages_are_recorded():
+    tracker = MemoryTracker()
+
+    with tracker:
+        with tracker.stage('trace'):
+            data = bytearray(4 * MIB)
+        with tracker.stage('geometry'):
+            pass
+
+    del data
+
+    assert [entry['stage'] for entry in tracker.stages] == ['trace', 'geometry']
+    assert tracker.stages[0]['traced_peak'] >= 4 * MIB
+
+
+@pytest.mark.skipif(current_rss() is None, reason='RSS not available')
+def test_peak_rss_is_seen_during_the_stage():
+    tracker = MemoryTracker()
+    before = current_rss()
+
+    with tracker:
+        with tracker.stage('spike'):
+            # Touch every page so that it is resident, then free it before
+            # the stage ends
+            data = bytearray(64 * MIB)
+            data[::4096] = b'\1' * len(data[::4096])
+            del data
+
+    assert tracker.stages[0]['rss'] - before >= 48 * MIB
+
+
+def _grow(chunks, count, tracker=None):
+    for _ in range(count):
+        chunk = bytearray(4 * MIB)
+        chunk[::4096] = b'\1' * len(chunk[::4096])
+        chunks.append(chunk)
+        if tracker is not None:
+            tracker.check('grow')
+
+
+def test_budget_is_checked_after_the_stage():
+    chunks = []
+
+    # The budget is on top of what the process already uses
+    with pytest.raises(MemoryBudgetExceeded, match="stage 'grow'"):
+        with MemoryTracker(budget=64 * MIB) as tracker:
+            with tracker.stage('grow'):
+                _grow(chunks, 32)
+
+    assert len(chunks) == 32
+
+
+def test_budget_stops_the_stage_early():
+    chunks = []
+
+    with pytest.raises(MemoryBudgetExceeded):
+        with MemoryTracker(budget=64 * MIB) as tracker:
+            with tracker.stage('grow'):
+                _grow(chunks, 200, tracker)
+
+    # Stopped long before the loop could finish (800 MiB)
+    assert len(chunks) < 20
+
+
+def test_budget_is_checked_before_the_next_stage():
+    stages = []
+
+    with pytest.raises(MemoryBudgetExceeded, match="stage 'encode'"):
+        with MemoryTracker(budget=16 * MIB) as tracker:
+            # Kept after the stage ends, as a render keeps its geometry
+            data = bytearray(32 * MIB)
+            stages.append('geometry')
+            with tracker.stage('encode'):
+                stages.append('encode')
+
+    del data
+    assert stages == ['geometry']
+
+
+def test_headroom():
+    assert MemoryTracker().headroom() is None
+
+    if current_rss() is not None:
+        with MemoryTracker(budget=100 * MIB) as tracker:
+            assert 50 * MIB < tracker.headroom() <= 100 * MIB
+
+        with MemoryTracker(budget=1) as tracker:
+            data = bytearray(8 * MIB)
+            data[::4096] = b'\1' * len(data[::4096])
+            assert tracker.headroom() == 0
+
+
+def test_imagemagick_limit_without_a_budget():
+    # Nothing to limit, so Wand isn't needed
+    with imagemagick_limit(None):
+        pass
+
+
+def test_format_memory_stages():
+    lines = format_memory_stages([
+        {'stage': 'trace', 'traced_peak': 2 * MIB, 'rss': None},
+    ])
+
+    assert lines == ['memory: trace        peak      2.0 MiB  peak rss unknown']
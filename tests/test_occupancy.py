@@ -0,0 +1,118 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for dumat.occupancy. """
+from io import BytesIO
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from dumat import cubicsuperpath, occupancy
+from dumat.floorplan import PreparedFloorplan
+from dumat.occupancy import (
+    OCCUPANCY_PARTIAL as PARTIAL,
+    OCCUPANCY_WALKABLE as WALKABLE,
+    OCCUPANCY_WALL as WALL,
+)
+
+
+def _prepared():
+    # A room from (20, 20) to (60, 50) on a map of 100 x 70, with a grid of
+    # 20 px: two squares across are floor, the bottom row is half floor
+    return PreparedFloorplan(
+        100,
+        70,
+        cubicsuperpath.parsePath('M 20,20 L 60,20 L 60,50 L 20,50 Z'),
+        []
+    )
+
+
+def test_grid_size():
+    assert occupancy.grid_size(100, 70, 20) == (5, 4)
+    assert occupancy.grid_size(100, 80, 20) == (5, 4)
+    assert occupancy.grid_size(1, 1, 20) == (1, 1)
+
+
+def test_occupancy_grid():
+    grid = occupancy.occupancy_grid(_prepared(), 20)
+
+    assert grid.tolist() == [
+        [WALL, WALL, WALL, WALL, WALL],
+        [WALL, WALKABLE, WALKABLE, WALL, WALL],
+        [WALL, PARTIAL, PARTIAL, WALL, WALL],
+        [WALL, WALL, WALL, WALL, WALL],
+    ]
+
+
+def test_occupancy_grid_checks_tile_size():
+    with pytest.raises(ValueError, match='greater than zero'):
+        occupancy.occupancy_grid(_prepared(), 0)
+
+
+@pytest.mark.parametrize('shape', [(1, 1), (3, 4), (5, 7), (2, 8)])
+def test_pack_round_trip(shape):
+    rng = np.random.default_rng(sum(shape))
+    grid = rng.integers(0, 3, shape).astype(np.uint8)
+
+    data = occupancy.pack_occupancy(grid, 12.5)
+    unpacked, tile_size = occupancy.unpack_occupancy(data)
+
+    assert tile_size == 12.5
+    assert unpacked.tolist() == grid.tolist()
+    # Two bits per square after the header
+    header = len(occupancy.OCCUPANCY_MAGIC) + 16
+    assert len(data) == header + (grid.size + 3) // 4
+
+
+def test_pack_bit_order():
+    grid = np.array([[WALKABLE, PARTIAL, WALL, WALKABLE, PARTIAL]], dtype=np.uint8)
+
+    data = occupancy.pack_occupancy(grid, 20)
+
+    # The first square in the high bits, padded with wall
+    assert data[-2:] == bytes((0b10010010, 0b01000000))
+
+
+def test_not_an_occupancy_grid():
+    with pytest.raises(ValueError, match='Not an occupancy grid'):
+        occupancy.unpack_occupancy(b'DUMATWL\x01')
+
+
+def test_save_png(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    path = str(tmp_path / 'grid.png')
+
+    occupancy.save_occupancy(_prepared(), 20, path)
+
+    with open(path, 'rb') as source:
+        image = Image.open(BytesIO(source.read()))
+
+    assert image.size == (5, 4)
+    assert image.getpixel((1, 1)) == 255
+    assert image.getpixel((1, 2)) == 128
+    assert image.getpixel((0, 0)) == 0
+
+
+def test_save_packed(tmp_path):
+    path = str(tmp_path / 'grid.bin')
+
+    occupancy.save_occupancy(_prepared(), 20, path)
+
+    with open(path, 'rb') as source:
+        grid, tile_size = occupancy.unpack_occupancy(source.read())
+
+    assert tile_size == 20
+    assert grid.tolist() == occupancy.occupancy_grid(_prepared(), 20).tolist()
@@ -0,0 +1,116 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for dumat.parallel. """
+import pytest
+
+from dumat import cubicsuperpath, parallel, svgtools
+from dumat.floorplan import PreparedFloorplan, csp_coords, csp_from_coords
+
+
+def _rooms(count):
+    """ A row of small square rooms, some with a rounded corner. """
+    return cubicsuperpath.parsePath(' '.join(
+        'M {0},0 L {1},0 C {2},0 {2},5 {2},10 L {0},10 Z'.format(
+            20 * number, 20 * number + 5 + number % 3, 20 * number + 10
+        )
+        for number in range(count)
+    ))
+
+
+def test_chunk_subpaths():
+    p = _rooms(10)
+
+    ranges = parallel.chunk_subpaths(p, 3)
+
+    # Consecutive, covering every subpath, and no more than asked for
+    assert ranges[0][0] == 0 and ranges[-1][1] == 10
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    assert len(ranges) <= 3
+
+    assert parallel.chunk_subpaths(p, 100) == [(n, n + 1) for n in range(10)]
+
+
+def test_should_parallelise():
+    small = _rooms(2)
+
+    assert not parallel.should_parallelise(small, 4)
+    assert not parallel.should_parallelise(_rooms(5000), 1)
+    assert parallel.should_parallelise(_rooms(5000), 4)
+
+
+def test_csp_coords_round_trip():
+    p = _rooms(4)
+
+    assert csp_from_coords(*csp_coords(p)) == p
+
+
+def test_parallel_outline_matches_serial():
+    p = _rooms(12)
+    seeds = ['seed:{}'.format(number) for number in range(len(p))]
+    original = svgtools.copy_csp(p)
+
+    outline = parallel.parallel_outline(p, 4.0, 1.0, 2.0, seeds, workers=2)
+
+    serial = [
+        parallel.outline_subpath(subpath, 4.0, 1.0, 2.0, seed)
+        for subpath, seed in zip(svgtools.copy_csp(p), seeds)
+    ]
+
+    assert outline == serial
+    assert p == original
+
+
+def test_seeded_floorplan_outline_matches_serial(monkeypatch):
+    def prepared(workers):
+        floorplan = PreparedFloorplan(300, 20, _rooms(12), [])
+        floorplan.workers = workers
+        return floorplan
+
+    serial = prepared(1).outline(10, 2, seed=3)
+
+    monkeypatch.setattr(parallel, 'PARALLEL_MIN_NODES', 1)
+
+    assert prepared(2).outline(10, 2, seed=3) == serial
+
+
+def test_floorplans_dont_start_processes_by_default(monkeypatch):
+    def fail(*args, **kwargs):
+        pytest.fail('Started worker processes without being asked to')
+
+    monkeypatch.setattr(parallel, 'PARALLEL_MIN_NODES', 1)
+    monkeypatch.setattr(parallel, 'parallel_outline', fail)
+
+    floorplan = PreparedFloorplan(300, 20, _rooms(12), [])
+
+    assert floorplan.workers == 1
+    assert len(floorplan.outline(10, 2, seed=3)) == 12
+
+
+def test_workers_are_spawned(monkeypatch):
+    contexts = []
+    get_context = parallel.multiprocessing.get_context
+
+    def record(method=None):
+        contexts.append(method)
+        return get_context(method)
+
+    monkeypatch.setattr(parallel.multiprocessing, 'get_context', record)
+
+    seeds = list(range(4))
+
+    parallel.parallel_outline(_rooms(4), 4.0, 1.0, 2.0, seeds, workers=2)
+
+    assert contexts == ['spawn']
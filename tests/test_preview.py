@@ -0,0 +1,152 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for scaled renders and previews with dumat.excavate. """
+from base64 import b64decode
+from importlib.util import find_spec
+from io import BytesIO
+
+import pytest
+
+from dumat import excavate, svgtools
+from dumat.floorplan import PreparedFloorplan
+
+bs4 = pytest.importorskip('bs4')
+Image = pytest.importorskip('PIL.Image')
+
+FLOOR = 'M 20,20 L 320,20 C 380,20 380,220 320,220 L 20,220 Z'
+
+WIDTH = 400
+HEIGHT = 300
+
+TILE_SIZE = 50
+
+
+def _prepared():
+    return PreparedFloorplan.from_path(FLOOR, WIDTH, HEIGHT)
+
+
+def _texture(colour, size=(128, 128)):
+    # Noisy, so that downsampling makes the PNG smaller
+    image = Image.effect_noise(size, 64).convert('RGB')
+    image.paste(colour, (0, 0, size[0] // 2, size[1] // 2))
+    output = BytesIO()
+    image.save(output, 'PNG')
+    return output.getvalue()
+
+
+def _document(scale, **kwargs):
+    doc = excavate.build_room_document(
+        _prepared(),
+        _texture((10, 20, 30)),
+        _texture((40, 50, 60)),
+        TILE_SIZE,
+        seed=1,
+        scale=scale,
+        **kwargs
+    )
+    return bs4.BeautifulSoup(doc.prettify(), 'xml')
+
+
+@pytest.mark.parametrize('scale', [0, -0.5, float('nan')])
+def test_check_scale(scale):
+    with pytest.raises(ValueError, match='greater than zero'):
+        excavate.check_scale(scale)
+
+
+def test_scaled_document_keeps_the_view():
+    svg = _document(0.25).find('svg')
+
+    assert (float(svg['width']), float(svg['height'])) == (100, 75)
+    assert svg['viewBox'] == '0 0 {} {}'.format(WIDTH, HEIGHT)
+
+
+def test_scaled_outline_is_coarser():
+    def nodes(scale):
+        return svgtools.node_count(
+            _prepared().outline(TILE_SIZE, 2, seed=1, scale=scale)
+        )
+
+    assert nodes(0.25) < nodes(0.5) < nodes(1)
+
+
+def test_scaled_textures_are_downsampled():
+    data = _texture((10, 20, 30))
+
+    _, full_size, full_bytes, _ = excavate.embed_texture(data, (WIDTH, HEIGHT))
+    _, small_size, small_bytes, _ = excavate.embed_texture(
+        data,
+        (WIDTH, HEIGHT),
+        scale=0.25
+    )
+
+    # Drawn the same size on the map, with fewer pixels
+    assert small_size == full_size
+    assert small_bytes < full_bytes
+
+
+@pytest.mark.skipif(find_spec('numpy') is None, reason='needs NumPy')
+def test_scaled_baked_shading():
+    image = _document(0.25, shading='baked').find(id='image-wall-shading')
+    assert image is not None
+
+    data = image['xlink:href'].partition(',')[2]
+
+    # One pixel for each pixel of the drawn map
+    assert Image.open(BytesIO(b64decode(data))).size == (100, 75)
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """ Records what the command line asks render_room_from_paths() for. """
+    calls = []
+
+    def fake_render(*args, **kwargs):
+        calls.append(kwargs)
+
+    monkeypatch.setattr(excavate, 'render_room_from_paths', fake_render)
+    return calls
+
+
+def _main(monkeypatch, *arguments):
+    inputs = ['ground.png', 'wall.png', 'floor.png', 'map.png']
+    monkeypatch.setattr('sys.argv', ['excavate'] + list(arguments) + inputs)
+    excavate.main()
+
+
+def test_command_line_preview(monkeypatch, rendered):
+    _main(monkeypatch, '--preview')
+
+    assert rendered[0]['scale'] == excavate.PREVIEW_SCALE
+    expected = 'baked' if find_spec('numpy') is not None else 'filter'
+    assert rendered[0]['shading'] == expected
+
+
+def test_command_line_preview_keeps_scale(monkeypatch, rendered):
+    _main(monkeypatch, '--preview', '--scale', '0.5')
+
+    assert rendered[0]['scale'] == 0.5
+
+
+@pytest.mark.parametrize('arguments, message', [
+    (['--scale', '0'], '--scale must be greater than zero'),
+    (['--preview', '--tiles'], "can't be used with --tiles"),
+])
+def test_command_line_scale_errors(monkeypatch, capsys, arguments, message):
+    with pytest.raises(SystemExit) as exit_info:
+        _main(monkeypatch, *arguments)
+
+    assert exit_info.value.code == 2
+    assert message in capsys.readouterr().err
@@ -0,0 +1,225 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for dumat.raster. The baked wall shading is checked against the
+template's filter itself, run primitive by primitive on premultiplied RGBA
+arrays as the SVG specification describes.
+"""
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from dumat import cubicsuperpath, raster
+
+TEMPLATE = os.path.join(os.path.dirname(raster.__file__), 'template.svg')
+
+SVG_NS = '{http://www.w3.org/2000/svg}'
+
+# Rec. 709 luminance, as used by luminanceToAlpha
+LUMINANCE = np.array((0.2125, 0.7154, 0.0721))
+
+
+def _unpremultiply(image):
+    alpha = image[..., 3:]
+    colour = np.divide(
+        image[..., :3],
+        alpha,
+        out=np.zeros_like(image[..., :3]),
+        where=alpha > 0
+    )
+    return np.concatenate((colour, alpha), axis=-1)
+
+
+def _premultiply(image):
+    return np.concatenate((image[..., :3] * image[..., 3:], image[..., 3:]), axis=-1)
+
+
+def _colour_matrix(image, element):
+    straight = _unpremultiply(image)
+
+    if element.get('type') == 'luminanceToAlpha':
+        result = np.zeros_like(straight)
+        result[..., 3] = straight[..., :3] @ LUMINANCE
+    else:
+        matrix = np.array(element.get('values').split(), dtype=float).reshape(4, 5)
+        result = straight @ matrix[:, :4].T + matrix[:, 4]
+
+    return _premultiply(np.clip(result, 0, 1))
+
+
+def _over(top, bottom):
+    return top + bottom * (1 - top[..., 3:])
+
+
+def _composite(a, b, operator):
+    if operator == 'in':
+        return a * b[..., 3:]
+    if operator == 'over':
+        return _over(a, b)
+    if operator == 'xor':
+        return a * (1 - b[..., 3:]) + b * (1 - a[..., 3:])
+    raise NotImplementedError(operator)
+
+
+def run_wall_filter(floor_mask, blur_inside, blur_outside):
+    """
+    Runs the template's wall boundary filter on a black floor with the given
+    coverage. Returns the premultiplied RGBA result.
+    """
+    sigmas = {'wall-blur-inside': blur_inside, 'wall-blur-outside': blur_outside}
+
+    source = np.zeros(floor_mask.shape + (4,))
+    source[..., 3] = floor_mask
+
+    results = {'SourceGraphic': source}
+    previous = source
+
+    root = ET.parse(TEMPLATE).getroot()
+    wall_filter = next(
+        element for element in root.iter(SVG_NS + 'filter')
+        if element.get('id') == 'wall-boundary-filter'
+    )
+
+    for element in wall_filter:
+        name = element.tag[len(SVG_NS):]
+        a = results[element.get('in')] if element.get('in') else previous
+        b = results.get(element.get('in2'))
+
+        if name == 'feColorMatrix':
+            result = _colour_matrix(a, element)
+        elif name == 'feGaussianBlur':
+            sigma = sigmas[element.get('id')]
+            result = np.stack(
+                [raster.gaussian_blur(a[..., c].astype(np.float32), sigma)
+                 for c in range(4)],
+                axis=-1
+            ).astype(float)
+        elif name == 'feOffset':
+            assert float(element.get('dx')) == 0 and float(element.get('dy')) == 0
+            result = a
+        elif name == 'feComposite':
+            result = _composite(a, b, element.get('operator'))
+        elif name == 'feFlood':
+            assert element.get('flood-color') == 'rgb(255,255,255)'
+            result = np.full_like(a, float(element.get('flood-opacity')))
+        elif name == 'feBlend':
+            assert element.get('mode') == 'normal'
+            result = _over(a, b)
+        else:
+            raise NotImplementedError(name)
+
+        if element.get('result'):
+            results[element.get('result')] = result
+        previous = result
+
+    return previous
+
+
+def _room_mask(width=48, height=40):
+    """ The coverage of an antialiased room with a rounded corner. """
+    room = cubicsuperpath.parsePath(
+        'M 8.3,7.6 L 36.2,7.6 C 42,7.6 42,12 42,16 L 42,33.4 L 8.3,33.4 Z'
+    )
+    return raster.coverage_mask(room, width, height)
+
+
+@pytest.mark.parametrize('blur_inside, blur_outside', [(2.0, 1.5), (3.2, 2.5)])
+def test_wall_shading_matches_filter(blur_inside, blur_outside):
+    mask = _room_mask()
+
+    grey, alpha = raster.wall_shading(mask, blur_inside, blur_outside)
+    reference = run_wall_filter(mask.astype(float), blur_inside, blur_outside)
+
+    np.testing.assert_allclose(alpha, reference[..., 3], atol=1e-5)
+    np.testing.assert_allclose(grey * alpha, reference[..., 0], atol=1e-5)
+
+
+def test_inner_shadow_alpha():
+    # Deep inside the floor the filter's shadow is 1 - B^2, not 1 - B
+    mask = np.ones((64, 64), dtype=np.float32)
+    mask[:, :32] = 0
+
+    blurred = raster.gaussian_blur(mask, 3.0)
+    _, alpha = raster.wall_shading(mask, 3.0, 0.0)
+
+    row = 32
+    for column in (33, 35, 38):
+        b = blurred[row, column]
+        assert alpha[row, column] == pytest.approx(1 - b * b, abs=1e-5)
+
+
+@pytest.mark.parametrize('sigma', [1.0, 2.0, 2.5, 3.0])
+def test_gaussian_blur_is_centred(sigma):
+    impulse = np.zeros((1, 41), dtype=np.float32)
+    impulse[0, 20] = 1
+
+    blurred = raster.gaussian_blur(impulse.repeat(41, axis=0), sigma)[20]
+
+    assert blurred.sum() == pytest.approx(1, abs=1e-5)
+    centroid = (blurred * np.arange(41)).sum() / blurred.sum()
+    assert centroid == pytest.approx(20, abs=1e-5)
+
+
+def test_box_sizes_even():
+    # d = floor(2 * 3 * sqrt(2 pi) / 4 + 0.5) = 4
+    assert raster.box_sizes(2.0) == (4, 4, 5)
+    assert raster.box_sizes(1.0) == (2, 2, 3)
+
+
+def test_coverage_mask_square():
+    square = cubicsuperpath.parsePath('M 2,2 L 6,2 L 6,6 L 2,6 Z')
+    mask = raster.coverage_mask(square, 8, 8)
+
+    assert mask[2:6, 2:6].min() == 1
+    assert mask.sum() == pytest.approx(16)
+
+
+def _shading_pixels(region, scale=1.0):
+    from io import BytesIO
+    Image = pytest.importorskip('PIL.Image')
+
+    floor = cubicsuperpath.parsePath('M 10,10 L 30,10 L 30,30 L 10,30 Z')
+    data = raster.wall_shading_png(floor, 40, 40, 2.0, 1.5, region, scale)
+
+    with Image.open(BytesIO(data)) as image:
+        return np.asarray(image.convert('LA'), dtype=float)
+
+
+def test_shading_size():
+    assert raster.shading_size((0, 0, 40, 30)) == (40, 30)
+    # Enough pixels from the corner of the region to cover it
+    assert raster.shading_size((10.5, 10.25, 5.5, 5.25)) == (6, 6)
+    assert raster.shading_size((1, 1, 10, 10), 0.25) == (3, 3)
+
+
+def test_region_shading_matches_the_whole_map():
+    whole = _shading_pixels(None)
+    region = _shading_pixels((8, 12, 6, 5))
+
+    assert region.shape[:2] == (5, 6)
+    np.testing.assert_allclose(region, whole[12:17, 8:14], atol=1)
+
+
+def test_fractional_region_shading_starts_at_the_corner():
+    # At twice the size, half a px of the map is a whole px of the shading
+    whole = _shading_pixels(None, 2.0)
+    region = _shading_pixels((9.5, 15.5, 4, 3.5), 2.0)
+
+    assert region.shape[:2] == (7, 8)
+    np.testing.assert_allclose(region, whole[31:38, 19:27], atol=1)
@@ -0,0 +1,161 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for rendering regions of the map with dumat.excavate. """
+from io import BytesIO
+
+import pytest
+
+from dumat import excavate
+from dumat.floorplan import PreparedFloorplan
+
+bs4 = pytest.importorskip('bs4')
+Image = pytest.importorskip('PIL.Image')
+
+# Two rooms, far enough apart that a region around one doesn't need the other
+FLOOR = (
+    'M 20,20 L 120,20 L 120,100 L 20,100 Z '
+    'M 600,400 L 700,400 L 700,480 L 600,480 Z'
+)
+
+TILE_SIZE = 10
+
+
+def _prepared():
+    prepared = PreparedFloorplan.from_path(FLOOR, 800, 600)
+    prepared.workers = 1
+    return prepared
+
+
+def _texture(colour):
+    output = BytesIO()
+    Image.new('RGB', (32, 32), colour).save(output, 'PNG')
+    return output.getvalue()
+
+
+def _render(region, **kwargs):
+    data, mime_type = excavate.render_region(
+        *region,
+        _prepared(),
+        _texture((10, 20, 30)),
+        _texture((40, 50, 60)),
+        TILE_SIZE,
+        'svg',
+        seed=1,
+        **kwargs
+    )
+
+    assert mime_type == 'image/svg+xml'
+    return bs4.BeautifulSoup(data, 'xml')
+
+
+def test_region_document():
+    doc = _render((0, 0, 200, 150))
+    svg = doc.find('svg')
+
+    assert (float(svg['width']), float(svg['height'])) == (200, 150)
+    assert svg['viewBox'] == '0 0 200 150'
+
+    # Only the room near the region is drawn
+    floor = doc.find(id='clip-path-floor-path')['d']
+    assert '120' in floor
+    assert '700' not in floor
+
+
+def test_scaled_region():
+    doc = _render((0, 0, 200, 150), scale=0.5)
+    svg = doc.find('svg')
+
+    assert (float(svg['width']), float(svg['height'])) == (100, 75)
+    assert svg['viewBox'] == '0 0 200 150'
+
+
+@pytest.mark.parametrize('shading', ['filter', 'baked'])
+def test_wall_only_region(shading):
+    if shading == 'baked':
+        pytest.importorskip('numpy')
+
+    # Nothing but wall, even with the padding for the shading
+    doc = _render((300, 200, 100, 100), shading=shading)
+
+    clip = doc.find(id='clip-path-room-path')['d']
+
+    assert doc.find(id='clip-path-floor-path')['d'] == ''
+    assert doc.find(id='clip-path-floor-path-inverted')['d'] == clip
+    assert float(doc.find('svg')['width']) == 100
+
+
+def test_padding_is_clipped_to_the_map():
+    doc = _render((0, 0, 50, 50))
+    padding = excavate.shading_padding(TILE_SIZE)
+    filter_tag = doc.find(id='wall-boundary-filter')
+
+    assert float(filter_tag['x']) == -padding
+    assert float(filter_tag['width']) == 50 + 2 * padding
+    # The clip path doesn't go off the map
+    assert doc.find(id='clip-path-room-path')['d'].startswith('m 0 0 ')
+
+
+@pytest.mark.parametrize('size', [(0, 10), (10, -1)])
+def test_empty_region(size):
+    with pytest.raises(ValueError, match='positive size'):
+        _render((0, 0) + size)
+
+
+@pytest.mark.parametrize('region, scale', [
+    ((10.5, 20.25, 101.5, 50.25), 1.0),
+    ((0.5, 0.5, 1, 1), 1.0),
+    ((10.3, 20.7, 60, 40), 0.25),
+])
+def test_baked_shading_covers_the_region(region, scale):
+    pytest.importorskip('numpy')
+
+    doc = _render(region, shading='baked', scale=scale)
+    image = doc.find(id='image-wall-shading')
+    x, y, width, height = region
+
+    # The pixels start where the region's do, and reach past its far edges
+    assert float(image['x']) == pytest.approx(x)
+    assert float(image['y']) == pytest.approx(y)
+    assert float(image['x']) + float(image['width']) >= x + width
+    assert float(image['y']) + float(image['height']) >= y + height
+    assert float(image['width']) * scale == pytest.approx(
+        round(float(image['width']) * scale)
+    )
+
+
+def test_big_texture_is_cut_down_to_the_region():
+    output = BytesIO()
+    Image.new('RGB', (300, 300), (10, 20, 30)).save(output, 'PNG')
+
+    data, _ = excavate.render_region(
+        120,
+        130,
+        50,
+        40,
+        _prepared(),
+        output.getvalue(),
+        _texture((40, 50, 60)),
+        TILE_SIZE,
+        'svg'
+    )
+    doc = bs4.BeautifulSoup(data, 'xml')
+
+    # Drawn once, where the region is, and only as big as it
+    image = doc.find(id='image-ground')
+    uses = doc.find(id='layer-ground').find_all('use')
+
+    assert (float(image['width']), float(image['height'])) == (50, 40)
+    assert [(use['x'], use['y']) for use in uses] == [('120', '130')]
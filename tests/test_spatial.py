@@ -0,0 +1,122 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for dumat.spatial. """
+import random
+
+import pytest
+
+from dumat import bezmisc, cubicsuperpath
+from dumat.spatial import (
+    GridIndex,
+    bbox_intersects,
+    segment_bbox,
+    subpath_bbox,
+    union_bbox,
+)
+
+# How many points along a curve to check against its bounding box
+SAMPLES = 200
+
+
+@pytest.mark.parametrize('d', [
+    'M 0,0 C 0,10 20,-10 20,0',
+    'M 5,5 C 40,-20 -30,-20 10,5',
+    'M 0,0 C 30,30 -10,30 20,0',
+    'M 0,0 Q 10,20 20,0',
+    'M 3,7 L 12,-4',
+])
+def test_segment_bbox_is_tight(d):
+    sp1, sp2 = cubicsuperpath.parsePath(d)[0]
+    bez = (sp1[1], sp1[2], sp2[0], sp2[1])
+
+    x0, y0, x1, y1 = segment_bbox(sp1, sp2)
+    points = [bezmisc.bezierpointatt(bez, t / SAMPLES) for t in range(SAMPLES + 1)]
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+
+    # Contains every point on the curve...
+    assert x0 <= min(xs) + 1e-9 and max(xs) <= x1 + 1e-9
+    assert y0 <= min(ys) + 1e-9 and max(ys) <= y1 + 1e-9
+
+    # ...and no more than that
+    assert (x0, y0, x1, y1) == pytest.approx((min(xs), min(ys), max(xs), max(ys)), abs=0.01)
+
+
+def test_segment_bbox_random_curves():
+    rng = random.Random(1)
+
+    for _ in range(100):
+        nodes = [[rng.uniform(-50, 50), rng.uniform(-50, 50)] for _ in range(4)]
+        sp1 = [nodes[0], nodes[0], nodes[1]]
+        sp2 = [nodes[2], nodes[3], nodes[3]]
+        bez = (sp1[1], sp1[2], sp2[0], sp2[1])
+
+        x0, y0, x1, y1 = segment_bbox(sp1, sp2)
+
+        for t in range(SAMPLES + 1):
+            x, y = bezmisc.bezierpointatt(bez, t / SAMPLES)
+            assert x0 - 1e-9 <= x <= x1 + 1e-9
+            assert y0 - 1e-9 <= y <= y1 + 1e-9
+
+
+def test_subpath_bbox():
+    subpath = cubicsuperpath.parsePath('M 10,10 L 20,10 C 30,10 30,20 20,20 Z')[0]
+
+    assert subpath_bbox(subpath) == pytest.approx((10, 10, 27.5, 20))
+    assert subpath_bbox(subpath[:1]) == (10, 10, 10, 10)
+
+
+def test_union_and_intersects():
+    assert union_bbox([(0, 0, 1, 1), (5, -2, 6, 0)]) == (0, -2, 6, 1)
+
+    assert bbox_intersects((0, 0, 2, 2), (1, 1, 3, 3))
+    assert bbox_intersects((0, 0, 2, 2), (2, 0, 3, 1))
+    assert not bbox_intersects((0, 0, 2, 2), (2.5, 0, 3, 1))
+
+
+def test_grid_index_matches_brute_force():
+    rng = random.Random(2)
+    bboxes = []
+    for _ in range(300):
+        x, y = rng.uniform(0, 1000), rng.uniform(0, 1000)
+        bboxes.append((x, y, x + rng.uniform(0, 60), y + rng.uniform(0, 60)))
+
+    index = GridIndex(GridIndex.auto_cell_size(bboxes))
+    for bbox in bboxes:
+        index.insert(bbox)
+
+    for _ in range(100):
+        x, y = rng.uniform(-100, 1000), rng.uniform(-100, 1000)
+        size = rng.choice((5, 50, 500, 2000))
+        region = (x, y, x + size, y + size)
+
+        expected = [
+            number for number, bbox in enumerate(bboxes)
+            if bbox_intersects(bbox, region)
+        ]
+
+        assert index.query(region) == expected
+
+
+def test_grid_index_from_csp():
+    p = cubicsuperpath.parsePath(
+        'M 0,0 L 10,0 L 10,10 Z M 100,100 L 110,100 L 110,110 Z'
+    )
+    index = GridIndex.from_csp(p)
+
+    assert index.query((-5, -5, 5, 5)) == [0]
+    assert index.query((105, 105, 200, 200)) == [1]
+    assert index.query((20, 20, 90, 90)) == []
@@ -0,0 +1,115 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for overlapping the stages of a render in dumat.excavate. """
+from io import BytesIO
+import threading
+
+import pytest
+
+from dumat import excavate
+
+Image = pytest.importorskip('PIL.Image')
+pytest.importorskip('bs4')
+
+FLOOR = 'M 20,20 L 120,20 L 120,100 L 20,100 Z'
+
+# The size of the bitmap floorplan
+WIDTH = 200
+HEIGHT = 150
+
+
+def _png(size, colour):
+    output = BytesIO()
+    Image.new('RGB', size, colour).save(output, 'PNG')
+    return output.getvalue()
+
+
+class FakeTrace(object):
+    """
+    Stands in for tracing (which needs 'potrace'), returning a fixed path and
+    recording the thread each trace ran on.
+    """
+
+    def __init__(self):
+        self.size = (float(WIDTH), float(HEIGHT))
+        self.threads = []
+
+    def __call__(self, image_data, tolerance, min_area, report):
+        self.threads.append(threading.current_thread())
+        return (FLOOR,) + self.size
+
+
+@pytest.fixture
+def trace(monkeypatch):
+    fake = FakeTrace()
+    monkeypatch.setattr(excavate, 'extract_image_path', fake)
+    return fake
+
+
+def _render(**kwargs):
+    data, mime_type = excavate.render_room(
+        # Bigger than the map, so that the textures are cropped to its size
+        _png((300, 300), (10, 20, 30)),
+        _png((300, 300), (40, 50, 60)),
+        _png((WIDTH, HEIGHT), (255, 255, 255)),
+        10,
+        'svg',
+        seed=1,
+        **kwargs
+    )
+
+    assert mime_type == 'image/svg+xml'
+    return data
+
+
+def test_bitmap_size():
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg"/>'
+
+    assert excavate.bitmap_size(_png((30, 20), (0, 0, 0))) == (30.0, 20.0)
+    assert excavate.bitmap_size(svg) is None
+    assert excavate.bitmap_size(b'not an image') is None
+
+
+def test_trace_runs_on_another_thread(trace):
+    _render()
+
+    assert len(trace.threads) == 1
+    assert trace.threads[0] is not threading.main_thread()
+
+
+def test_concurrent_render_matches_serial(trace):
+    concurrent = _render()
+
+    # Tracking memory keeps the stages apart
+    serial = _render(track_memory=True)
+
+    assert trace.threads[1] is threading.main_thread()
+    assert concurrent == serial
+
+
+def test_textures_prepared_again_for_traced_size(trace):
+    # Tracing came up with a different size than the bitmap's
+    trace.size = (float(WIDTH + 50), float(HEIGHT))
+
+    assert _render() == _render(track_memory=True)
+
+
+def test_concurrent_render_report(trace):
+    report = {}
+
+    _render(report=report)
+
+    assert report['texture_bytes'] > 0
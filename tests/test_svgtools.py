@@ -0,0 +1,256 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for dumat.svgtools. """
+import io
+import math
+import random
+
+import pytest
+
+from dumat import bezmisc, cubicsuperpath, svgtools
+
+
+def _line_node(x, y):
+    return [[x, y], [x, y], [x, y]]
+
+
+def test_point_line_distance():
+    assert svgtools.point_line_distance((5, 3), (0, 0), (10, 0)) == pytest.approx(3)
+    # A degenerate line is a point
+    assert svgtools.point_line_distance((3, 4), (0, 0), (0, 0)) == pytest.approx(5)
+
+
+def test_douglas_peucker_keeps_ends():
+    assert svgtools.douglas_peucker([(0, 0), (1, 0.1), (2, 0)], 0.5) == [0, 2]
+    assert svgtools.douglas_peucker([(0, 0), (5, 5)], 0.5) == [0, 1]
+
+
+def test_douglas_peucker_keeps_corners():
+    points = [(0, 0), (5, 0.2), (10, 0), (10, 5), (10.1, 10), (10, 15)]
+
+    assert svgtools.douglas_peucker(points, 0.5) == [0, 2, 5]
+    assert svgtools.douglas_peucker(points, 0.05) == [0, 1, 2, 4, 5]
+    assert svgtools.douglas_peucker(points, 0) == [0, 1, 2, 3, 4, 5]
+
+
+def test_douglas_peucker_within_tolerance():
+    points = [(x, (x * 7919 % 13) / 13.0) for x in range(50)]
+    tolerance = 0.4
+
+    kept = svgtools.douglas_peucker(points, tolerance)
+
+    # Every dropped point is within the tolerance of the line replacing it
+    for first, last in zip(kept, kept[1:]):
+        for index in range(first + 1, last):
+            assert svgtools.point_line_distance(
+                points[index], points[first], points[last]
+            ) <= tolerance
+
+
+def test_simplify_straight_run():
+    subpath = [_line_node(x, 0.05 * (x % 2)) for x in range(11)]
+
+    simplified = svgtools.simplify_csp([subpath], 0.1)
+
+    assert simplified == [[_line_node(0, 0), _line_node(10, 0)]]
+
+
+def test_simplify_leaves_curves():
+    p = cubicsuperpath.parsePath('M 0,0 L 10,0 L 20,0 C 30,0 30,10 20,10 L 0,10 Z')
+
+    simplified = svgtools.simplify_csp(p, 0.5)
+
+    # The straight run along the top is merged, the curve is untouched
+    assert [node[1] for node in simplified[0]] == [[0, 0], [20, 0], [20, 10], [0, 10], [0, 0]]
+    assert simplified[0][1][2] == [30, 0]
+    assert simplified[0][2][0] == [30, 10]
+
+
+def test_simplify_zero_tolerance():
+    p = cubicsuperpath.parsePath('M 0,0 L 10,0 L 20,0 L 20,10 Z')
+
+    assert svgtools.simplify_csp(p, 0) == p
+
+
+def test_simplify_drops_specks():
+    p = cubicsuperpath.parsePath(
+        'M 0,0 L 100,0 L 100,100 L 0,100 Z M 200,200 L 202,200 L 202,202 Z'
+    )
+
+    simplified = svgtools.simplify_csp(p, 0, min_area=4)
+
+    assert len(simplified) == 1
+    assert svgtools.subpath_area(simplified[0]) == pytest.approx(10000)
+
+
+def test_subpath_area_sign():
+    clockwise = cubicsuperpath.parsePath('M 0,0 L 0,10 L 10,10 L 10,0 Z')[0]
+    anticlockwise = cubicsuperpath.parsePath('M 0,0 L 10,0 L 10,10 L 0,10 Z')[0]
+
+    assert svgtools.subpath_area(clockwise) == pytest.approx(-100)
+    assert svgtools.subpath_area(anticlockwise) == pytest.approx(100)
+
+
+def test_subpath_area_of_curves():
+    # A circle of radius 10 from four arcs (the usual bezier approximation)
+    k = 10 * 0.5522847498
+    circle = cubicsuperpath.parsePath(
+        'M 10,0 C 10,{0} {0},10 0,10 C -{0},10 -10,{0} -10,0 '
+        'C -10,-{0} -{0},-10 0,-10 C {0},-10 10,-{0} 10,0 Z'.format(k)
+    )[0]
+
+    assert svgtools.subpath_area(circle) == pytest.approx(math.pi * 100, rel=1e-3)
+
+
+def test_simplify_keeps_curved_rooms():
+    # Their nodes enclose no area at all: a two-node oval, and a triangle
+    # made of one quadratic curve and a straight line back
+    oval = 'M 0,0 C 0,40 60,40 60,0 C 60,-40 0,-40 0,0 Z'
+    triangle = 'M 100,0 Q 130,60 160,0 Z'
+    p = cubicsuperpath.parsePath(oval + ' ' + triangle)
+
+    assert [svgtools.subpath_area(subpath) for subpath in p] == pytest.approx(
+        [-2880, -1200]
+    )
+    assert len(svgtools.simplify_csp(p, 0, min_area=100)) == 2
+
+
+def test_segment_kind():
+    line, quadratic, cubic = (
+        cubicsuperpath.parsePath(d)[0] for d in (
+            'M 0,0 L 10,5',
+            'M 0,0 Q 10,20 20,0',
+            'M 0,0 C 0,10 20,-10 20,0',
+        )
+    )
+
+    assert svgtools.segment_kind(*line) == 'L'
+    assert svgtools.segment_kind(*quadratic) == 'Q'
+    assert svgtools.segment_kind(*cubic) == 'C'
+
+
+@pytest.mark.parametrize('d', [
+    'M 0,0 Q 10,20 20,0',
+    'M 3,4 Q 50,-10 12,30',
+    'M 0,0 Q 100,1 200,0',
+])
+def test_quadratic_length_matches_numeric(d):
+    sp1, sp2 = cubicsuperpath.parsePath(d)[0]
+    bez = (sp1[1], sp1[2], sp2[0], sp2[1])
+
+    exact = svgtools.quadratic_length(svgtools.quadratic_coefficients(sp1, sp2))
+
+    assert exact == pytest.approx(bezmisc.bezierlength(bez, 1e-6), rel=1e-4)
+
+
+@pytest.mark.parametrize('d', ['M 0,0 L 30,40', 'M 0,0 Q 10,20 20,0'])
+def test_split_at_length_halves(d):
+    sp1, sp2 = cubicsuperpath.parsePath(d)[0]
+    total = svgtools.cspseglength(sp1, sp2)
+
+    first, middle, last = svgtools.cspbezsplitatlength(sp1, sp2, 0.5)
+
+    assert svgtools.cspseglength(first, middle) == pytest.approx(total / 2, rel=1e-3)
+    assert svgtools.cspseglength(middle, last) == pytest.approx(total / 2, rel=1e-3)
+    # Lines and quadratics stay lines and quadratics when split
+    assert svgtools.segment_kind(first, middle) == svgtools.segment_kind(sp1, sp2)
+
+
+STREAMED = 'M 0,0 L 40,0 C 60,0 60,30 40,30 L 0,30 Z M 100,100 Q 120,80 140,100 Z'
+
+
+def test_streamed_parse_and_format():
+    assert list(cubicsuperpath.iterParsePath(STREAMED)) == cubicsuperpath.parsePath(STREAMED)
+
+    p = cubicsuperpath.parsePath(STREAMED)
+    sink = io.StringIO()
+    cubicsuperpath.writePath(iter(p), sink, terminate=True)
+
+    assert sink.getvalue() == cubicsuperpath.formatPath(p, terminate=True)
+
+
+def test_stream_path_matches_whole_path():
+    sink = io.StringIO()
+    svgtools.stream_path(
+        STREAMED,
+        sink,
+        transform='translate(5,7) scale(2)',
+        max_length=8,
+        jitter_radius=2,
+        rng=random.Random(4)
+    )
+
+    p = cubicsuperpath.parsePath(STREAMED)
+    svgtools.applyTransformToPath(svgtools.parseTransform('translate(5,7) scale(2)'), p)
+    p = svgtools.add_nodes_to_csp(p, 'adaptive', max_length=8)
+    svgtools.jitter_csp(p, True, True, 2, 2, False, random.Random(4))
+
+    assert sink.getvalue() == cubicsuperpath.formatPath(p)
+
+
+def test_sinks_match_returned_path():
+    sink = io.StringIO()
+    svgtools.add_nodes_to_path(STREAMED, 'bymax', max_length=5, sink=sink)
+    assert sink.getvalue() == svgtools.add_nodes_to_path(STREAMED, 'bymax', max_length=5)
+
+    sink = io.StringIO()
+    svgtools.fuseTransform('rotate(30)', STREAMED, sink=sink)
+    assert sink.getvalue() == svgtools.fuseTransform('rotate(30)', STREAMED)
+
+    # jitter_nodes() uses the global random generator
+    sink = io.StringIO()
+    random.seed(1)
+    svgtools.jitter_nodes(STREAMED, radiusx=3, radiusy=3, sink=sink)
+    random.seed(1)
+    assert sink.getvalue() == svgtools.jitter_nodes(STREAMED, radiusx=3, radiusy=3)
+
+
+def _segment_count(p):
+    return sum(len(subpath) - 1 for subpath in p)
+
+
+def test_add_nodes_adaptive_straight():
+    p = [[_line_node(0, 0), _line_node(20, 0)]]
+
+    p = svgtools.add_nodes_to_csp(p, 'adaptive', max_length=5)
+
+    # Straight segments are split as they would be by length
+    assert _segment_count(p) == 4
+    assert [node[1][0] for node in p[0]] == pytest.approx([0, 5, 10, 15, 20])
+    assert all(node[1][1] == 0 for node in p[0])
+
+
+def test_add_nodes_adaptive_bends():
+    def split(path, curvature=1.0):
+        return svgtools.add_nodes_to_csp(
+            cubicsuperpath.parsePath(path),
+            'adaptive',
+            max_length=5,
+            curvature=curvature
+        )
+
+    straight = split('M 0,0 L 20,0')
+    curved = split('M 0,0 C 0,10 20,10 20,0')
+    flat = split('M 0,0 C 0,10 20,10 20,0', curvature=0)
+
+    # Bends get more nodes than their length alone would need
+    assert _segment_count(curved) > _segment_count(flat)
+    assert _segment_count(curved) > _segment_count(straight)
+
+    # The split curve still runs through the same points
+    for node in curved[0]:
+        x, y = node[1]
+        assert 0 <= x <= 20 and 0 <= y <= 7.5 + 1e-9
@@ -0,0 +1,147 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for dumat.textures. """
+from io import BytesIO
+
+import pytest
+
+from dumat import textures
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    textures.clear_cache()
+    yield
+    textures.clear_cache()
+
+
+def _encode(size, format='PNG', mode='RGB'):
+    output = BytesIO()
+    Image.new(mode, size, (10, 20, 30)).save(output, format)
+    return output.getvalue()
+
+
+def test_image_mime_type():
+    assert textures.image_mime_type(_encode((4, 4))) == 'image/png'
+    assert textures.image_mime_type(_encode((4, 4), 'JPEG')) == 'image/jpeg'
+    assert textures.image_mime_type(_encode((4, 4), 'GIF', 'P')) == 'image/gif'
+    assert textures.image_mime_type(b'RIFF\0\0\0\0WEBPVP8 ') == 'image/webp'
+    assert textures.image_mime_type(b'<svg/>') == 'application/octet-stream'
+
+
+def test_png_size():
+    assert textures.png_size(_encode((37, 11))) == (37, 11)
+    assert textures.png_size(_encode((37, 11), 'JPEG')) is None
+
+
+def test_small_texture_is_embedded_as_is():
+    data = _encode((50, 40))
+
+    prepared, mime_type, size, origin = textures.prepare_texture(
+        data,
+        (100, 100)
+    )
+
+    assert prepared is data
+    assert (mime_type, size, origin) == ('image/png', (50, 40), (None, None))
+
+
+def test_big_texture_is_cropped():
+    data = _encode((300, 200), 'JPEG')
+
+    prepared, mime_type, size, _ = textures.prepare_texture(data, (120.5, 80))
+
+    assert mime_type == 'image/jpeg'
+    assert size == (121, 80)
+    assert Image.open(BytesIO(prepared)).size == (121, 80)
+
+
+def test_scaled_texture_is_downsampled():
+    data = _encode((200, 100))
+
+    prepared, _, size, _ = textures.prepare_texture(data, (400, 400), scale=0.25)
+
+    # The size is still in map px, but the image has fewer pixels
+    assert size == (200, 100)
+    assert Image.open(BytesIO(prepared)).size == (50, 25)
+
+
+def test_texture_format():
+    data = _encode((20, 20))
+
+    prepared, mime_type, _, _ = textures.prepare_texture(data, (100, 100), format='jpg')
+
+    assert mime_type == 'image/jpeg'
+    assert textures.image_mime_type(prepared) == 'image/jpeg'
+
+
+def test_prepared_textures_are_cached():
+    data = _encode((300, 200))
+
+    first = textures.prepare_texture(data, (100, 100))
+    second = textures.prepare_texture(bytearray(data), (100, 100))
+    other = textures.prepare_texture(data, (100, 50))
+
+    assert second is first
+    assert other is not first
+
+
+def test_unknown_format_is_reencoded_as_png():
+    data = _encode((30, 20), 'TIFF')
+    assert textures.image_mime_type(data) == textures.UNKNOWN_MIME_TYPE
+
+    prepared, mime_type, size, _ = textures.prepare_texture(data, (100, 100))
+
+    assert mime_type == 'image/png'
+    assert textures.png_size(prepared) == (30, 20)
+    assert size == (30, 20)
+
+
+def test_unreadable_texture():
+    with pytest.raises(ValueError, match="isn't a readable image"):
+        textures.prepare_texture(b'not an image at all', (100, 100))
+
+
+def test_texture_window():
+    window = textures.texture_window
+
+    # Shorter than the texture across, but not down
+    assert window((100, 50), (400, 400), (130.5, 0, 170, 60)) == ((130, 40), None)
+    # Clipped to the map first
+    assert window((100, 100), (150, 150), (120, 120, 200, 200)) == ((120, 30),) * 2
+    assert window((100, 100), (400, 400), (0, 0, 400, 400)) == (None, None)
+
+
+def test_texture_is_cut_down_to_the_region():
+    # Each column is a different shade, so the part that was kept can be told
+    image = Image.new('L', (100, 20))
+    image.putdata([x for _ in range(20) for x in range(100)])
+    output = BytesIO()
+    image.save(output, 'PNG')
+
+    prepared, _, size, origin = textures.prepare_texture(
+        output.getvalue(),
+        (400, 400),
+        region=(270, 0, 330, 40)
+    )
+    kept = Image.open(BytesIO(prepared)).convert('L')
+
+    # Map x 270 is texture x 70, and the 60 px from there wrap around
+    assert origin == (270, None)
+    assert size == kept.size == (60, 20)
+    assert [kept.getpixel((x, 0)) for x in (0, 29, 30, 59)] == [70, 99, 0, 29]
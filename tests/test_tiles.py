@@ -0,0 +1,240 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+""" Tests for the tile pyramid layout in dumat.tiles. """
+from io import BytesIO
+import os
+
+import pytest
+
+from dumat import cubicsuperpath, excavate, tiles
+from dumat.floorplan import PreparedFloorplan
+
+
+def test_level_count():
+    assert tiles.level_count(1, 1) == 1
+    assert tiles.level_count(2, 1) == 2
+    assert tiles.level_count(1000, 600) == 11
+    assert tiles.level_count(1024, 1024) == 11
+    assert tiles.level_count(1025, 10) == 12
+
+
+def test_level_size():
+    levels = tiles.level_count(1000, 600)
+
+    assert tiles.level_size(1000, 600, levels - 1, levels) == (1000, 600)
+    assert tiles.level_size(1000, 600, levels - 2, levels) == (500, 300)
+    assert tiles.level_size(1000, 600, levels - 4, levels) == (125, 75)
+    assert tiles.level_size(1000, 600, 0, levels) == (1, 1)
+
+
+def test_tile_grid_and_boxes():
+    size = (600, 300)
+
+    assert tiles.tile_grid(size, 256) == (3, 2)
+    assert tiles.tile_box(0, 0, size, 256) == (0, 0, 256, 256)
+    assert tiles.tile_box(2, 1, size, 256) == (512, 256, 88, 44)
+
+    # The tiles cover the level exactly
+    columns, rows = tiles.tile_grid(size, 256)
+    area = sum(
+        width * height
+        for column in range(columns)
+        for row in range(rows)
+        for _, _, width, height in [tiles.tile_box(column, row, size, 256)]
+    )
+    assert area == size[0] * size[1]
+
+
+def test_tile_path():
+    assert tiles.tile_path('map_files', 3, 1, 2, 'png') == os.path.join(
+        'map_files', '3', '1_2.png'
+    )
+
+
+def test_is_wall_only():
+    prepared = PreparedFloorplan(
+        2000,
+        2000,
+        cubicsuperpath.parsePath('M 100,100 L 200,100 L 200,200 L 100,200 Z'),
+        cubicsuperpath.parsePath('M 0,0 L 2000,0 L 2000,2000 L 0,2000 Z')
+    )
+    padding = excavate.shading_padding(20)
+
+    assert not tiles.is_wall_only(prepared, (0, 0, 256, 256), 20)
+    # Near enough for the shading to reach into the tile
+    assert not tiles.is_wall_only(prepared, (200 + padding - 1, 0, 256, 256), 20)
+    assert tiles.is_wall_only(prepared, (200 + padding + 1, 0, 256, 256), 20)
+    assert tiles.is_wall_only(prepared, (1024, 1024, 256, 256), 20)
+
+
+def _fake_render(box, path):
+    # Stands in for rasterising, which needs ImageMagick
+    from PIL import Image
+
+    output = BytesIO()
+    Image.new('RGB', box[2:], (255, 0, 0)).save(output, 'PNG')
+    tiles._write_tile(path, output.getvalue())
+
+
+def _export(tmp_path, monkeypatch, **kwargs):
+    from PIL import Image
+
+    monkeypatch.setattr(tiles, '_render_tile', _fake_render)
+
+    wall = BytesIO()
+    Image.new('RGB', (32, 32), (0, 0, 255)).save(wall, 'PNG')
+
+    prepared = PreparedFloorplan.from_path(
+        'M 20,20 L 80,20 L 80,80 L 20,80 Z',
+        600,
+        300
+    )
+
+    report = {}
+    manifest = tiles.export_tile_pyramid(
+        str(tmp_path / 'map.dzi'),
+        prepared,
+        b'',
+        wall.getvalue(),
+        10,
+        tile_px=128,
+        workers=1,
+        report=report,
+        **kwargs
+    )
+
+    return manifest, report
+
+
+def _tile_files(tmp_path, manifest):
+    for level in range(manifest['levels']):
+        size = tiles.level_size(
+            manifest['width'],
+            manifest['height'],
+            level,
+            manifest['levels']
+        )
+        columns, rows = tiles.tile_grid(size, manifest['tile_px'])
+
+        for row in range(rows):
+            for column in range(columns):
+                path = tiles.tile_path(
+                    str(tmp_path / 'map_files'), level, column, row, 'png'
+                )
+                yield level, (column, row), path
+
+
+def test_wall_only_tiles_are_written(tmp_path, monkeypatch):
+    pytest.importorskip('PIL')
+    from PIL import Image
+
+    manifest, report = _export(tmp_path, monkeypatch)
+    top = str(manifest['levels'] - 1)
+
+    # Every tile in the pyramid exists, wall or not
+    for _, _, path in _tile_files(tmp_path, manifest):
+        assert os.path.exists(path)
+
+    assert report['tiles_rendered'] == 1
+    assert report['tiles_wall'] > 0
+    assert (0, 0) not in manifest['wall_only'][top]
+    assert (4, 2) in manifest['wall_only'][top]
+
+    files_dir = str(tmp_path / 'map_files')
+    path = tiles.tile_path(files_dir, int(top), 4, 2, 'png')
+    with Image.open(path) as image:
+        assert image.size == (600 - 512, 300 - 256)
+        assert image.getpixel((0, 0)) == (0, 0, 255)
+
+
+def test_identical_wall_tiles_are_linked(tmp_path, monkeypatch):
+    pytest.importorskip('PIL')
+
+    manifest, report = _export(tmp_path, monkeypatch)
+    top = manifest['levels'] - 1
+    files_dir = str(tmp_path / 'map_files')
+
+    # Whole tiles line up with the texture, so they are all the same
+    inodes = {
+        os.stat(tiles.tile_path(files_dir, top, column, row, 'png')).st_ino
+        for column, row in [(2, 0), (3, 0), (2, 1), (3, 1)]
+    }
+    assert len(inodes) == 1
+    assert report['tiles_wall_encoded'] < report['tiles_wall']
+
+
+def test_rendering_replaces_links(tmp_path, monkeypatch):
+    pytest.importorskip('PIL')
+
+    manifest, _ = _export(tmp_path, monkeypatch)
+    files_dir = str(tmp_path / 'map_files')
+    top = manifest['levels'] - 1
+    linked = tiles.tile_path(files_dir, top, 3, 0, 'png')
+    before = open(linked, 'rb').read()
+
+    # Rendering a linked tile mustn't write through to the other links
+    _fake_render((0, 0, 128, 128), tiles.tile_path(files_dir, top, 2, 0, 'png'))
+
+    assert open(linked, 'rb').read() == before
+
+
+def test_render_every_tile(tmp_path, monkeypatch):
+    pytest.importorskip('PIL')
+
+    manifest, report = _export(tmp_path, monkeypatch, skip_wall=False)
+
+    assert manifest['wall_only'] == {}
+    assert report['tiles_rendered'] == 5 * 3
+    for _, _, path in _tile_files(tmp_path, manifest):
+        assert os.path.exists(path)
+
+
+def test_textures_given_as_file_names(tmp_path, monkeypatch):
+    from PIL import Image
+
+    seen = []
+
+    def fake_render(box, path):
+        seen.append(tiles._worker_state['wall_data'])
+        _fake_render(box, path)
+
+    wall_path = str(tmp_path / 'wall.png')
+    Image.new('RGB', (32, 32), (0, 0, 255)).save(wall_path)
+    ground_path = str(tmp_path / 'ground.png')
+    Image.new('RGB', (32, 32), (0, 255, 0)).save(ground_path)
+
+    monkeypatch.setattr(tiles, '_render_tile', fake_render)
+
+    prepared = PreparedFloorplan.from_path(
+        'M 20,20 L 80,20 L 80,80 L 20,80 Z',
+        300,
+        200
+    )
+
+    manifest = tiles.export_tile_pyramid(
+        str(tmp_path / 'map.dzi'),
+        prepared,
+        ground_path,
+        wall_path,
+        10,
+        tile_px=128,
+        workers=1
+    )
+
+    # The files are mapped rather than read, and let go of afterwards
+    assert seen and all(isinstance(data, memoryview) for data in seen)
+    assert tiles._worker_state == {}
+    assert manifest['wall_only']
@@ -0,0 +1,165 @@
+# Copyright 2014 Jason Heeris, jason.heeris@gmail.com
+#
+# This file is part of the dungeon excavator ("dumat").
+#
+# Dumat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# Dumat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# dumat. If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for dumat.walls. The grid ray caster is checked against testing every
+ray against every segment.
+"""
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from dumat import bezmisc, cubicsuperpath
+from dumat.floorplan import PreparedFloorplan
+from dumat.walls import WALLS_MAGIC, WallIndex, flatten_walls
+
+
+def brute_force(segments, origins, targets):
+    """ Returns the nearest hit fraction of each ray (inf for none). """
+    fractions = []
+
+    for (px, py), (tx, ty) in zip(origins, targets):
+        rx, ry = tx - px, ty - py
+        best = math.inf
+
+        for x0, y0, x1, y1 in segments:
+            sx, sy = x1 - x0, y1 - y0
+            denominator = rx * sy - ry * sx
+            if denominator == 0:
+                continue
+
+            qx, qy = x0 - px, y0 - py
+            t = (qx * sy - qy * sx) / denominator
+            u = (qx * ry - qy * rx) / denominator
+
+            if 0 <= t <= 1 and 0 <= u <= 1:
+                best = min(best, t)
+
+        fractions.append(best)
+
+    return np.array(fractions)
+
+
+def _random_walls(rng, count, size):
+    starts = rng.uniform(0, size, (count, 2))
+    ends = starts + rng.uniform(-size / 5, size / 5, (count, 2))
+    return np.hstack((starts, ends))
+
+
+@pytest.mark.parametrize('cell_size', [None, 3.0, 17.0, 500.0])
+def test_cast_rays_matches_brute_force(cell_size):
+    rng = np.random.default_rng(5)
+    segments = _random_walls(rng, 150, 200)
+    index = WallIndex(200, 200, segments, cell_size=cell_size)
+
+    # Rays in every direction, some starting or ending outside the map and
+    # some axis aligned
+    origins = rng.uniform(-20, 220, (400, 2))
+    targets = rng.uniform(-20, 220, (400, 2))
+    targets[:20, 0] = origins[:20, 0]
+    targets[20:40, 1] = origins[20:40, 1]
+
+    fractions, hit_segments = index.cast_rays(origins, targets)
+    expected = brute_force(segments, origins, targets)
+
+    np.testing.assert_allclose(fractions, expected, rtol=1e-9)
+    assert ((hit_segments >= 0) == np.isfinite(expected)).all()
+    assert (index.line_of_sight(origins, targets) == np.isinf(expected)).all()
+
+
+def test_hit_points():
+    index = WallIndex(100, 100, [(50, 0, 50, 100)])
+
+    points = index.hit_points([(10, 10), (10, 10)], [(90, 50), (40, 90)])
+
+    np.testing.assert_allclose(points, [(50, 30), (40, 90)])
+
+
+def test_zero_length_ray():
+    index = WallIndex(100, 100, [(50, 0, 50, 100)])
+
+    assert index.line_of_sight([(10, 10)], [(10, 10)]).all()
+
+
+def test_flatten_walls():
+    p = cubicsuperpath.parsePath('M 0,0 L 10,0 C 20,0 20,10 10,10 L 0,10')
+
+    segments, curves, curve_numbers = flatten_walls(p, step=2.0)
+
+    # The curve is split into pieces, and the open subpath is closed
+    assert len(curves) == 1
+    assert (curve_numbers == 0).sum() > 5
+    assert tuple(segments[0]) == (0, 0, 10, 0)
+    assert tuple(segments[-1]) == (0, 10, 0, 0)
+
+    pieces = segments[curve_numbers == 0]
+    assert np.hypot(pieces[:, 2] - pieces[:, 0], pieces[:, 3] - pieces[:, 1]).max() <= 2.0
+
+    # Every piece starts and ends on the curve
+    bez = curves[0]
+    on_curve = [bezmisc.bezierpointatt(bez, t / 1000) for t in range(1001)]
+    for x, y in pieces[:, :2]:
+        assert min(math.hypot(x - cx, y - cy) for cx, cy in on_curve) < 0.05
+
+
+def test_refine_moves_hits_onto_curve():
+    prepared = PreparedFloorplan(
+        100,
+        100,
+        cubicsuperpath.parsePath('M 10,50 C 10,10 90,10 90,50 Z'),
+        []
+    )
+    index = WallIndex.from_floorplan(prepared, step=20.0)
+
+    # Between the ends of the flattened pieces, which are inside the curve
+    origin, target = (37, 40), (37, 0)
+    rough = index.hit_points([origin], [target])[0]
+    refined = index.hit_points([origin], [target], refine=True)[0]
+
+    # Where the curve crosses x = 37 (x increases along it)
+    bez = ((10, 50), (10, 10), (90, 10), (90, 50))
+    low, high = 0.0, 1.0
+    for _ in range(60):
+        middle = (low + high) / 2
+        if bezmisc.bezierpointatt(bez, middle)[0] < 37:
+            low = middle
+        else:
+            high = middle
+    on_curve = bezmisc.bezierpointatt(bez, low)
+
+    assert refined == pytest.approx(on_curve)
+    assert rough[1] > refined[1] + 0.1
+
+
+@pytest.mark.parametrize('name', ['walls.json', 'walls.bin'])
+def test_save_and_load(tmp_path, name):
+    index = WallIndex(120, 80, [(0.5, 1.25, 10, 20), (30, 40, 50.75, 60)])
+    path = str(tmp_path / name)
+
+    index.save(path)
+    loaded = WallIndex.load(path)
+
+    assert (loaded.width, loaded.height) == (120, 80)
+    np.testing.assert_allclose(loaded.segments, index.segments)
+
+    with open(path, 'rb') as source:
+        assert source.read().startswith(WALLS_MAGIC) == name.endswith('.bin')
+
+
+def test_not_a_wall_file():
+    with pytest.raises(ValueError, match='Not a wall segment file'):
+        WallIndex.from_bytes(b'DUMATPF\x02')